@@ -0,0 +1,111 @@
+""" Integration tests for the Bundle resource: creates, updates, and deletes a set
+    of users and a schema in a local database.
+    """
+
+import pytest
+import random
+from unittest.mock import ANY
+
+from cf_postgres import util, itest_helpers
+from cf_postgres.handlers import bundle_handler
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture(scope="module")
+def catalog():
+    with itest_helpers.CatalogInspector() as inspector:
+        yield inspector
+
+
+@pytest.fixture
+def randval():
+    return random.randrange(100000, 999999)
+
+
+@pytest.fixture
+def names(randval):
+    return {
+        "schema":   f"schema_{randval}",
+        "owner":    f"owner_{randval}",
+        "reader":   f"reader_{randval}",
+        }
+
+
+@pytest.fixture
+def props(names):
+    return {
+        "Resource": "Bundle",
+        "Resources": [
+            { "Resource": "Schema", "Name": names["schema"], "Owner": names["owner"], "ReadOnlyUsers": [names["reader"]] },
+            { "Resource": "User",   "Username": names["owner"] },
+            { "Resource": "User",   "Username": names["reader"] },
+            ],
+        }
+
+
+@pytest.fixture
+def response(randval):
+    return {}
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create_and_delete(catalog, names, props, response):
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert bundle_handler.try_handle(conn, "Create", "Bundle", None, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": f"User:{names['owner']},User:{names['reader']},Schema:{names['schema']}",
+                       "Data": ANY,
+                       }
+    assert catalog.role(names["owner"]) != None
+    assert catalog.role(names["reader"]) != None
+    schema_info = catalog.schema(names["schema"])
+    assert schema_info.owner_name == names["owner"]
+    assert names["reader"] in schema_info.permissions
+    physical_id = response["PhysicalResourceId"]
+    response = {}
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert bundle_handler.try_handle(conn, "Delete", "Bundle", physical_id, props, {}, response)
+    assert response["Status"] == "SUCCESS"
+    assert catalog.schema(names["schema"]) == None
+    assert catalog.role(names["owner"]) == None
+    assert catalog.role(names["reader"]) == None
+
+
+def test_partial_failure_rolls_back(catalog, names, props, response):
+    # the schema's grantee doesn't exist, so the schema fails after the users are created
+    props["Resources"][0]["Users"] = [f"{names['reader']}_missing"]
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert bundle_handler.try_handle(conn, "Create", "Bundle", None, props, {}, response)
+    assert response["Status"] == "FAILED"
+    assert f"Schema {names['schema']}" in response["Reason"]
+    assert catalog.schema(names["schema"]) == None
+    assert catalog.role(names["owner"]) == None
+    assert catalog.role(names["reader"]) == None
+
+
+def test_rename_schema_keeps_contents(catalog, randval, names, props, response):
+    props["Resources"][0]["Cascade"] = "true"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert bundle_handler.try_handle(conn, "Create", "Bundle", None, props, {}, response)
+        csr = conn.cursor()
+        csr.execute(f"create table {names['schema']}.t{randval} ( x int not null )")
+        conn.commit()
+    physical_id = response["PhysicalResourceId"]
+    new_props = dict(props, Resources=[dict(props["Resources"][0], Name=f"{names['schema']}_new")] + props["Resources"][1:])
+    response = {}
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert bundle_handler.try_handle(conn, "Update", "Bundle", physical_id, new_props, props, response)
+    assert response["Status"] == "SUCCESS"
+    assert catalog.schema(names["schema"]) == None
+    assert catalog.schema(f"{names['schema']}_new") != None
+    tables = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                                 lambda c: c.execute("select tablename from pg_tables where schemaname = %s", (f"{names['schema']}_new",)))
+    assert [row["tablename"] for row in tables] == [f"t{randval}"]
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert bundle_handler.try_handle(conn, "Delete", "Bundle", physical_id, new_props, {}, {})
+    assert catalog.schema(f"{names['schema']}_new") == None
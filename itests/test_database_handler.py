@@ -0,0 +1,148 @@
+""" Integration tests for the Database resource. ** Does not clean up afterward **
+    """
+
+import pytest
+import random
+from unittest.mock import ANY
+
+from cf_postgres import util, itest_helpers
+from cf_postgres.handlers import database_handler
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture(scope="module")
+def catalog():
+    with itest_helpers.CatalogInspector() as inspector:
+        yield inspector
+
+
+@pytest.fixture
+def randval():
+    return random.randrange(100000, 999999)
+
+
+@pytest.fixture
+def db_name(randval):
+    return f"db_{randval}"
+
+
+@pytest.fixture
+def response(randval):
+    return {}
+
+
+@pytest.fixture
+def db_admin():
+    return itest_helpers.local_pg8000_secret(None)["user"]
+
+
+@pytest.fixture
+def template_name(randval):
+    # creates a template database with a single table
+    name = f"template_{randval}"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        conn.autocommit = True
+        conn.cursor().execute(f"create database {name}")
+    connection_info = itest_helpers.local_pg8000_secret(None)
+    connection_info['database'] = name
+    with util.connect_to_db(connection_info) as conn:
+        csr = conn.cursor()
+        csr.execute("create table example ( id int primary key, value text )")
+        csr.execute("insert into example values (1, 'argle'), (2, 'bargle')")
+        conn.commit()
+    return name
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create_default(catalog, db_admin, db_name, response):
+    props = {
+            "Name":     db_name,
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert database_handler.try_handle(conn, "Create", "Database", None, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": db_name,
+                       "Data": ANY,
+                       }
+    info = catalog.database(db_name)
+    assert info['owner_name'] == db_admin
+    assert info['connection_limit'] == -1
+
+
+def test_create_from_template(catalog, randval, db_name, template_name, response):
+    owner = itest_helpers.create_user(f"user_{randval}")
+    props = {
+            "Name":             db_name,
+            "Template":         template_name,
+            "Owner":            owner,
+            "Encoding":         "UTF8",
+            "ConnectionLimit":  "10",
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert database_handler.try_handle(conn, "Create", "Database", None, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": db_name,
+                       "Data": ANY,
+                       }
+    info = catalog.database(db_name)
+    assert info['owner_name'] == owner
+    assert info['encoding'] == "UTF8"
+    assert info['connection_limit'] == 10
+    connection_info = itest_helpers.local_pg8000_secret(None)
+    connection_info['database'] = db_name
+    rows = util.select_as_dict(connection_info, lambda c: c.execute("select count(*) as count from example"))
+    assert rows[0]['count'] == 2
+
+
+def test_update(catalog, randval, db_admin, db_name, response):
+    create_props = {
+            "Name":             db_name,
+            "ConnectionLimit":  "10",
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert database_handler.try_handle(conn, "Create", "Database", None, create_props, {}, response)
+    owner = itest_helpers.create_user(f"user_{randval}")
+    new_name = "new" + db_name
+    update_props = {
+            "Name":             new_name,
+            "Owner":            owner,
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert database_handler.try_handle(conn, "Update", "Database", db_name, update_props, create_props, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": new_name,
+                       "Data": ANY,
+                       }
+    assert catalog.database(db_name) == None
+    info = catalog.database(new_name)
+    assert info['owner_name'] == owner
+    assert info['connection_limit'] == -1
+    # removing the owner returns the database to the admin user
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert database_handler.try_handle(conn, "Update", "Database", new_name, { "Name": new_name }, update_props, response)
+    assert response["Status"] == "SUCCESS"
+    assert catalog.database(new_name)['owner_name'] == db_admin
+
+
+def test_delete(catalog, db_name, response):
+    props = {
+            "Name":     db_name,
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert database_handler.try_handle(conn, "Create", "Database", None, props, {}, response)
+    assert catalog.database(db_name) != None
+    response.clear()
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert database_handler.try_handle(conn, "Delete", "Database", db_name, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": db_name,
+                       }
+    assert catalog.database(db_name) == None
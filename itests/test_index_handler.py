@@ -0,0 +1,96 @@
+""" Integration tests for the Index resource. ** Does not clean up afterward **
+    """
+
+import pytest
+import random
+from unittest.mock import ANY
+
+from cf_postgres import util, itest_helpers
+from cf_postgres.handlers import index_handler
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def randval():
+    return random.randrange(100000, 999999)
+
+
+@pytest.fixture
+def table_name(randval):
+    # creates a table with some duplicate values
+    name = f"public.t_{randval}"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"create table {name} ( id int not null, value text )")
+        csr.execute(f"insert into {name} select x, 'value ' || (x % 100) from generate_series(1, 1000) x")
+        conn.commit()
+    return name
+
+
+@pytest.fixture
+def index_name(randval):
+    return f"idx_{randval}"
+
+
+@pytest.fixture
+def response(randval):
+    return {}
+
+
+def retrieve_index(index_name):
+    rows = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                               lambda c: c.execute("select i.indisvalid, i.indisunique from pg_index i where i.indexrelid = to_regclass(%s)",
+                                                   (f"public.{index_name}",)))
+    return rows[0] if rows else None
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create_and_delete(table_name, index_name, response):
+    props = {
+            "Name":     index_name,
+            "Table":    table_name,
+            "Columns":  [ "value", "id desc" ],
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert index_handler.try_handle(conn, "Create", "Index", None, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": f"public.{index_name}",
+                       "Data": ANY,
+                       }
+    assert response["Data"]["Table"] == table_name.split(".")[1]
+    assert retrieve_index(index_name) == { "indisvalid": True, "indisunique": False }
+    # creating again verifies the existing index
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert index_handler.try_handle(conn, "Create", "Index", None, props, {}, response)
+    assert response["Status"] == "SUCCESS"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert index_handler.try_handle(conn, "Delete", "Index", f"public.{index_name}", props, {}, response)
+    assert response["Status"] == "SUCCESS"
+    assert retrieve_index(index_name) == None
+
+
+def test_replaces_invalid_index(table_name, index_name, response):
+    props = {
+            "Name":     index_name,
+            "Table":    table_name,
+            "Columns":  [ "value" ],
+            "Unique":   "true",
+            }
+    # the first attempt fails because of duplicates, leaving an invalid index
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert index_handler.try_handle(conn, "Create", "Index", None, props, {}, response)
+    assert response["Status"] == "FAILED"
+    assert retrieve_index(index_name) == { "indisvalid": False, "indisunique": True }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"delete from {table_name} where id > 100")
+        conn.commit()
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert index_handler.try_handle(conn, "Create", "Index", None, props, {}, response)
+    assert response["Status"] == "SUCCESS"
+    assert retrieve_index(index_name) == { "indisvalid": True, "indisunique": True }
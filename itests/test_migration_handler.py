@@ -0,0 +1,102 @@
+""" Integration tests for the Migration resource. ** Does not clean up afterward **
+    """
+
+import pytest
+import random
+
+from cf_postgres import util, itest_helpers
+from cf_postgres.handlers import migration_handler
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def randval():
+    return random.randrange(100000, 999999)
+
+
+@pytest.fixture
+def migration_name(randval):
+    return f"migration_{randval}"
+
+
+@pytest.fixture
+def table_name(randval):
+    return f"migrated_{randval}"
+
+
+@pytest.fixture
+def response(randval):
+    return {}
+
+################################################################################
+## helper functions
+################################################################################
+
+def retrieve_applied_versions(migration_name):
+    rows = util.select_as_dict(
+                itest_helpers.local_pg8000_secret(None),
+                lambda c: c.execute("select version from cf_postgres.migrations where migration_name = %s order by version",
+                                    (migration_name,)))
+    return [row['version'] for row in rows]
+
+
+def retrieve_row_count(table_name):
+    rows = util.select_as_dict(
+                itest_helpers.local_pg8000_secret(None),
+                lambda c: c.execute(f"select count(*) as count from {table_name}"))
+    return rows[0]['count']
+
+################################################################################
+## testcases
+################################################################################
+
+def test_apply_incrementally(migration_name, table_name, response):
+    create_props = {
+            "Name":     migration_name,
+            "Scripts":  [
+                        { "Version": "001", "Sql": f"create table {table_name} ( id int primary key, value text )" },
+                        { "Version": "002", "Sql": f"insert into {table_name} values (1, 'argle;'); insert into {table_name} values (2, $$bargle;$$)" },
+                        ]
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert migration_handler.try_handle(conn, "Create", "Migration", None, create_props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": migration_name,
+                       "Data": { "Version": "002", "AppliedCount": "2" },
+                       }
+    assert retrieve_applied_versions(migration_name) == ["001", "002"]
+    assert retrieve_row_count(table_name) == 2
+    # update adds a script; if the earlier scripts were re-run they'd fail
+    update_props = {
+            "Name":     migration_name,
+            "Scripts":  create_props["Scripts"] + [
+                        { "Version": "003", "Sql": f"create index concurrently {table_name}_idx on {table_name} (value)", "Transactional": "false" },
+                        ]
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert migration_handler.try_handle(conn, "Update", "Migration", migration_name, update_props, create_props, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": migration_name,
+                       "Data": { "Version": "003", "AppliedCount": "1" },
+                       }
+    assert retrieve_applied_versions(migration_name) == ["001", "002", "003"]
+    assert retrieve_row_count(table_name) == 2
+
+
+def test_failed_script_is_not_recorded(migration_name, table_name, response):
+    props = {
+            "Name":     migration_name,
+            "Scripts":  [
+                        { "Version": "001", "Sql": f"create table {table_name} ( id int primary key )" },
+                        { "Version": "002", "Sql": f"insert into {table_name} values (1); insert into {table_name} values (1)" },
+                        ]
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert migration_handler.try_handle(conn, "Create", "Migration", None, props, {}, response)
+    assert response["Status"] == "FAILED"
+    assert retrieve_applied_versions(migration_name) == ["001"]
+    assert retrieve_row_count(table_name) == 0
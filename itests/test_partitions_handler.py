@@ -0,0 +1,78 @@
+""" Integration tests for the Partitions resource. ** Does not clean up afterward **
+    """
+
+import datetime
+import pytest
+import random
+from unittest.mock import ANY
+
+from cf_postgres import util, itest_helpers
+from cf_postgres.handlers import partitions_handler
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def randval():
+    return random.randrange(100000, 999999)
+
+
+@pytest.fixture
+def table_name(randval):
+    name = f"public.events_{randval}"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"create table {name} ( id bigint not null, created timestamptz not null ) partition by range (created)")
+        conn.commit()
+    return name
+
+
+@pytest.fixture
+def response(randval):
+    return {}
+
+
+def retrieve_partitions(table_name):
+    rows = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                               lambda c: c.execute("select inhrelid::regclass::text as name from pg_inherits where inhparent = to_regclass(%s) order by 1",
+                                                   (table_name,)))
+    return [row["name"] for row in rows]
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create_and_expire(monkeypatch, table_name, response):
+    unqualified = table_name.split(".")[1]
+    monkeypatch.setattr(partitions_handler, '_today', lambda: datetime.date(2024, 3, 6))
+    props = {
+            "Table":        table_name,
+            "Interval":     "day",
+            "Lookahead":    "2",
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert partitions_handler.try_handle(conn, "Create", "Partitions", None, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": table_name,
+                       "Data": ANY,
+                       }
+    assert retrieve_partitions(table_name) == [f"{unqualified}_20240306", f"{unqualified}_20240307", f"{unqualified}_20240308"]
+    # inserts land in the partitions
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"insert into {table_name} values (1, '2024-03-06 23:59:59+00'), (2, '2024-03-08 00:00:00+00')")
+        conn.commit()
+    # two days later, the first partition is past retention
+    monkeypatch.setattr(partitions_handler, '_today', lambda: datetime.date(2024, 3, 8))
+    new_props = dict(props, Retention="1")
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert partitions_handler.try_handle(conn, "Update", "Partitions", table_name, new_props, props, response)
+    assert response["Status"] == "SUCCESS"
+    assert retrieve_partitions(table_name) == [f"{unqualified}_20240307", f"{unqualified}_20240308",
+                                               f"{unqualified}_20240309", f"{unqualified}_20240310"]
+    # the detached partition still exists, with its data
+    rows = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                               lambda c: c.execute(f"select id from {table_name}_20240306"))
+    assert rows == [{ "id": 1 }]
@@ -0,0 +1,85 @@
+""" Integration tests for the RoleMembership resource. ** Does not clean up afterward **
+    """
+
+import pytest
+import random
+from unittest.mock import ANY
+
+from cf_postgres import util, itest_helpers
+from cf_postgres.handlers import role_membership_handler
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture(scope="module")
+def catalog():
+    with itest_helpers.CatalogInspector() as inspector:
+        yield inspector
+
+
+@pytest.fixture
+def randval():
+    return random.randrange(100000, 999999)
+
+
+@pytest.fixture
+def role_name(randval):
+    return itest_helpers.create_user(f"group_{randval}")
+
+
+@pytest.fixture
+def members(randval):
+    return [itest_helpers.create_user(f"user_{randval}_{x}") for x in range(4)]
+
+
+@pytest.fixture
+def response(randval):
+    return {}
+
+################################################################################
+## testcases
+################################################################################
+
+def test_lifecycle(catalog, role_name, members, response):
+    create_props = {
+            "Role":     role_name,
+            "Members":  members[0:3],
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert role_membership_handler.try_handle(conn, "Create", "RoleMembership", None, create_props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": role_name,
+                       "Data": ANY,
+                       }
+    assert catalog.role_members(role_name) == set(members[0:3])
+    update_props = {
+            "Role":     role_name,
+            "Members":  members[1:4],
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert role_membership_handler.try_handle(conn, "Update", "RoleMembership", role_name, update_props, create_props, response)
+    assert response["Status"] == "SUCCESS"
+    assert catalog.role_members(role_name) == set(members[1:4])
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert role_membership_handler.try_handle(conn, "Delete", "RoleMembership", role_name, update_props, {}, response)
+    assert response["Status"] == "SUCCESS"
+    assert catalog.role_members(role_name) == set()
+
+
+def test_unmanaged_members_retained(catalog, role_name, members, response):
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"grant {role_name} to {members[3]}")
+        conn.commit()
+    props = {
+            "Role":     role_name,
+            "Members":  members[0:2],
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert role_membership_handler.try_handle(conn, "Create", "RoleMembership", None, props, {}, response)
+    assert catalog.role_members(role_name) == set([members[0], members[1], members[3]])
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert role_membership_handler.try_handle(conn, "Delete", "RoleMembership", role_name, props, {}, response)
+    assert catalog.role_members(role_name) == set([members[3]])
@@ -13,6 +13,12 @@ from cf_postgres.handlers import schema_handler
 ## fixtures
 ################################################################################
 
+@pytest.fixture(scope="module")
+def catalog():
+    with itest_helpers.CatalogInspector() as inspector:
+        yield inspector
+
+
 @pytest.fixture
 def randval():
     return random.randrange(100000, 999999)
@@ -66,18 +72,18 @@ PERM_TYPE_USAGE         = itest_helpers.Permission('USAGE',       'T', False)
 ## helper functions
 ################################################################################
 
-def assert_schema(schema_name, owner_name, privs_by_grantee, default_privs):
-    info = itest_helpers.retrieve_schema_info(schema_name)
-    assert len(info) == 1
-    assert info[0]["owner_name"] == owner_name
-    assert itest_helpers.retrieve_schema_permissions(schema_name) == privs_by_grantee
-    assert itest_helpers.retrieve_default_schema_permissions(schema_name) == default_privs
+def assert_schema(catalog, schema_name, owner_name, privs_by_grantee, default_privs):
+    state = catalog.schema(schema_name)
+    assert state != None
+    assert state.owner_name == owner_name
+    assert state.permissions == privs_by_grantee
+    assert state.default_permissions == default_privs
 
 ################################################################################
 ## Testcases
 ################################################################################
 
-def test_create_default_owner_no_explicit_acls(db_admin, schema_name, response):
+def test_create_default_owner_no_explicit_acls(catalog, db_admin, schema_name, response):
     props = {
             "Name":     schema_name,
             }
@@ -86,11 +92,12 @@ def test_create_default_owner_no_explicit_acls(db_admin, schema_name, response):
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
+                       "Data": ANY,
                        }
-    assert_schema(schema_name, db_admin,  {}, {})    # grants are blank until first explicit grant
+    assert_schema(catalog, schema_name, db_admin,  {}, {})    # grants are blank until first explicit grant
 
 
-def test_create_default_owner_public_access(db_admin, schema_name, response):
+def test_create_default_owner_public_access(catalog, db_admin, schema_name, response):
     props = {
             "Name":     schema_name,
             "Public":   "true",
@@ -100,8 +107,9 @@ def test_create_default_owner_public_access(db_admin, schema_name, response):
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
+                       "Data": ANY,
                        }
-    assert_schema(schema_name, db_admin,
+    assert_schema(catalog, schema_name, db_admin,
                   {
                       db_admin: set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),   # adding any grants adds owner grant
                       "PUBLIC": set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),
@@ -117,7 +125,7 @@ def test_create_default_owner_public_access(db_admin, schema_name, response):
                   })
 
 
-def test_create_default_owner_public_readonly_access(db_admin, schema_name, response):
+def test_create_default_owner_public_readonly_access(catalog, db_admin, schema_name, response):
     props = {
             "Name":     schema_name,
             "ReadOnly":   "true",
@@ -127,8 +135,9 @@ def test_create_default_owner_public_readonly_access(db_admin, schema_name, resp
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
+                       "Data": ANY,
                        }
-    assert_schema(schema_name, db_admin,
+    assert_schema(catalog, schema_name, db_admin,
                   {
                       db_admin: set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),   # adding any grants adds owner grant
                       "PUBLIC": set([PERM_SCHEMA_USAGE]),
@@ -142,7 +151,7 @@ def test_create_default_owner_public_readonly_access(db_admin, schema_name, resp
                   })
 
 
-def test_create_default_owner_explicit_user_acls(randval, db_admin, schema_name, response):
+def test_create_default_owner_explicit_user_acls(catalog, randval, db_admin, schema_name, response):
     user_1 = itest_helpers.create_user(f"user_{randval}_1")
     user_2 = itest_helpers.create_user(f"user_{randval}_2")
     props = {
@@ -155,8 +164,9 @@ def test_create_default_owner_explicit_user_acls(randval, db_admin, schema_name,
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
+                       "Data": ANY,
                        }
-    assert_schema(schema_name, db_admin,
+    assert_schema(catalog, schema_name, db_admin,
                   {
                       db_admin: set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),
                       user_1:   set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),
@@ -177,7 +187,7 @@ def test_create_default_owner_explicit_user_acls(randval, db_admin, schema_name,
                   })
 
 
-def test_create_default_owner_mixed_public_and_user_acls(randval, db_admin, schema_name, response):
+def test_create_default_owner_mixed_public_and_user_acls(catalog, randval, db_admin, schema_name, response):
     user_1 = itest_helpers.create_user(f"user_{randval}_1")
     user_2 = itest_helpers.create_user(f"user_{randval}_2")
     props = {
@@ -191,8 +201,9 @@ def test_create_default_owner_mixed_public_and_user_acls(randval, db_admin, sche
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
+                       "Data": ANY,
                        }
-    assert_schema(schema_name, db_admin,
+    assert_schema(catalog, schema_name, db_admin,
                   {
                       db_admin: set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),
                       "PUBLIC": set([PERM_SCHEMA_USAGE]),
@@ -219,7 +230,7 @@ def test_create_default_owner_mixed_public_and_user_acls(randval, db_admin, sche
 
 
 # we'll just verify that we can specify owner; the ACLs are handled separately so no need to replicate above tests
-def test_create_explicit_owner_no_explicit_acls(randval, schema_name, response):
+def test_create_explicit_owner_no_explicit_acls(catalog, randval, schema_name, response):
     owner = itest_helpers.create_user(f"user_{randval}_0")
     props = {
             "Name":     schema_name,
@@ -230,29 +241,31 @@ def test_create_explicit_owner_no_explicit_acls(randval, schema_name, response):
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
+                       "Data": ANY,
                        }
-    assert_schema(schema_name, owner, {}, {})    # grants are blank until first explicit grant
+    assert_schema(catalog, schema_name, owner, {}, {})    # grants are blank until first explicit grant
 
 
-def test_delete(randval, db_admin, schema_name, response):
+def test_delete(catalog, randval, db_admin, schema_name, response):
     props = {
             "Name":     schema_name
             }
     # first create the schema and verify that it's there
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Create", "Schema", None, props, {}, response)
-    assert_schema(schema_name, db_admin, {}, {})
+    assert_schema(catalog, schema_name, db_admin, {}, {})
     # then delete and verify that it's no longer there
+    response.clear()
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Delete", "Schema", schema_name, props, {}, response)
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
                        }
-    assert len(itest_helpers.retrieve_schema_info(schema_name)) == 0
+    assert catalog.schema(schema_name) == None
 
 
-def test_delete_cascade(randval, db_admin, schema_name, response):
+def test_delete_cascade(catalog, randval, db_admin, schema_name, response):
     props = {
             "Name":     schema_name,
             "Cascade":  "true"
@@ -265,16 +278,44 @@ def test_delete_cascade(randval, db_admin, schema_name, response):
         csr.execute(f"create table {schema_name}.t{randval} ( x int not null )")
         conn.commit()
     # then delete and verify that it's no longer there
+    response.clear()
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Delete", "Schema", schema_name, props, {}, response)
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": schema_name,
                        }
-    assert len(itest_helpers.retrieve_schema_info(schema_name)) == 0
+    assert catalog.schema(schema_name) == None
 
 
-def test_delete_failure_no_cascade(randval, db_admin, schema_name, response):
+def test_delete_cascade_in_batches(catalog, randval, db_admin, schema_name, response):
+    props = {
+            "Name":             schema_name,
+            "Cascade":          "true",
+            "CascadeBatchSize": "2",
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Create", "Schema", None, props, {}, response)
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        for x in range(5):
+            csr.execute(f"create table {schema_name}.t{x} ( id serial primary key, x int not null )")
+        csr.execute(f"create view {schema_name}.v0 as select * from {schema_name}.t0")
+        csr.execute(f"create function {schema_name}.f(x int) returns int as 'select x + 1' language sql")
+        csr.execute(f"create type {schema_name}.mood as enum ('happy', 'sad')")
+        csr.execute(f"create type {schema_name}.floatrange as range (subtype = float8)")
+        conn.commit()
+    response.clear()
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Delete", "Schema", schema_name, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": schema_name,
+                       }
+    assert catalog.schema(schema_name) == None
+
+
+def test_delete_failure_no_cascade(catalog, randval, db_admin, schema_name, response):
     props = {
             "Name":     schema_name,
             }
@@ -286,6 +327,7 @@ def test_delete_failure_no_cascade(randval, db_admin, schema_name, response):
         csr.execute(f"create table {schema_name}.t{randval} ( x int not null )")
         conn.commit()
     # then attempt to delete
+    response.clear()
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Delete", "Schema", schema_name, props, {}, response)
     assert response == {
@@ -294,33 +336,33 @@ def test_delete_failure_no_cascade(randval, db_admin, schema_name, response):
                        "Reason": ANY
                        }
     # and verify that it's still there
-    assert len(itest_helpers.retrieve_schema_info(schema_name)) == 1
+    assert catalog.schema(schema_name) != None
 
 
-def test_update_change_name(randval, db_admin, schema_name, response):
+def test_update_change_name(catalog, randval, db_admin, schema_name, response):
     create_props = {
             "Name":     schema_name
             }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Create", "Schema", None, create_props, {}, response)
-    assert_schema(schema_name, db_admin, {}, {})
+    assert_schema(catalog, schema_name, db_admin, {}, {})
     new_name = "new" + schema_name
     update_props = {
             "Name":     new_name
             }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, update_props, create_props, response)
-    assert_schema(new_name, db_admin, {}, {})
+    assert_schema(catalog, new_name, db_admin, {}, {})
 
 
-def test_update_change_owner(randval, db_admin, schema_name, response):
+def test_update_change_owner(catalog, randval, db_admin, schema_name, response):
     # initial schema creation: default owner
     create_props = {
             "Name":     schema_name
             }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Create", "Schema", schema_name, create_props, {}, response)
-    assert_schema(schema_name, db_admin, {}, {})
+    assert_schema(catalog, schema_name, db_admin, {}, {})
     new_owner = itest_helpers.create_user(f"user_{randval}_0")
     update_props = {
             "Name":     schema_name,
@@ -328,10 +370,62 @@ def test_update_change_owner(randval, db_admin, schema_name, response):
             }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, update_props, create_props, response)
-    assert_schema(schema_name, new_owner, {}, {})
+    assert_schema(catalog, schema_name, new_owner, {}, {})
+
 
 
-def test_update_public_to_readonly(randval, db_admin, schema_name, response):
+@pytest.mark.parametrize("batch_size", [None, "2"])
+def test_update_change_owner_transfer_ownership(catalog, randval, db_admin, schema_name, response, batch_size):
+    create_props = {
+            "Name":     schema_name
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Create", "Schema", schema_name, create_props, {}, response)
+        csr = conn.cursor()
+        csr.execute(f"create table {schema_name}.t1 ( id serial primary key, x int )")
+        csr.execute(f"create table {schema_name}.t2 ( id int generated always as identity, d date ) partition by range (d)")
+        csr.execute(f"create table {schema_name}.t2_2024 partition of {schema_name}.t2 for values from ('2024-01-01') to ('2025-01-01')")
+        csr.execute(f"create sequence {schema_name}.s1")
+        csr.execute(f"create view {schema_name}.v1 as select id from {schema_name}.t1")
+        csr.execute(f"create function {schema_name}.f1(v int) returns int as 'select v' language sql")
+        csr.execute(f"create type {schema_name}.mood as enum ('happy', 'sad')")
+        csr.execute(f"create domain {schema_name}.positive as int check (value > 0)")
+        csr.execute(f"create type {schema_name}.floatrange as range (subtype = float8)")
+        conn.commit()
+    new_owner = itest_helpers.create_user(f"user_{randval}_0")
+    update_props = {
+            "Name":                 schema_name,
+            "Owner":                new_owner,
+            "TransferOwnership":    "true",
+            }
+    if batch_size:
+        update_props["TransferOwnershipBatchSize"] = batch_size
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, update_props, create_props, response)
+    assert response["Status"] == "SUCCESS"
+    assert_schema(catalog, schema_name, new_owner, {}, {})
+    owners = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                                 lambda c: c.execute("""
+                                                     select  c.relname as name, pg_get_userbyid(c.relowner) as owner
+                                                     from    pg_class c
+                                                     where   c.relnamespace = to_regnamespace(%s)
+                                                     union all
+                                                     select  p.proname, pg_get_userbyid(p.proowner)
+                                                     from    pg_proc p
+                                                     where   p.pronamespace = to_regnamespace(%s)
+                                                     and     not exists (select 1 from pg_depend d where d.classid = 'pg_proc'::regclass and d.objid = p.oid and d.deptype = 'i')
+                                                     union all
+                                                     select  t.typname, pg_get_userbyid(t.typowner)
+                                                     from    pg_type t
+                                                     where   t.typnamespace = to_regnamespace(%s)
+                                                     and     not exists (select 1 from pg_depend d where d.classid = 'pg_type'::regclass and d.objid = t.oid and d.deptype = 'i')
+                                                     """,
+                                                     (schema_name, schema_name, schema_name)))
+    assert len(owners) > 10
+    assert set(row["owner"] for row in owners) == { new_owner }
+
+
+def test_update_public_to_readonly(catalog, randval, db_admin, schema_name, response):
     create_props = {
             "Name":     schema_name,
             "Public":   "true",
@@ -345,7 +439,7 @@ def test_update_public_to_readonly(randval, db_admin, schema_name, response):
             }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, update_props, create_props, response)
-    assert_schema(schema_name, db_admin,
+    assert_schema(catalog, schema_name, db_admin,
                   {
                       db_admin: set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),   # adding any grants adds owner grant
                       "PUBLIC": set([PERM_SCHEMA_USAGE]),
@@ -359,7 +453,7 @@ def test_update_public_to_readonly(randval, db_admin, schema_name, response):
                   })
 
 
-def test_update_readonly_to_public(randval, db_admin, schema_name, response):
+def test_update_readonly_to_public(catalog, randval, db_admin, schema_name, response):
     create_props = {
             "Name":     schema_name,
             "ReadOnly": "true",
@@ -373,7 +467,7 @@ def test_update_readonly_to_public(randval, db_admin, schema_name, response):
             }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, update_props, create_props, response)
-    assert_schema(schema_name, db_admin,
+    assert_schema(catalog, schema_name, db_admin,
                   {
                       db_admin: set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),   # adding any grants adds owner grant
                       "PUBLIC": set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),
@@ -389,7 +483,7 @@ def test_update_readonly_to_public(randval, db_admin, schema_name, response):
                   })
 
 
-def test_update_users(randval, db_admin, schema_name, response):
+def test_update_users(catalog, randval, db_admin, schema_name, response):
     user_1 = itest_helpers.create_user(f"user_{randval}_1")
     user_2 = itest_helpers.create_user(f"user_{randval}_2")
     create_props = {
@@ -407,7 +501,7 @@ def test_update_users(randval, db_admin, schema_name, response):
             }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, update_props, create_props, response)
-    assert_schema(schema_name, db_admin,
+    assert_schema(catalog, schema_name, db_admin,
                   {
                       db_admin: set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),
                       user_2:   set([PERM_SCHEMA_USAGE, PERM_SCHEMA_CREATE]),
@@ -426,3 +520,166 @@ def test_update_users(randval, db_admin, schema_name, response):
                                     PERM_FUNCTION_EXECUTE,
                                     ]),
                   })
+
+
+def test_update_grant_existing(catalog, randval, db_admin, schema_name, response):
+    user_1 = itest_helpers.create_user(f"user_{randval}_1")
+    user_2 = itest_helpers.create_user(f"user_{randval}_2")
+    table_name = f"t{randval}"
+    create_props = {
+            "Name":             schema_name,
+            "GrantExisting":    "true",
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Create", "Schema", None, create_props, {}, response)
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"create table {schema_name}.{table_name} ( x int not null )")
+        conn.commit()
+    update_props = {
+            "Name":             schema_name,
+            "GrantExisting":    "true",
+            "Users":            [ user_1 ],
+            "ReadOnlyUsers":    [ user_2 ]
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, update_props, create_props, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": schema_name,
+                       "Data": ANY,
+                       }
+    table_privs = catalog.table_permissions(schema_name, table_name)
+    assert table_privs[user_1] == set(itest_helpers.Permission(p) for p in
+                                      ["INSERT", "SELECT", "UPDATE", "DELETE", "TRUNCATE", "REFERENCES", "TRIGGER"])
+    assert table_privs[user_2] == set([itest_helpers.Permission("SELECT")])
+    # and remove the read-only user
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, create_props, update_props, response)
+    table_privs = catalog.table_permissions(schema_name, table_name)
+    assert user_1 not in table_privs
+    assert user_2 not in table_privs
+
+
+def test_update_public_grant_existing(catalog, randval, db_admin, schema_name, response):
+    table_name = f"t{randval}"
+    private_props = {
+            "Name":             schema_name,
+            "GrantExisting":    "true",
+            }
+    public_props = dict(private_props, Public="true")
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Create", "Schema", None, private_props, {}, response)
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"create table {schema_name}.{table_name} ( x int not null )")
+        conn.commit()
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, public_props, private_props, response)
+    assert "PUBLIC" in catalog.table_permissions(schema_name, table_name)
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Update", "Schema", schema_name, private_props, public_props, response)
+    assert response["Status"] == "SUCCESS"
+    assert "PUBLIC" not in catalog.table_permissions(schema_name, table_name)
+    assert "PUBLIC" not in catalog.schema(schema_name).permissions
+
+
+def test_create_from_template(catalog, randval, db_admin, schema_name, response):
+    template_name = f"template_{randval}"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"create schema {template_name}")
+        csr.execute(f"create table {template_name}.parent ( id serial primary key, name text not null unique )")
+        csr.execute(f"create table {template_name}.child ( parent_id int references {template_name}.parent, "
+                    f"created date not null default current_date, check (parent_id > 0) ) partition by range (created)")
+        csr.execute(f"create table {template_name}.event ( id bigint generated always as identity, parent_id int references {template_name}.parent )")
+        csr.execute(f"create table {template_name}.child_2024 partition of {template_name}.child for values from ('2024-01-01') to ('2025-01-01')")
+        csr.execute(f"create index child_parent_idx on {template_name}.child (parent_id)")
+        csr.execute(f"create function {template_name}.twice(v int) returns int as 'select v * 2' language sql")
+        csr.execute(f"create view {template_name}.parent_names as select name, {template_name}.twice(id) as x from {template_name}.parent")
+        conn.commit()
+    props = {
+            "Name":     schema_name,
+            "Template": template_name,
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Create", "Schema", None, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": schema_name,
+                       "Data": ANY,
+                       }
+    # the copies must refer to each other, not to the template
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"insert into {schema_name}.parent (name) values ('argle')")
+        csr.execute(f"insert into {schema_name}.child (parent_id, created) select id, '2024-06-01' from {schema_name}.parent")
+        csr.execute(f"select {schema_name}.twice(1), (select count(*) from {schema_name}.parent_names), (select count(*) from {schema_name}.child_2024)")
+        assert list(csr.fetchone()) == [2, 1, 1]
+        csr.execute(f"insert into {schema_name}.event (parent_id) select id from {schema_name}.parent")
+        csr.execute(f"select count(*) from {template_name}.parent")
+        assert list(csr.fetchone()) == [0]
+        conn.commit()
+    indexes = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                                  lambda c: c.execute("select indexname, tablename from pg_indexes where schemaname = %s order by 1", (schema_name,)))
+    assert [(row["indexname"], row["tablename"]) for row in indexes] == [
+        ("child_2024_parent_id_idx", "child_2024"), ("child_parent_idx", "child"),
+        ("parent_name_key", "parent"), ("parent_pkey", "parent")]
+    # and the template's indexes must be unchanged
+    indexes = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                                  lambda c: c.execute("select indexname from pg_indexes where schemaname = %s order by 1", (template_name,)))
+    assert [row["indexname"] for row in indexes] == [
+        "child_2024_parent_id_idx", "child_parent_idx", "parent_name_key", "parent_pkey"]
+
+
+def test_create_from_template_with_types(catalog, randval, db_admin, schema_name, response):
+    template_name = f"template_{randval}"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"create schema {template_name}")
+        csr.execute(f"create type {template_name}.mood as enum ('sad', 'ok', 'happy')")
+        csr.execute(f"create domain {template_name}.score as int not null default 0 constraint score_range check (value between 0 and 100)")
+        csr.execute(f"create type {template_name}.rating as ( mood {template_name}.mood, score {template_name}.score )")
+        csr.execute(f"create table {template_name}.review ( id serial primary key, mood {template_name}.mood, "
+                    f"score {template_name}.score, history {template_name}.rating[] )")
+        conn.commit()
+    props = {
+            "Name":     schema_name,
+            "Template": template_name,
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Create", "Schema", None, props, {}, response)
+    assert response["Status"] == "SUCCESS", response.get("Reason")
+    # the table's columns must use the copied types
+    columns = util.select_as_dict(itest_helpers.local_pg8000_secret(None),
+                                  lambda c: c.execute("""
+                                                      select  a.attname, n.nspname
+                                                      from    pg_attribute a
+                                                      join    pg_type t on t.oid = a.atttypid
+                                                      join    pg_namespace n on n.oid = t.typnamespace
+                                                      where   a.attrelid = %s::regclass
+                                                      and     a.attnum > 0
+                                                      and     a.attname <> 'id'
+                                                      order by 1
+                                                      """,
+                                                      (f"{schema_name}.review",)))
+    assert [(row["attname"], row["nspname"]) for row in columns] == [
+        ("history", schema_name), ("mood", schema_name), ("score", schema_name)]
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        csr = conn.cursor()
+        csr.execute(f"insert into {schema_name}.review (mood) values ('happy')")
+        csr.execute(f"select score from {schema_name}.review")
+        assert list(csr.fetchone()) == [0]
+        with pytest.raises(pg8000.dbapi.DatabaseError):
+            csr.execute(f"insert into {schema_name}.review (mood, score) values ('sad', 101)")
+        conn.rollback()
+
+def test_create_from_missing_template(catalog, randval, db_admin, schema_name, response):
+    props = {
+            "Name":     schema_name,
+            "Template": f"template_{randval}",
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert schema_handler.try_handle(conn, "Create", "Schema", None, props, {}, response)
+    assert response["Status"] == "FAILED"
+    assert catalog.schema(schema_name) == None
@@ -16,6 +16,12 @@ from cf_postgres.handlers import user_handler
 ## fixtures
 ################################################################################
 
+@pytest.fixture(scope="module")
+def catalog():
+    with itest_helpers.CatalogInspector() as inspector:
+        yield inspector
+
+
 @pytest.fixture
 def randval():
     return random.randrange(100000, 999999)
@@ -39,8 +45,8 @@ def response(randval):
 ## helper functions
 ################################################################################
 
-def assert_user_info(username, has_createdb, has_createrole):
-    user_info = itest_helpers.retrieve_user_info(username)
+def assert_user_info(catalog, username, has_createdb, has_createrole):
+    user_info = catalog.role(username)
     assert user_info != None
     assert user_info['rolcreatedb'] == has_createdb
     assert user_info['rolcreaterole'] == has_createrole
@@ -58,7 +64,7 @@ def assert_user_can_login(username, password):
 ## testcases
 ################################################################################
 
-def test_create_from_username_and_password_no_extra_abilities(username, password, response):
+def test_create_from_username_and_password_no_extra_abilities(catalog, username, password, response):
     props = {
             "Username":     username,
             "Password":     password,
@@ -68,12 +74,13 @@ def test_create_from_username_and_password_no_extra_abilities(username, password
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": username,
+                       "Data": ANY,
                        }
-    assert_user_info(username, False, False)
+    assert_user_info(catalog, username, False, False)
     assert_user_can_login(username, password)
 
 
-def test_create_from_username_and_password_with_createdb(username, password, response):
+def test_create_from_username_and_password_with_createdb(catalog, username, password, response):
     props = {
             "Username":         username,
             "Password":         password,
@@ -84,12 +91,13 @@ def test_create_from_username_and_password_with_createdb(username, password, res
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": username,
+                       "Data": ANY,
                        }
-    assert_user_info(username, True, False)
+    assert_user_info(catalog, username, True, False)
     assert_user_can_login(username, password)
 
 
-def test_create_from_username_and_password_with_createrole(username, password, response):
+def test_create_from_username_and_password_with_createrole(catalog, username, password, response):
     props = {
             "Username":         username,
             "Password":         password,
@@ -100,12 +108,13 @@ def test_create_from_username_and_password_with_createrole(username, password, r
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": username,
+                       "Data": ANY,
                        }
-    assert_user_info(username, False, True)
+    assert_user_info(catalog, username, False, True)
     assert_user_can_login(username, password)
 
 
-def test_create_from_username_and_password_explicit_no_extra_abilities(username, password, response):
+def test_create_from_username_and_password_explicit_no_extra_abilities(catalog, username, password, response):
     props = {
             "Username":         username,
             "Password":         password,
@@ -117,12 +126,13 @@ def test_create_from_username_and_password_explicit_no_extra_abilities(username,
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": username,
+                       "Data": ANY,
                        }
-    assert_user_info(username, False, False)
+    assert_user_info(catalog, username, False, False)
     assert_user_can_login(username, password)
 
 
-def test_create_from_username_only(username, response):
+def test_create_from_username_only(catalog, username, response):
     props = {
             "Username":     username,
             }
@@ -131,14 +141,15 @@ def test_create_from_username_only(username, response):
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": username,
+                       "Data": ANY,
                        }
-    assert_user_info(username, False, False)
+    assert_user_info(catalog, username, False, False)
     # can't assert login because there's no password
 
 
-def test_update(username, password, response):
+def test_update(catalog, username, password, response):
     # we'll create the user with nothing, and then update
-    test_create_from_username_only(username, response)
+    test_create_from_username_only(catalog, username, response)
     props = {
             "Username":         username,
             "Password":         password,
@@ -150,12 +161,36 @@ def test_update(username, password, response):
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": username,
+                       "Data": ANY,
+                       }
+    assert_user_info(catalog, username, True, True)
+    assert_user_can_login(username, password)
+
+
+def test_update_changes_only_modified_attributes(catalog, username, password, response):
+    create_props = {
+            "Username":         username,
+            "Password":         password,
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert user_handler.try_handle(conn, "Create", "User", None, create_props, {}, response)
+    update_props = {
+            "Username":         username,
+            "Password":         password,
+            "CreateDatabase":   "true",
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert user_handler.try_handle(conn, "Update", "User", username, update_props, create_props, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": username,
+                       "Data": ANY,
                        }
-    assert_user_info(username, True, True)
+    assert_user_info(catalog, username, True, False)
     assert_user_can_login(username, password)
 
 
-def test_delete(username, response):
+def test_delete(catalog, username, response):
     props = {
             "Username":     username,
             }
@@ -163,11 +198,109 @@ def test_delete(username, response):
         csr = conn.cursor()
         csr.execute(f"create user {username} password NULL")
         conn.commit()
-    assert itest_helpers.retrieve_user_info(username) != None   # verify that we created before trying to delete
+    assert catalog.role(username) != None   # verify that we created before trying to delete
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert user_handler.try_handle(conn, "Delete", "User", username, props, {}, response)
+    assert response == {
+                       "Status": "SUCCESS",
+                       "PhysicalResourceId": username,
+                       }
+    assert catalog.role(username) == None
+
+
+
+def create_owned_objects(randval, username):
+    """ Creates a database, and tables owned by the user in that database and the
+        default database, along with a grant on a table that the user doesn't own.
+        Returns the name of the new database.
+        """
+    db_name = f"db_{randval}"
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        conn.autocommit = True
+        csr = conn.cursor()
+        csr.execute(f"create user {username} password NULL")
+        csr.execute(f"create database {db_name}")
+        csr.execute(f"create table t_{randval} ( id int )")
+        csr.execute(f"alter table t_{randval} owner to {username}")
+    connection_info = dict(itest_helpers.local_pg8000_secret(None), database=db_name)
+    with util.connect_to_db(connection_info) as conn:
+        csr = conn.cursor()
+        csr.execute("create table owned ( id int )")
+        csr.execute(f"alter table owned owner to {username}")
+        csr.execute("create table granted ( id int )")
+        csr.execute(f"grant select on granted to {username}")
+        conn.commit()
+    return db_name
+
+
+def table_owners(db_name):
+    connection_info = dict(itest_helpers.local_pg8000_secret(None), database=db_name)
+    rows = util.select_as_dict(connection_info,
+                               lambda c: c.execute("select tablename, tableowner from pg_tables where schemaname = 'public'"))
+    return dict((row["tablename"], row["tableowner"]) for row in rows)
+
+
+@pytest.mark.parametrize("on_delete", ["Reassign", "DropOwned"])
+def test_delete_with_owned_objects(monkeypatch, catalog, randval, username, response, on_delete):
+    monkeypatch.setattr(util, "retrieve_pg8000_secret", itest_helpers.local_pg8000_secret)
+    db_name = create_owned_objects(randval, username)
+    default_db = itest_helpers.local_pg8000_secret(None)["database"]
+    admin = itest_helpers.local_pg8000_secret(None)["user"]
+    props = {
+            "Username":         username,
+            "AdminSecretArn":   "arn:aws:secretsmanager:us-east-1:123456789012:secret:local",
+            "OnDelete":         on_delete,
+            }
     with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
         assert user_handler.try_handle(conn, "Delete", "User", username, props, {}, response)
     assert response == {
                        "Status": "SUCCESS",
                        "PhysicalResourceId": username,
                        }
-    assert itest_helpers.retrieve_user_info(username) == None
+    assert catalog.role(username) == None
+    if on_delete == "Reassign":
+        assert table_owners(db_name) == { "owned": admin, "granted": admin }
+        assert table_owners(default_db)[f"t_{randval}"] == admin
+    else:
+        assert table_owners(db_name) == { "granted": admin }
+        assert f"t_{randval}" not in table_owners(default_db)
+
+
+def test_delete_with_owned_objects_fails_by_default(catalog, randval, username, response):
+    db_name = create_owned_objects(randval, username)
+    props = {
+            "Username":     username,
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert user_handler.try_handle(conn, "Delete", "User", username, props, {}, response)
+    assert response["Status"] == "FAILED"
+    assert catalog.role(username) != None
+
+
+def test_settings(catalog, username, response):
+    db_name = itest_helpers.local_pg8000_secret(None)["database"]
+    props = {
+            "Username":         username,
+            "ConnectionLimit":  "10",
+            "Settings":         { "work_mem": "64MB", "search_path": "app, public" },
+            "DatabaseSettings": { db_name: { "statement_timeout": "30s" } },
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert user_handler.try_handle(conn, "Create", "User", None, props, {}, response)
+    assert response["Status"] == "SUCCESS"
+    assert response["Data"]["ConnectionLimit"] == "10"
+    assert catalog.role_settings(username) == {
+        None:       { "work_mem": "64MB", "search_path": "app, public" },
+        db_name:    { "statement_timeout": "30s" },
+        }
+    new_props = {
+            "Username":         username,
+            "Settings":         { "work_mem": "128MB" },
+            }
+    with util.connect_to_db(itest_helpers.local_pg8000_secret(None)) as conn:
+        assert user_handler.try_handle(conn, "Update", "User", username, new_props, props, response)
+    assert response["Status"] == "SUCCESS"
+    assert catalog.role(username)['rolconnlimit'] == -1
+    assert catalog.role_settings(username) == {
+        None:       { "work_mem": "128MB" },
+        }
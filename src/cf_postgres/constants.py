@@ -14,6 +14,11 @@ REQ_RESPONSE_URL    = 'ResponseURL'
 
 REQ_RESOURCE_TYPE   = 'Resource'
 REQ_ADMIN_SECRET    = 'AdminSecretArn'
+REQ_EARLY_ACK       = 'AcknowledgeDeleteEarly'
+REQ_DATABASES       = 'Databases'
+REQ_PLAN            = 'Plan'
+REQ_WARM_UP         = 'WarmUp'
+REQ_REINVOCATION    = 'Reinvocation'        # added when the Lambda re-invokes itself
 
 # standard response elements
 
@@ -24,11 +29,13 @@ RSP_PHYSICAL_ID     = 'PhysicalResourceId'
 RSP_STATUS          = 'Status'
 RSP_REASON          = 'Reason'
 RSP_DATA            = 'Data'
+RSP_STATEMENTS      = 'Statements'          # only returned for a plan
 
 # response status code
 
 RSP_SUCCESS         = 'SUCCESS'
 RSP_FAILURE         = 'FAILED'
+RSP_IN_PROGRESS     = 'IN_PROGRESS'         # internal: the handler will resume when re-invoked
 
 # actions that a resource handler needs to process
 
@@ -36,6 +43,28 @@ ACTION_CREATE       = 'Create'
 ACTION_UPDATE       = 'Update'
 ACTION_DELETE       = 'Delete'
 
+# CloudWatch metrics (written using embedded metric format)
+
+METRIC_NAMESPACE        = 'CFPostgres'
+METRIC_DELETE_FAILURES  = 'AcknowledgedDeleteFailures'
+
+# configuration provided via environment
+
+ENV_MAX_WORKERS         = 'CF_POSTGRES_MAX_WORKERS'
+DEFAULT_MAX_WORKERS     = 4
+ENV_SECRET_CACHE_TTL    = 'CF_POSTGRES_SECRET_CACHE_TTL'
+DEFAULT_SECRET_CACHE_TTL = 300
+ENV_PREWARM_SECRET      = 'CF_POSTGRES_PREWARM_SECRET_ARN'
+
+# a handler that runs out of time may be resumed this many times
+
+MAX_REINVOCATIONS       = 20
+
+# Postgres error codes that we handle explicitly
+
+SQLSTATE_INVALID_AUTHORIZATION  = '28000'
+SQLSTATE_INVALID_PASSWORD       = '28P01'
+
 # components of the standard RDS secret
 
 DB_SECRET_USERNAME  = 'username'
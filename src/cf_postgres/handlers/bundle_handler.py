@@ -0,0 +1,197 @@
+""" Handler for Bundle resources: a list of User and Schema resources that are
+    processed by their own handlers, in dependency order, using a single connection
+    and transaction. If any of them fails, the entire bundle is rolled back.
+    """
+
+import logging
+import sys
+
+from collections import namedtuple
+
+from cf_postgres import util
+from cf_postgres.constants import *
+from cf_postgres.handlers import user_handler, schema_handler
+
+
+# resource configuration
+
+RESOURCE_NAME = "Bundle"
+
+PROP_RESOURCES  = "Resources"
+
+# the resources that may be bundled, in the order that they're created; deletes
+# happen in reverse order, after all creates and updates
+
+BUNDLED_HANDLERS = [
+    user_handler,
+    schema_handler,
+    ]
+
+
+# physical_id is the resource's existing name, if that differs from its new name
+
+Step = namedtuple("Step", ["request_type", "resource_type", "name", "props", "old_props", "physical_id"], defaults=[None])
+
+
+def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+    if resource_type != RESOURCE_NAME:
+        return False
+    if util.verify_property(props, response, PROP_RESOURCES):
+        handle(conn, request_type, physical_id, props, old_props, response)
+    return True
+
+
+def handle(conn, request_type, physical_id, props, old_props, response):
+    logging.info(f"bundle_handler: performing {request_type} for bundle {physical_id}")
+    try:
+        if request_type == ACTION_CREATE:
+            steps = _plan_create(props)
+        elif request_type == ACTION_UPDATE:
+            steps = _plan_update(props, old_props)
+        elif request_type == ACTION_DELETE:
+            steps = _plan_delete(props)
+        else:
+            util.report_failure(response, f"bundle_handler: Unknown request type: {request_type}")
+            return
+        data = _run_steps(DeferredCommitConnection(conn), steps, response)
+        conn.commit()
+        util.report_success(response, physical_id or _bundle_id(steps), data)
+    except:
+        util.report_failure(response, f"bundle_handler: failed to complete action {request_type} for bundle {physical_id}: {sys.exc_info()[1]}", physical_id)
+        conn.rollback()
+
+
+def _plan_create(props):
+    return [Step(ACTION_CREATE, resource_type, name, child_props, {})
+            for ((resource_type, name), child_props) in _bundled_resources(props).items()]
+
+
+def _plan_update(props, old_props):
+    """ Bundled resources are identified by type and name: those that appear in both
+        the new and old properties are updated, those that only appear in the new
+        properties are created, and those that only appear in the old properties are
+        deleted (after all creates and updates).
+
+        The exception is a schema whose name has changed: if the update removes one
+        schema and adds one, that's a rename, which is applied as an update of the
+        existing schema. Otherwise a removed schema would be dropped, along with its
+        contents if it specifies Cascade, so the update fails rather than guess which
+        of several schemas have been renamed.
+        """
+    new_resources = _bundled_resources(props)
+    old_resources = _bundled_resources(old_props)
+    renames = _schema_renames(new_resources, old_resources)
+    steps = []
+    for (key, child_props) in new_resources.items():
+        if key in old_resources:
+            steps.append(Step(ACTION_UPDATE, key[0], key[1], child_props, old_resources[key]))
+        elif key in renames:
+            old_key = renames[key]
+            steps.append(Step(ACTION_UPDATE, key[0], key[1], child_props, old_resources[old_key], old_key[1]))
+        else:
+            steps.append(Step(ACTION_CREATE, key[0], key[1], child_props, {}))
+    renamed = set(renames.values())
+    for (key, child_props) in reversed(old_resources.items()):
+        if key not in new_resources and key not in renamed:
+            steps.append(Step(ACTION_DELETE, key[0], key[1], child_props, {}))
+    return steps
+
+
+def _schema_renames(new_resources, old_resources):
+    """ Returns a dict that maps the key of a renamed schema to its old key. Raises if
+        schemas have been both added and removed, and it isn't clear which have been
+        renamed, if any of the removed schemas would be dropped with their contents.
+        """
+    schema_type = schema_handler.RESOURCE_NAME
+    added = [key for key in new_resources if key[0] == schema_type and key not in old_resources]
+    removed = [key for key in old_resources if key[0] == schema_type and key not in new_resources]
+    if len(added) == 1 and len(removed) == 1:
+        return { added[0]: removed[0] }
+    if added:
+        cascaded = [key[1] for key in removed if util.get_boolean_prop(old_resources[key], schema_handler.PROP_CASCADE)]
+        if cascaded:
+            raise Exception(f"can not determine whether schemas {', '.join(cascaded)} have been renamed or removed; "
+                            f"rename one schema per update")
+    return {}
+
+
+def _plan_delete(props):
+    return [Step(ACTION_DELETE, resource_type, name, child_props, {})
+            for ((resource_type, name), child_props) in reversed(_bundled_resources(props).items())]
+
+
+def _bundled_resources(props):
+    """ Returns a dict of the bundled resources' properties, keyed by (type, name),
+        in creation order. Each resource inherits the bundle's admin secret, unless
+        it specifies its own.
+        """
+    handler_names = [handler.RESOURCE_NAME for handler in BUNDLED_HANDLERS]
+    resources = []
+    for child_props in props.get(PROP_RESOURCES) or []:
+        resource_type = child_props.get(REQ_RESOURCE_TYPE)
+        if resource_type not in handler_names:
+            raise Exception(f"unsupported resource type: {resource_type}; must be one of {', '.join(handler_names)}")
+        name = _resource_name(resource_type, child_props)
+        if not name:
+            raise Exception(f"{resource_type} does not specify a name")
+        if props.get(REQ_ADMIN_SECRET) and not child_props.get(REQ_ADMIN_SECRET):
+            child_props = dict(child_props, **{REQ_ADMIN_SECRET: props.get(REQ_ADMIN_SECRET)})
+        resources.append(((resource_type, name), child_props))
+    result = {}
+    for (key, child_props) in sorted(resources, key=lambda x: handler_names.index(x[0][0])):
+        if key in result:
+            raise Exception(f"{key[0]} {key[1]} is specified more than once")
+        result[key] = child_props
+    return result
+
+
+def _resource_name(resource_type, child_props):
+    """ Returns the name that the resource's handler reports as its physical ID.
+        """
+    if resource_type == user_handler.RESOURCE_NAME:
+        return user_handler.load_user_info(child_props, None)[0]
+    return child_props.get(schema_handler.PROP_NAME)
+
+
+def _run_steps(conn, steps, response):
+    """ Invokes the bundled resources' handlers, raising if any of them fail. Returns
+        their combined attributes, prefixed by resource type and name.
+        """
+    handlers = dict((handler.RESOURCE_NAME, handler) for handler in BUNDLED_HANDLERS)
+    data = {}
+    for step in steps:
+        logging.info(f"bundle_handler: {step.request_type} {step.resource_type} {step.name}")
+        physical_id = (step.physical_id or step.name) if step.request_type != ACTION_CREATE else None
+        child_response = dict(response)
+        handlers[step.resource_type].try_handle(conn, step.request_type, step.resource_type, physical_id, step.props, step.old_props, child_response)
+        if child_response.get(RSP_STATUS) != RSP_SUCCESS:
+            raise Exception(f"{step.resource_type} {step.name}: {child_response.get(RSP_REASON) or child_response.get(RSP_STATUS)}")
+        for (key, value) in (child_response.get(RSP_DATA) or {}).items():
+            data[f"{step.resource_type}.{step.name}.{key}"] = value
+    return data
+
+
+def _bundle_id(steps):
+    return ",".join(f"{step.resource_type}:{step.name}" for step in steps)
+
+
+class DeferredCommitConnection:
+    """ Wraps the bundle's connection, ignoring commits and rollbacks from the bundled
+        resources' handlers, so that they all run in a single transaction that's
+        ended by the bundle. All other operations are passed through.
+        """
+
+    def __init__(self, conn):
+        object.__setattr__(self, "_conn", conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
@@ -0,0 +1,159 @@
+""" Handler for Database resources.
+    """
+
+import logging
+import sys
+import time
+
+import pg8000.dbapi
+
+from cf_postgres import sql, util
+from cf_postgres.constants import *
+
+
+# resource configuration
+
+RESOURCE_NAME = "Database"
+
+PROP_NAME       = "Name"
+PROP_OWNER      = "Owner"
+PROP_TEMPLATE   = "Template"
+PROP_ENCODING   = "Encoding"
+PROP_CONNLIMIT  = "ConnectionLimit"
+
+# creating from a template fails if anyone else is connected to the template;
+# we retry for a short while, on the assumption that those connections are brief
+
+TEMPLATE_RETRY_COUNT    = 10
+TEMPLATE_RETRY_DELAY    = 1.0
+
+SQLSTATE_OBJECT_IN_USE  = "55006"
+
+# the first version that supports "strategy file_copy"
+
+FILE_COPY_MIN_VERSION   = 150000
+
+# statements
+
+CREATE_DATABASE     = sql.template("create database {db_name:ident}{clauses}")
+RENAME_DATABASE     = sql.template("alter database {old_name:ident} rename to {db_name:ident}")
+ALTER_OWNER         = sql.template("alter database {db_name:ident} owner to {owner:role}")
+CONNECTION_LIMIT    = sql.template("alter database {db_name:ident} connection limit {limit}")
+DROP_DATABASE       = sql.template("drop database if exists {db_name:ident}")
+
+
+def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+    if resource_type != RESOURCE_NAME:
+        return False
+    db_name = util.verify_property(props, response, PROP_NAME)
+    if db_name:
+        handle(conn, request_type, physical_id, db_name, props, old_props, response)
+    return True
+
+
+def handle(conn, request_type, physical_id, db_name, props, old_props, response):
+    logging.info(f"database_handler: performing {request_type} for database {db_name}, resource {physical_id}")
+    # create/alter/drop database can't run inside a transaction
+    conn.autocommit = True
+    try:
+        if request_type == ACTION_CREATE:
+            _doCreate(conn, db_name, props, response)
+        elif request_type == ACTION_UPDATE:
+            _doUpdate(conn, physical_id, db_name, props, old_props, response)
+        elif request_type == ACTION_DELETE:
+            _doDelete(conn, physical_id, props, response)
+        else:
+            util.report_failure(response, f"database_handler: Unknown request type: {request_type}")
+    except:
+        util.report_failure(response, f"database_handler: failed to complete action {request_type} for database {db_name}: {sys.exc_info()[1]}", physical_id)
+    finally:
+        conn.autocommit = False
+
+
+def _doCreate(conn, db_name, props, response):
+    (owner_name, template_name, encoding, connection_limit) = _extract_props(props)
+    csr = conn.cursor()
+    clauses = []
+    if owner_name:
+        clauses.append(f" owner {sql.role(owner_name)}")
+    if template_name:
+        clauses.append(f" template {sql.ident(template_name)}")
+        if _server_version(csr) >= FILE_COPY_MIN_VERSION:
+            clauses.append(" strategy file_copy")
+    if encoding:
+        clauses.append(f" encoding {sql.literal(encoding)}")
+    if connection_limit is not None:
+        clauses.append(f" connection limit {connection_limit}")
+    _create_with_retry(csr, CREATE_DATABASE(db_name=db_name, clauses="".join(clauses)))
+    util.report_success(response, db_name, _retrieve_attributes(csr, db_name))
+
+
+def _doUpdate(conn, physical_id, db_name, props, old_props, response):
+    (new_owner_name, new_template_name, new_encoding, new_connection_limit) = _extract_props(props)
+    (old_owner_name, old_template_name, old_encoding, old_connection_limit) = _extract_props(old_props)
+    csr = conn.cursor()
+    if physical_id != db_name:
+        csr.execute(RENAME_DATABASE(old_name=physical_id, db_name=db_name))
+    if new_owner_name != old_owner_name:
+        # removing the owner gives the database back to the admin user, who created it
+        csr.execute(ALTER_OWNER(db_name=db_name, owner=new_owner_name or "current_user"))
+    if new_connection_limit != old_connection_limit:
+        limit = new_connection_limit if new_connection_limit is not None else -1
+        csr.execute(CONNECTION_LIMIT(db_name=db_name, limit=limit))
+    if (new_template_name != old_template_name) or (new_encoding != old_encoding):
+        logging.warning(f"database_handler: template and encoding only apply when creating database; ignoring changes for {db_name}")
+    util.report_success(response, db_name, _retrieve_attributes(csr, db_name))
+
+
+def _doDelete(conn, db_name, props, response):
+    csr = conn.cursor()
+    csr.execute(DROP_DATABASE(db_name=db_name))
+    util.report_success(response, db_name)
+
+
+def _extract_props(props):
+    """ Extracts relevant properties as a tuple: (owner, template, encoding, connection_limit).
+        Can be called for either new or old props.
+        """
+    return (
+        props.get(PROP_OWNER),
+        props.get(PROP_TEMPLATE),
+        props.get(PROP_ENCODING),
+        util.get_int_prop(props, PROP_CONNLIMIT)
+        )
+
+
+def _retrieve_attributes(csr, db_name):
+    """ Retrieves the database's attributes, for Fn::GetAtt. The name is converted
+        to its catalog form, which is how it appears in the DDL; this lets the query
+        use the index on datname.
+        """
+    query = """
+          select  d.oid::text                         as "Oid",
+                  pg_get_userbyid(d.datdba)           as "Owner",
+                  pg_encoding_to_char(d.encoding)     as "Encoding",
+                  d.datconnlimit                      as "ConnectionLimit"
+          from    pg_database d
+          where   d.datname = %s
+          """
+    return util.retrieve_attributes(csr, query, (sql.name(db_name),))
+
+
+def _server_version(csr):
+    csr.execute("select current_setting('server_version_num')::int")
+    row = csr.fetchone()
+    return row[0] if row else 0
+
+
+def _create_with_retry(csr, stmt):
+    """ Executes the create statement, retrying if the template database is in use.
+        """
+    for attempt in range(1, TEMPLATE_RETRY_COUNT + 1):
+        try:
+            csr.execute(stmt)
+            return
+        except pg8000.dbapi.DatabaseError as ex:
+            if util.sqlstate(ex) != SQLSTATE_OBJECT_IN_USE or attempt == TEMPLATE_RETRY_COUNT:
+                raise
+            logging.warning(f"database_handler: template in use (attempt {attempt} of {TEMPLATE_RETRY_COUNT}); retrying")
+            time.sleep(TEMPLATE_RETRY_DELAY)
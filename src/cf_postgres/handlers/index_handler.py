@@ -0,0 +1,202 @@
+""" Handler for Index resources: builds an index with "create index concurrently", so
+    that writes to the table aren't blocked. A build may take longer than a single
+    Lambda invocation; if so, the handler reports that it's in progress and resumes
+    (or verifies the build) when re-invoked.
+    """
+
+import logging
+import sys
+import threading
+import time
+
+from collections import namedtuple
+
+from cf_postgres import sql, util
+from cf_postgres.constants import *
+
+
+# resource configuration
+
+RESOURCE_NAME = "Index"
+
+PROP_NAME       = "Name"
+PROP_TABLE      = "Table"
+PROP_COLUMNS    = "Columns"
+PROP_UNIQUE     = "Unique"
+PROP_METHOD     = "Method"
+PROP_WHERE      = "Where"
+
+DEFAULT_METHOD  = "btree"
+
+# while another session is building the index, we check its progress at this
+# interval; and we stop waiting this many seconds before the invocation deadline,
+# so that there's time to report back
+
+POLL_INTERVAL   = 5.0
+DEADLINE_MARGIN = 30.0
+
+
+IndexState = namedtuple("IndexState", ["is_valid", "pid", "phase", "blocks_done", "blocks_total", "tuples_done", "tuples_total"])
+
+
+def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+    if resource_type != RESOURCE_NAME:
+        return False
+    index_name = util.verify_property(props, response, PROP_NAME)
+    table_name = util.verify_property(props, response, PROP_TABLE)
+    if index_name and table_name:
+        handle(conn, request_type, physical_id, index_name, props, old_props, response)
+    return True
+
+
+def handle(conn, request_type, physical_id, index_name, props, old_props, response):
+    logging.info(f"index_handler: performing {request_type} for index {index_name}, resource {physical_id}")
+    # concurrent index operations can't run inside a transaction
+    conn.autocommit = True
+    try:
+        if request_type == ACTION_CREATE:
+            _doCreate(conn, index_name, props, response)
+        elif request_type == ACTION_UPDATE:
+            _doUpdate(conn, physical_id, index_name, props, old_props, response)
+        elif request_type == ACTION_DELETE:
+            _doDelete(conn, physical_id, props, response)
+        else:
+            util.report_failure(response, f"index_handler: Unknown request type: {request_type}")
+    except:
+        util.report_failure(response, f"index_handler: failed to complete action {request_type} for index {index_name}: {sys.exc_info()[1]}", physical_id)
+    finally:
+        conn.autocommit = False
+
+
+def _doCreate(conn, index_name, props, response):
+    qualified_name = _qualified_name(index_name, props[PROP_TABLE])
+    _build(conn, qualified_name, _create_sql(index_name, props), response)
+
+
+def _doUpdate(conn, physical_id, index_name, props, old_props, response):
+    # a new name builds a new index, and CloudFormation then deletes the old one; we
+    # don't rebuild in place because that would leave the table without an index
+    qualified_name = _qualified_name(index_name, props[PROP_TABLE])
+    if qualified_name == physical_id and _create_sql(index_name, props) != _create_sql(index_name, old_props):
+        raise Exception("changing an index definition requires a new name")
+    _build(conn, qualified_name, _create_sql(index_name, props), response)
+
+
+def _doDelete(conn, physical_id, props, response):
+    csr = conn.cursor()
+    csr.execute(f"drop index concurrently if exists {sql.qualified(physical_id)}")
+    util.report_success(response, physical_id)
+
+
+def _build(conn, qualified_name, create_sql, response):
+    """ Ensures that a valid index exists. If a previous attempt left an invalid
+        index, and nobody is building it, that index is dropped and rebuilt. If some
+        other session is building it (a previous invocation, whose connection is
+        still running the build), we wait for that build to finish.
+
+        Reports in-progress if the build isn't complete by the invocation deadline.
+        """
+    csr = conn.cursor()
+    while True:
+        state = _retrieve_state(csr, qualified_name)
+        if state is None:
+            if _run_build(conn, create_sql):
+                break
+            util.report_in_progress(response, qualified_name)
+            return
+        elif state.is_valid:
+            break
+        elif state.pid is None:
+            logging.warning(f"index_handler: dropping invalid index {qualified_name} left by a previous build")
+            csr.execute(f"drop index concurrently if exists {sql.qualified(qualified_name)}")
+        else:
+            logging.info(f"index_handler: index {qualified_name} being built by process {state.pid}: {state.phase}; "
+                         f"blocks {state.blocks_done} of {state.blocks_total}, tuples {state.tuples_done} of {state.tuples_total}")
+            remaining = _time_remaining()
+            if remaining is not None and remaining < POLL_INTERVAL:
+                util.report_in_progress(response, qualified_name)
+                return
+            time.sleep(POLL_INTERVAL)
+    util.report_success(response, qualified_name, _retrieve_attributes(csr, qualified_name))
+
+
+def _run_build(conn, create_sql):
+    """ Executes the create statement on a separate thread, and waits for it to finish
+        or for the invocation deadline. Returns True if the build completed, False if
+        it's still running. In the latter case, the database continues the build,
+        which can be verified by a later invocation.
+        """
+    errors = []
+    def build():
+        try:
+            conn.cursor().execute(create_sql)
+        except Exception as ex:
+            errors.append(ex)
+    logging.info(f"index_handler: {create_sql}")
+    start = time.time()
+    thread = threading.Thread(target=build, daemon=True)
+    thread.start()
+    remaining = _time_remaining()
+    thread.join(max(remaining, 0) if remaining is not None else None)
+    if thread.is_alive():
+        logging.info(f"index_handler: build not complete after {time.time() - start:.3f} seconds")
+        return False
+    if errors:
+        raise errors[0]
+    logging.info(f"index_handler: build completed in {time.time() - start:.3f} seconds")
+    return True
+
+
+def _time_remaining():
+    """ Returns the time that we can spend building, None if unlimited.
+        """
+    remaining = util.seconds_remaining()
+    return None if remaining is None else remaining - DEADLINE_MARGIN
+
+
+def _qualified_name(index_name, table_name):
+    """ An index always belongs to its table's schema, so if the table name is
+        qualified, that determines the index's qualified name. This is the name as
+        given, which is used as the physical ID; it's quoted when used in SQL.
+        """
+    return ".".join(sql.split(table_name)[:-1] + [index_name])
+
+
+def _create_sql(index_name, props):
+    unique = "unique " if util.get_boolean_prop(props, PROP_UNIQUE) else ""
+    method = props.get(PROP_METHOD) or DEFAULT_METHOD
+    columns = ", ".join(props.get(PROP_COLUMNS, []))
+    statement = f"create {unique}index concurrently {sql.ident(index_name)} on {sql.qualified(props.get(PROP_TABLE))} using {method} ({columns})"
+    if props.get(PROP_WHERE):
+        statement += f" where {props[PROP_WHERE]}"
+    return statement
+
+
+def _retrieve_state(csr, qualified_name):
+    """ Returns the index's validity and build progress, None if it doesn't exist.
+        If the index isn't being built, the progress fields are None.
+        """
+    csr.execute("""
+                select  i.indisvalid, p.pid, p.phase, p.blocks_done, p.blocks_total, p.tuples_done, p.tuples_total
+                from    pg_index i
+                left join pg_stat_progress_create_index p
+                on      p.index_relid = i.indexrelid
+                where   i.indexrelid = to_regclass(%s)
+                """,
+                (sql.qualified(qualified_name),))
+    row = csr.fetchone()
+    return IndexState(*row) if row else None
+
+
+def _retrieve_attributes(csr, qualified_name):
+    """ Retrieves the index's attributes, for Fn::GetAtt.
+        """
+    query = """
+          select  i.indexrelid::text                  as "Oid",
+                  i.indrelid::regclass::text          as "Table",
+                  pg_get_indexdef(i.indexrelid)       as "Definition",
+                  pg_relation_size(i.indexrelid)      as "SizeBytes"
+          from    pg_index i
+          where   i.indexrelid = to_regclass(%s)
+          """
+    return util.retrieve_attributes(csr, query, (sql.qualified(qualified_name),))
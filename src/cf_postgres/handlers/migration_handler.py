@@ -0,0 +1,320 @@
+""" Handler for Migration resources: applies an ordered list of SQL scripts, recording
+    each script's version and checksum in a tracking table so that it's only applied
+    once.
+    """
+
+import hashlib
+import io
+import logging
+import os
+import sys
+import time
+
+from cf_postgres import sql, util
+from cf_postgres.constants import *
+
+
+# resource configuration
+
+RESOURCE_NAME = "Migration"
+
+PROP_NAME           = "Name"
+PROP_SCRIPTS        = "Scripts"
+PROP_SCHEMA         = "TrackingSchema"
+
+SCRIPT_VERSION      = "Version"
+SCRIPT_SQL          = "Sql"
+SCRIPT_FILE         = "File"
+SCRIPT_TRANSACTION  = "Transactional"
+
+DEFAULT_SCHEMA      = "cf_postgres"
+
+# script files are resolved relative to this directory, which defaults to the
+# "migrations" directory in the deployed Lambda bundle
+
+ENV_MIGRATIONS_DIR  = "CF_POSTGRES_MIGRATIONS_DIR"
+
+# scripts are read in chunks of this size, so that we never hold an entire
+# (potentially huge) script in memory
+
+READ_CHUNK_SIZE     = 65536
+
+
+def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+    if resource_type != RESOURCE_NAME:
+        return False
+    migration_name = util.verify_property(props, response, PROP_NAME)
+    if migration_name:
+        handle(conn, request_type, physical_id, migration_name, props, old_props, response)
+    return True
+
+
+def handle(conn, request_type, physical_id, migration_name, props, old_props, response):
+    logging.info(f"migration_handler: performing {request_type} for migration {migration_name}, resource {physical_id}")
+    try:
+        if request_type in (ACTION_CREATE, ACTION_UPDATE):
+            _doApply(conn, migration_name, props, response)
+        elif request_type == ACTION_DELETE:
+            _doDelete(conn, physical_id, props, response)
+        else:
+            util.report_failure(response, f"migration_handler: Unknown request type: {request_type}")
+    except:
+        util.report_failure(response, f"migration_handler: failed to complete action {request_type} for migration {migration_name}: {sys.exc_info()[1]}", physical_id)
+        conn.rollback()
+    finally:
+        conn.autocommit = False
+
+
+def _doApply(conn, migration_name, props, response):
+    """ Applies all scripts that haven't already been applied. Each script runs in its
+        own transaction (unless marked non-transactional), and is recorded in the same
+        transaction, so a failure leaves earlier scripts applied and recorded.
+        """
+    tracking_table = _ensure_tracking_table(conn, props.get(PROP_SCHEMA, DEFAULT_SCHEMA))
+    applied = _retrieve_applied(conn, tracking_table, migration_name)
+    scripts = props.get(PROP_SCRIPTS, [])
+    applied_count = 0
+    version = None
+    for script in scripts:
+        version = script.get(SCRIPT_VERSION)
+        if not version:
+            raise Exception(f"script without {SCRIPT_VERSION}: {script}")
+        if version in applied:
+            checksum = _checksum(_open_script(script))
+            if checksum != applied[version]:
+                raise Exception(f"script {version} has changed since it was applied")
+            logging.debug(f"migration_handler: skipping script {version}; already applied")
+            continue
+        _apply_script(conn, tracking_table, migration_name, version, script)
+        applied_count += 1
+    logging.info(f"migration_handler: applied {applied_count} of {len(scripts)} scripts for migration {migration_name}")
+    data = { "Version": version, "AppliedCount": str(applied_count) } if version else None
+    util.report_success(response, migration_name, data)
+
+
+def _doDelete(conn, migration_name, props, response):
+    # migrations aren't reversible; the tracking table remains so that scripts
+    # won't be re-applied to a database that already contains their objects
+    logging.info(f"migration_handler: delete of migration {migration_name} does not change database")
+    util.report_success(response, migration_name)
+
+
+def _ensure_tracking_table(conn, schema_name):
+    tracking_table = f"{sql.ident(schema_name)}.migrations"
+    csr = conn.cursor()
+    csr.execute(f"create schema if not exists {sql.ident(schema_name)}")
+    csr.execute(f"""
+                create table if not exists {tracking_table}
+                (
+                    migration_name  text not null,
+                    version         text not null,
+                    checksum        text not null,
+                    applied_at      timestamptz not null default now(),
+                    elapsed_ms      bigint not null,
+                    primary key (migration_name, version)
+                )
+                """)
+    conn.commit()
+    return tracking_table
+
+
+def _retrieve_applied(conn, tracking_table, migration_name):
+    """ Returns a dict of version to checksum for all applied scripts.
+        """
+    csr = conn.cursor()
+    csr.execute(f"select version, checksum from {tracking_table} where migration_name = %s", (migration_name,))
+    rows = csr.fetchall()
+    conn.commit()
+    return dict((version, checksum) for (version, checksum) in rows)
+
+
+def _apply_script(conn, tracking_table, migration_name, version, script):
+    is_transactional = util.get_boolean_prop(script, SCRIPT_TRANSACTION, True)
+    logging.info(f"migration_handler: applying script {version} for migration {migration_name}"
+                 + ("" if is_transactional else " (non-transactional)"))
+    start = time.time()
+    digest = hashlib.sha256()
+    conn.autocommit = not is_transactional
+    csr = conn.cursor()
+    statement_count = 0
+    for statement in _split_statements(_open_script(script), digest):
+        csr.execute(statement)
+        statement_count += 1
+    elapsed_ms = int((time.time() - start) * 1000)
+    csr.execute(f"insert into {tracking_table} (migration_name, version, checksum, elapsed_ms) values (%s, %s, %s, %s)",
+                (migration_name, version, digest.hexdigest(), elapsed_ms))
+    if is_transactional:
+        conn.commit()
+    conn.autocommit = False
+    logging.info(f"migration_handler: applied script {version} ({statement_count} statements) in {elapsed_ms} ms")
+
+
+def _open_script(script):
+    """ Returns a generator that reads the script in chunks, from either the inline
+        SQL or a file.
+        """
+    if script.get(SCRIPT_SQL) is not None:
+        return _read_chunks(io.StringIO(script[SCRIPT_SQL]))
+    elif script.get(SCRIPT_FILE):
+        return _read_file_chunks(_resolve_file(script[SCRIPT_FILE]))
+    else:
+        raise Exception(f"script {script.get(SCRIPT_VERSION)} must specify either {SCRIPT_SQL} or {SCRIPT_FILE}")
+
+
+def _resolve_file(filename):
+    default_dir = os.path.join(os.environ.get("LAMBDA_TASK_ROOT", os.getcwd()), "migrations")
+    base_dir = os.path.abspath(os.environ.get(ENV_MIGRATIONS_DIR, default_dir))
+    path = os.path.abspath(os.path.join(base_dir, filename))
+    if os.path.commonpath([base_dir, path]) != base_dir:
+        raise Exception(f"script file is outside migrations directory: {filename}")
+    return path
+
+
+def _read_file_chunks(path):
+    with open(path, encoding="utf-8") as f:
+        yield from _read_chunks(f)
+
+
+def _read_chunks(f):
+    while True:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _checksum(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _split_statements(chunks, digest=None):
+    """ Splits a script into individual statements, yielding each as soon as it's
+        complete. Understands quoted strings and identifiers, dollar-quoting, and
+        comments, so that semicolons within them don't end the statement. If passed
+        a hashlib object, updates it with the script contents.
+        """
+    statement = []
+    state = None            # None, "'", '"', "--", "/*", or a dollar-quote tag
+    escapes = False         # true for E'' strings, where backslash escapes
+    comment_depth = 0
+    pending = ""            # characters held back until we know what they mean
+    for chunk in chunks:
+        if digest:
+            digest.update(chunk.encode("utf-8"))
+        text = pending + chunk
+        pending = ""
+        i = 0
+        while i < len(text):
+            c = text[i]
+            if state is None:
+                if c in "-/$" and i + 1 == len(text):
+                    pending = c
+                    break
+                if c == ";":
+                    sql = "".join(statement).strip()
+                    if sql:
+                        yield sql
+                    statement = []
+                    i += 1
+                    continue
+                if c == "'":
+                    preceding = "".join(statement[-2:])[-2:]
+                    escapes = preceding[-1:] in ("e", "E") and not (preceding[:-1].isalnum() or preceding[:-1] == "_")
+                    state = "'"
+                elif c == '"':
+                    escapes = False
+                    state = '"'
+                elif text.startswith("--", i):
+                    state = "--"
+                elif text.startswith("/*", i):
+                    state = "/*"
+                    comment_depth = 1
+                    statement.append("/*")
+                    i += 2
+                    continue
+                elif c == "$":
+                    end = i + 1
+                    while end < len(text) and (text[end].isalnum() or text[end] == "_"):
+                        end += 1
+                    if end == len(text):
+                        pending = text[i:]
+                        break
+                    tag = text[i:end+1]
+                    if _is_dollar_tag(tag):
+                        state = tag
+                        statement.append(tag)
+                        i = end + 1
+                        continue
+                statement.append(c)
+                i += 1
+            elif state == "'" or state == '"':
+                if escapes and c == "\\":
+                    if i + 1 == len(text):
+                        pending = c
+                        break
+                    statement.append(text[i:i+2])
+                    i += 2
+                    continue
+                if c == state:
+                    if i + 1 == len(text):
+                        pending = c
+                        break
+                    if text[i+1] == state:
+                        statement.append(c + c)
+                        i += 2
+                        continue
+                    state = None
+                statement.append(c)
+                i += 1
+            elif state == "--":
+                if c == "\n":
+                    state = None
+                statement.append(c)
+                i += 1
+            elif state == "/*":
+                if c in "/*" and i + 1 == len(text):
+                    pending = c
+                    break
+                if text.startswith("/*", i):
+                    comment_depth += 1
+                    statement.append("/*")
+                    i += 2
+                elif text.startswith("*/", i):
+                    comment_depth -= 1
+                    if comment_depth == 0:
+                        state = None
+                    statement.append("*/")
+                    i += 2
+                else:
+                    statement.append(c)
+                    i += 1
+            else:
+                if text.startswith(state, i):
+                    statement.append(state)
+                    i += len(state)
+                    state = None
+                elif c == "$" and len(text) - i < len(state):
+                    pending = text[i:]
+                    break
+                else:
+                    statement.append(c)
+                    i += 1
+    statement.append(pending)
+    sql = "".join(statement).strip()
+    if sql:
+        yield sql
+
+
+def _is_dollar_tag(tag):
+    """ Determines whether the passed string is a valid dollar-quote tag ($$ or $name$).
+        Positional parameters ($1) are not tags.
+        """
+    if not tag.endswith("$"):
+        return False
+    body = tag[1:-1]
+    if not body:
+        return True
+    return (body[0].isalpha() or body[0] == "_") and all(ch.isalnum() or ch == "_" for ch in body)
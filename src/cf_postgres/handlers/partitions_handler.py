@@ -0,0 +1,217 @@
+""" Handler for Partitions resources: maintains the partitions of a table that's
+    range-partitioned by date, creating partitions ahead of the current date and
+    detaching or dropping those that have passed their retention period.
+    """
+
+import datetime
+import logging
+import re
+import sys
+import time
+
+from cf_postgres import sql, util
+from cf_postgres.constants import *
+
+
+# resource configuration
+
+RESOURCE_NAME = "Partitions"
+
+PROP_TABLE          = "Table"
+PROP_INTERVAL       = "Interval"
+PROP_LOOKAHEAD      = "Lookahead"
+PROP_RETENTION      = "Retention"
+PROP_EXPIRE_ACTION  = "ExpireAction"
+
+DEFAULT_LOOKAHEAD   = 7
+
+EXPIRE_DETACH       = "detach"
+EXPIRE_DROP         = "drop"
+
+# supported intervals, with the format of the partition-name suffix for each
+
+INTERVAL_FORMATS = {
+    "day":      "%Y%m%d",
+    "week":     "%Y%m%d",
+    "month":    "%Y%m",
+    "year":     "%Y",
+    }
+
+# creating or detaching a partition locks the parent table; we'd rather fail than
+# wait behind (and block everyone else behind) a long-running query
+
+LOCK_TIMEOUT = "10s"
+
+
+def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+    if resource_type != RESOURCE_NAME:
+        return False
+    table_name = util.verify_property(props, response, PROP_TABLE)
+    if table_name:
+        handle(conn, request_type, physical_id, table_name, props, old_props, response)
+    return True
+
+
+def handle(conn, request_type, physical_id, table_name, props, old_props, response):
+    logging.info(f"partitions_handler: performing {request_type} for table {table_name}, resource {physical_id}")
+    try:
+        if request_type == ACTION_CREATE:
+            _doApply(conn, table_name, props, response)
+        elif request_type == ACTION_UPDATE:
+            _doUpdate(conn, physical_id, table_name, props, old_props, response)
+        elif request_type == ACTION_DELETE:
+            _doDelete(conn, physical_id, props, response)
+        else:
+            util.report_failure(response, f"partitions_handler: Unknown request type: {request_type}")
+    except:
+        util.report_failure(response, f"partitions_handler: failed to complete action {request_type} for table {table_name}: {sys.exc_info()[1]}", physical_id)
+        conn.rollback()
+
+
+def _doUpdate(conn, physical_id, table_name, props, old_props, response):
+    # existing partitions are identified by name, and those names depend on the interval
+    if old_props.get(PROP_INTERVAL) and old_props.get(PROP_INTERVAL).lower() != props.get(PROP_INTERVAL, "").lower():
+        raise Exception(f"{PROP_INTERVAL} can't be changed")
+    _doApply(conn, table_name, props, response)
+
+
+def _doDelete(conn, table_name, props, response):
+    # partitions contain data, so they're left in place
+    logging.info(f"partitions_handler: delete of partitions for {table_name} does not change database")
+    util.report_success(response, table_name)
+
+
+def _doApply(conn, table_name, props, response):
+    """ Brings the table's partitions up to date: creates any that are missing from
+        the current period through the lookahead window, and detaches or drops those
+        older than the retention window. All changes are made in one transaction.
+        """
+    (interval, lookahead, retention, expire_action) = _extract_props(props)
+    start = time.time()
+    csr = conn.cursor()
+    existing = _retrieve_partitions(csr, table_name, interval)
+    current = _period_start(_today(), interval)
+    wanted = [_add_periods(current, interval, n) for n in range(lookahead + 1)]
+    to_create = [p for p in wanted if p not in existing]
+    to_expire = []
+    if retention is not None:
+        oldest = _add_periods(current, interval, -retention)
+        to_expire = sorted(p for p in existing if p < oldest)
+    csr.execute(f"set local lock_timeout = '{LOCK_TIMEOUT}'")
+    # partition bounds are dates in UTC; this matters if the partition key is timestamptz
+    csr.execute("set local time zone 'UTC'")
+    for period in to_create:
+        csr.execute(f"create table if not exists {_partition_name(table_name, interval, period)} "
+                    f"partition of {sql.qualified(table_name)} "
+                    f"for values from ('{period.isoformat()}') to ('{_add_periods(period, interval, 1).isoformat()}')")
+    for period in to_expire:
+        partition_name = _partition_name(table_name, interval, period)
+        if expire_action == EXPIRE_DROP:
+            csr.execute(f"drop table {partition_name}")
+        else:
+            csr.execute(f"alter table {sql.qualified(table_name)} detach partition {partition_name}")
+    conn.commit()
+    logging.info(f"partitions_handler: created {len(to_create)} partitions and {expire_action} {len(to_expire)} partitions "
+                 f"of {table_name} in {time.time() - start:.3f} seconds")
+    remaining = sorted((set(existing) | set(to_create)) - set(to_expire))
+    data = {
+        "Count":    str(len(remaining)),
+        "Oldest":   _partition_name(table_name, interval, remaining[0]),
+        "Newest":   _partition_name(table_name, interval, remaining[-1]),
+        }
+    util.report_success(response, table_name, data)
+
+
+def _extract_props(props):
+    """ Extracts and validates properties as a tuple: (interval, lookahead, retention,
+        expire_action). Retention is None if partitions should be kept forever.
+        """
+    interval = (props.get(PROP_INTERVAL) or "").lower()
+    if interval not in INTERVAL_FORMATS:
+        raise Exception(f"{PROP_INTERVAL} must be one of: {', '.join(INTERVAL_FORMATS.keys())}")
+    expire_action = (props.get(PROP_EXPIRE_ACTION) or EXPIRE_DETACH).lower()
+    if expire_action not in (EXPIRE_DETACH, EXPIRE_DROP):
+        raise Exception(f"{PROP_EXPIRE_ACTION} must be either {EXPIRE_DETACH} or {EXPIRE_DROP}")
+    return (
+        interval,
+        util.get_int_prop(props, PROP_LOOKAHEAD, DEFAULT_LOOKAHEAD),
+        util.get_int_prop(props, PROP_RETENTION),
+        expire_action,
+        )
+
+
+def _retrieve_partitions(csr, table_name, interval):
+    """ Returns the start dates of the table's existing partitions, identified by
+        name. Partitions that don't follow our naming convention (such as a default
+        partition) are ignored.
+        """
+    csr.execute("""
+                select  c.relname
+                from    pg_inherits i
+                join    pg_class c
+                on      c.oid = i.inhrelid
+                where   i.inhparent = to_regclass(%s)
+                """,
+                (sql.qualified(table_name),))
+    prefix = sql.name(sql.split(table_name)[-1]) + "_"
+    result = set()
+    for (name,) in csr.fetchall():
+        if name.startswith(prefix):
+            period = _parse_suffix(name[len(prefix):], interval)
+            if period:
+                result.add(period)
+    return result
+
+
+def _today():
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def _period_start(date, interval):
+    if interval == "week":
+        return date - datetime.timedelta(days=date.weekday())
+    elif interval == "month":
+        return date.replace(day=1)
+    elif interval == "year":
+        return date.replace(month=1, day=1)
+    return date
+
+
+def _add_periods(start, interval, count):
+    """ Returns the start of the period that's count periods after (or before, if
+        negative) the period beginning with start.
+        """
+    if interval == "day":
+        return start + datetime.timedelta(days=count)
+    elif interval == "week":
+        return start + datetime.timedelta(weeks=count)
+    elif interval == "month":
+        months = start.year * 12 + start.month - 1 + count
+        return start.replace(year=months // 12, month=months % 12 + 1)
+    else:
+        return start.replace(year=start.year + count)
+
+
+def _partition_name(table_name, interval, period):
+    """ Returns the partition's qualified name, quoted for use in SQL. Partitions are
+        in the same schema as their table, with a suffix identifying the period.
+        """
+    parts = sql.split(table_name)
+    partition = sql.name(parts[-1]) + "_" + period.strftime(INTERVAL_FORMATS[interval])
+    return ".".join([sql.ident(p) for p in parts[:-1]] + [sql.quote(partition)])
+
+
+def _parse_suffix(suffix, interval):
+    """ Returns the start date of the period identified by a partition-name suffix,
+        None if the suffix isn't valid for the interval.
+        """
+    if not re.fullmatch(r"[0-9]+", suffix):
+        return None
+    try:
+        date = datetime.datetime.strptime(suffix, INTERVAL_FORMATS[interval]).date()
+    except ValueError:
+        return None
+    if date != _period_start(date, interval) or suffix != date.strftime(INTERVAL_FORMATS[interval]):
+        return None
+    return date
+
@@ -0,0 +1,126 @@
+""" Handler for RoleMembership resources: grants a role (typically a group role) to a
+    list of members.
+    """
+
+import logging
+import sys
+
+from cf_postgres import sql, util
+from cf_postgres.constants import *
+
+
+# resource configuration
+
+RESOURCE_NAME = "RoleMembership"
+
+PROP_ROLE       = "Role"
+PROP_MEMBERS    = "Members"
+
+# statements
+
+GRANT_ROLE      = sql.template("grant {role_name:ident} to {members:names}")
+REVOKE_ROLE     = sql.template("revoke {role_name:ident} from {members:names}")
+
+
+def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+    if resource_type != RESOURCE_NAME:
+        return False
+    role_name = util.verify_property(props, response, PROP_ROLE)
+    if role_name:
+        handle(conn, request_type, physical_id, role_name, props, old_props, response)
+    return True
+
+
+def handle(conn, request_type, physical_id, role_name, props, old_props, response):
+    logging.info(f"role_membership_handler: performing {request_type} for role {role_name}, resource {physical_id}")
+    try:
+        if request_type == ACTION_CREATE:
+            _doCreate(conn, role_name, props, response)
+        elif request_type == ACTION_UPDATE:
+            _doUpdate(conn, physical_id, role_name, props, old_props, response)
+        elif request_type == ACTION_DELETE:
+            _doDelete(conn, physical_id, props, response)
+        else:
+            util.report_failure(response, f"role_membership_handler: Unknown request type: {request_type}")
+    except:
+        util.report_failure(response, f"role_membership_handler: failed to complete action {request_type} for role {role_name}: {sys.exc_info()[1]}", physical_id)
+        conn.rollback()
+
+
+def _doCreate(conn, role_name, props, response):
+    csr = conn.cursor()
+    current = _retrieve_members(csr, [role_name])
+    members = _apply_changes(csr, role_name, current.get(sql.name(role_name), set()), set(), _members(props))
+    conn.commit()
+    util.report_success(response, role_name, _attributes(members))
+
+
+def _doUpdate(conn, physical_id, role_name, props, old_props, response):
+    old_members = _members(old_props)
+    new_members = _members(props)
+    csr = conn.cursor()
+    current = _retrieve_members(csr, [physical_id, role_name])
+    if sql.name(physical_id) != sql.name(role_name):
+        # members were managed for a different role; remove them all from it
+        _apply_changes(csr, physical_id, current.get(sql.name(physical_id), set()), old_members, set())
+        old_members = set()
+    members = _apply_changes(csr, role_name, current.get(sql.name(role_name), set()), old_members, new_members)
+    conn.commit()
+    util.report_success(response, role_name, _attributes(members))
+
+
+def _doDelete(conn, role_name, props, response):
+    csr = conn.cursor()
+    current = _retrieve_members(csr, [role_name])
+    _apply_changes(csr, role_name, current.get(sql.name(role_name), set()), _members(props), set())
+    conn.commit()
+    util.report_success(response, role_name)
+
+
+def _retrieve_members(csr, role_names):
+    """ Retrieves the current members of the named roles, as a dict keyed by role name.
+        Role and member names are as they appear in the catalog.
+        """
+    query = """
+          select  r.rolname as role_name,
+                  m.rolname as member_name
+          from    pg_auth_members a
+          join    pg_roles r on r.oid = a.roleid
+          join    pg_roles m on m.oid = a.member
+          where   r.rolname = any(%s)
+          """
+    csr.execute(query, (list(set(sql.name(r) for r in role_names)),))
+    result = {}
+    for (role_name, member_name) in csr.fetchall():
+        result.setdefault(role_name, set()).add(member_name)
+    return result
+
+
+def _apply_changes(csr, role_name, current, old_members, new_members):
+    """ Grants the role to new members that don't already have it, and revokes it from
+        previously-managed members that are no longer listed. Members that were granted
+        the role outside of this resource are left alone. Each is a single statement,
+        regardless of the number of members affected. Returns the resulting members.
+        """
+    to_revoke = sorted((old_members - new_members) & current)
+    to_grant  = sorted(new_members - current)
+    logging.info(f"role_membership_handler: role {role_name} has {len(current)} members; "
+                 f"granting to {len(to_grant)}, revoking from {len(to_revoke)}")
+    if to_revoke:
+        csr.execute(REVOKE_ROLE(role_name=role_name, members=to_revoke))
+    if to_grant:
+        csr.execute(GRANT_ROLE(role_name=role_name, members=to_grant))
+    return (current - set(to_revoke)) | set(to_grant)
+
+
+def _members(props):
+    """ Returns the members listed in the properties, as they appear in the catalog.
+        """
+    return set(sql.name(m) for m in props.get(PROP_MEMBERS, []))
+
+
+def _attributes(members):
+    """ Returns attributes for Fn::GetAtt. These are derived from the membership that
+        was read before making changes, so don't require another query.
+        """
+    return { "Members": ",".join(sorted(members)) }
@@ -3,8 +3,9 @@
 
 import logging
 import sys
+import time
 
-from cf_postgres import util
+from cf_postgres import sql, util
 from cf_postgres.constants import *
 
 
@@ -19,6 +20,76 @@ PROP_READONLY   = "ReadOnly"
 PROP_USERS      = "Users"
 PROP_ROUSERS    = "ReadOnlyUsers"
 PROP_CASCADE    = "Cascade"
+PROP_EXISTING   = "GrantExisting"
+PROP_BATCH_SIZE = "CascadeBatchSize"
+PROP_TEMPLATE   = "Template"
+PROP_TRANSFER   = "TransferOwnership"
+PROP_TRANSFER_BATCH_SIZE = "TransferOwnershipBatchSize"
+
+# privileges on existing objects, as (object class, full access, read-only access)
+
+EXISTING_OBJECT_PRIVILEGES = [
+    ("tables",      "all",  "select"),
+    ("sequences",   "all",  "select, usage"),
+    ("functions",   "all",  "execute"),
+    ]
+
+# limits the time that we'll wait for a catalog lock when updating existing objects
+
+EXISTING_OBJECT_LOCK_TIMEOUT = "10s"
+
+# when granting/revoking privileges or transferring ownership of existing objects,
+# this many statements are sent to the database in a single round-trip
+
+STATEMENTS_PER_EXECUTE = 100
+
+# statements
+
+CREATE_SCHEMA       = sql.template("create schema if not exists {schema_name:ident}")
+CREATE_OWNED_SCHEMA = sql.template("create schema if not exists {schema_name:ident} authorization {owner_name:role}")
+ALTER_OWNER         = sql.template("alter schema {schema_name:ident} owner to  {owner_name:role}")
+RENAME_SCHEMA       = sql.template("alter schema {old_name:ident} rename to  {schema_name:ident}")
+DROP_SCHEMA         = sql.template("drop schema if exists {schema_name:ident}")
+DROP_SCHEMA_CASCADE = sql.template("drop schema if exists {schema_name:ident} cascade")
+DROP_OBJECTS        = sql.template("drop {kind} if exists {names} cascade")
+ALTER_OBJECT_OWNER  = sql.template("alter {kind} {name} owner to {owner}")
+SET_SEARCH_PATH     = sql.template("set local search_path to {schema_name:ident}")
+GRANT_EXISTING      = sql.template("grant {privs} on all {object_class} in schema {schema_name:ident} to {recipients:roles}")
+REVOKE_EXISTING     = sql.template("revoke {privs} on all {object_class} in schema {schema_name:ident} from {recipients:roles}")
+
+# statements applied for each grantee, keyed by whether they're read-only
+
+GRANTS = {
+    True: [
+        sql.template("grant usage on schema {schema_name:ident} to {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} grant select on tables to {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} grant select, usage on sequences to {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} grant execute on functions to {recipient:role}"),
+        ],
+    False: [
+        sql.template("grant all on schema {schema_name:ident} to {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} grant all on tables to {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} grant all on sequences to {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} grant all on functions to {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} grant all on types to {recipient:role}"),
+        ],
+    }
+
+REVOKES = {
+    True: [
+        sql.template("revoke usage on schema {schema_name:ident} from {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} revoke select on tables from {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} revoke select, usage on sequences from {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} revoke execute on functions from {recipient:role}"),
+        ],
+    False: [
+        sql.template("revoke all on schema {schema_name:ident} from {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} revoke all on tables from {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} revoke all on sequences from {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} revoke all on functions from {recipient:role}"),
+        sql.template("alter default privileges in schema {schema_name:ident} revoke all on types from {recipient:role}"),
+        ],
+    }
 
 
 def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
@@ -50,17 +121,27 @@ def _doCreate(conn, schema_name, props, response):
     (owner_name, is_public, is_readonly, users, ro_users) = _extract_props(props)
     csr = conn.cursor()
     if owner_name:
-        csr.execute(f"create schema if not exists {schema_name} authorization {owner_name}")
+        csr.execute(CREATE_OWNED_SCHEMA(schema_name=schema_name, owner_name=owner_name))
     else:
-        csr.execute(f"create schema if not exists {schema_name}")
+        csr.execute(CREATE_SCHEMA(schema_name=schema_name))
+    grants = []
     if is_public or is_readonly:
-        _apply_grants(csr, schema_name, "PUBLIC", is_readonly)
+        grants.append(("PUBLIC", is_readonly))
     for user in users:
-        _apply_grants(csr, schema_name, user, False)
+        grants.append((user, False))
     for user in ro_users:
-        _apply_grants(csr, schema_name, user, True)
+        grants.append((user, True))
+    _apply_grants(csr, schema_name, grants)
+    template_name = props.get(PROP_TEMPLATE)
+    if template_name:
+        _clone_template(csr, schema_name, template_name)
+    if util.get_boolean_prop(props, PROP_EXISTING):
+        _apply_existing_object_privileges(csr, schema_name, grants, False)
+    if util.get_boolean_prop(props, PROP_TRANSFER):
+        _transfer_ownership(conn, schema_name, util.get_int_prop(props, PROP_TRANSFER_BATCH_SIZE))
+    data = _retrieve_attributes(csr, schema_name)
     conn.commit()
-    util.report_success(response, schema_name)
+    util.report_success(response, schema_name, data)
 
 
 def _doUpdate(conn, physical_id, schema_name, props, old_props, response):
@@ -69,41 +150,524 @@ def _doUpdate(conn, physical_id, schema_name, props, old_props, response):
     schema_name = _opt_rename_schema(conn, physical_id, schema_name)
     csr = conn.cursor()
     if new_owner_name != old_owner_name:
-        csr.execute(f"alter schema {schema_name} owner to  {new_owner_name}")
-    if old_is_public and not new_is_public:
-        _apply_revokes(csr, schema_name, "PUBLIC", old_is_readonly)
-        _apply_grants(csr, schema_name, "PUBLIC", new_is_readonly)
-    if new_is_public and not old_is_public:
-        _apply_revokes(csr, schema_name, "PUBLIC", old_is_readonly)
-        _apply_grants(csr, schema_name, "PUBLIC", new_is_readonly)
+        csr.execute(ALTER_OWNER(schema_name=schema_name, owner_name=new_owner_name))
+    revokes = []
+    grants = []
+    # PUBLIC is granted access when the schema is either Public or ReadOnly, so only
+    # revoke what was granted before, and only grant what the update calls for
+    old_public_access = (old_is_public or old_is_readonly, old_is_readonly)
+    new_public_access = (new_is_public or new_is_readonly, new_is_readonly)
+    if old_public_access != new_public_access:
+        if old_public_access[0]:
+            revokes.append(("PUBLIC", old_is_readonly))
+        if new_public_access[0]:
+            grants.append(("PUBLIC", new_is_readonly))
     for user in old_users:
         if not user in new_users:
-            _apply_revokes(csr, schema_name, user, False)
+            revokes.append((user, False))
     for user in old_ro_users:
         if not user in new_ro_users:
-            _apply_revokes(csr, schema_name, user, True)
+            revokes.append((user, True))
     for user in new_ro_users:
         if not user in old_ro_users:
-            _apply_grants(csr, schema_name, user, True)
+            grants.append((user, True))
     for user in new_users:
         if not user in old_users:
-            _apply_grants(csr, schema_name, user, False)
-            
+            grants.append((user, False))
+    _apply_revokes(csr, schema_name, revokes)
+    _apply_grants(csr, schema_name, grants)
+    if util.get_boolean_prop(props, PROP_EXISTING):
+        _apply_existing_object_privileges(csr, schema_name, revokes, True)
+        _apply_existing_object_privileges(csr, schema_name, grants, False)
+    if util.get_boolean_prop(props, PROP_TRANSFER):
+        _transfer_ownership(conn, schema_name, util.get_int_prop(props, PROP_TRANSFER_BATCH_SIZE))
+    data = _retrieve_attributes(csr, schema_name)
     conn.commit()
-    util.report_success(response, schema_name)
+    util.report_success(response, schema_name, data)
 
 
 def _doDelete(conn, schema_name, props, response):
     cascade = util.get_boolean_prop(props, PROP_CASCADE)
+    batch_size = util.get_int_prop(props, PROP_BATCH_SIZE)
+    if cascade and batch_size:
+        _drop_contents_in_batches(conn, schema_name, batch_size)
     csr = conn.cursor()
     if cascade:
-        csr.execute(f"drop schema if exists {schema_name} cascade")
+        csr.execute(DROP_SCHEMA_CASCADE(schema_name=schema_name))
     else:
-        csr.execute(f"drop schema if exists {schema_name}")
+        csr.execute(DROP_SCHEMA(schema_name=schema_name))
     conn.commit()
     util.report_success(response, schema_name)
 
 
+def _drop_contents_in_batches(conn, schema_name, batch_size):
+    """ Drops the objects in a schema, at most batch_size per transaction, so that a
+        huge schema doesn't need a huge lock set. Each batch is committed, so if the
+        Lambda times out a subsequent delete resumes with the objects that remain.
+        """
+    csr = conn.cursor()
+    total = 0
+    while True:
+        start = time.time()
+        objects = _select_droppable_objects(csr, schema_name, batch_size)
+        if not objects:
+            break
+        by_kind = {}
+        for (kind, name) in objects:
+            by_kind.setdefault(kind, []).append(name)
+        for kind, names in by_kind.items():
+            csr.execute(DROP_OBJECTS(kind=kind, names=", ".join(names)))
+        conn.commit()
+        total += len(objects)
+        logging.info(f"schema_handler: dropped {len(objects)} objects from schema {schema_name} "
+                     f"in {time.time() - start:.3f} seconds; {total} dropped so far")
+    logging.info(f"schema_handler: dropped {total} objects from schema {schema_name}")
+
+
+# common table expressions that enumerate the objects in a schema (identified by the
+# query's first parameter), other than those that belong to extensions or that are
+# managed along with another object (eg, a range type's constructor functions); kind
+# is the keyword used to drop or alter the object, pass is the order for dropping,
+# and follows_table identifies relations (owned sequences) that depend on another
+
+SCHEMA_OBJECTS = """
+          with n as
+                  (
+                  select  oid, nspowner
+                  from    pg_namespace
+                  where   oid = to_regnamespace(%s)
+                  ),
+               objects as
+                  (
+                  select  x.*
+                  from    (
+                          select  case c.relkind
+                                      when 'v' then 'view'
+                                      when 'm' then 'materialized view'
+                                      when 'S' then 'sequence'
+                                      when 'f' then 'foreign table'
+                                      else 'table'
+                                  end as kind,
+                                  c.oid::regclass::text as name,
+                                  'pg_class'::regclass as classid,
+                                  c.oid as objid,
+                                  c.relowner as owner,
+                                  1 as pass,
+                                  c.relispartition as is_partition,
+                                  exists
+                                  (
+                                  select  1
+                                  from    pg_depend d
+                                  where   d.classid = 'pg_class'::regclass
+                                  and     d.objid = c.oid
+                                  and     d.refclassid = 'pg_class'::regclass
+                                  and     d.deptype in ('a', 'i')
+                                  ) as follows_table
+                          from    pg_class c
+                          join    n
+                          on      n.oid = c.relnamespace
+                          where   c.relkind in ('r', 'p', 'v', 'm', 'S', 'f')
+                          union all
+                          select  case p.prokind
+                                      when 'p' then 'procedure'
+                                      when 'a' then 'aggregate'
+                                      else 'function'
+                                  end,
+                                  p.oid::regprocedure::text,
+                                  'pg_proc'::regclass,
+                                  p.oid,
+                                  p.proowner,
+                                  2,
+                                  false,
+                                  false
+                          from    pg_proc p
+                          join    n
+                          on      n.oid = p.pronamespace
+                          where   not exists
+                                  (
+                                  select  1
+                                  from    pg_depend d
+                                  where   d.classid = 'pg_proc'::regclass
+                                  and     d.objid = p.oid
+                                  and     d.deptype = 'i'
+                                  )
+                          union all
+                          select  case t.typtype when 'd' then 'domain' else 'type' end,
+                                  t.oid::regtype::text,
+                                  'pg_type'::regclass,
+                                  t.oid,
+                                  t.typowner,
+                                  3,
+                                  false,
+                                  false
+                          from    pg_type t
+                          join    n
+                          on      n.oid = t.typnamespace
+                          left join pg_class c
+                          on      c.oid = t.typrelid
+                          where   t.typtype in ('c', 'd', 'e', 'r')
+                          and     (t.typrelid = 0 or c.relkind = 'c')
+                          ) x
+                  where   not exists
+                          (
+                          select  1
+                          from    pg_depend e
+                          where   e.classid = x.classid
+                          and     e.objid = x.objid
+                          and     e.deptype = 'e'
+                          )
+                  )
+          """
+
+
+def _select_droppable_objects(csr, schema_name, limit):
+    """ Returns (kind, name) tuples for the top-level objects in a schema, in the order
+        that they should be dropped, where kind is the keyword used to drop them. This
+        excludes objects that are dropped along with another object (eg, sequences owned
+        by a column, partitions, a range type's constructors), and objects that belong
+        to extensions.
+        """
+    query = SCHEMA_OBJECTS + """
+          select  kind, name
+          from    objects
+          where   not is_partition
+          and     not follows_table
+          order by pass, name
+          limit   %s
+          """
+    csr.execute(query, (sql.ident(schema_name), limit))
+    return csr.fetchall()
+
+
+def _transfer_ownership(conn, schema_name, batch_size):
+    """ Makes the schema's owner the owner of all objects in the schema. Objects that
+        need to change are identified by a single catalog query, and the ALTERs are
+        sent in groups to minimize round-trips.
+
+        If batch_size is None, this happens in the current transaction. Otherwise the
+        current transaction is committed, and objects are transferred at most
+        batch_size per transaction, so that a huge schema doesn't need a huge lock
+        set; if the Lambda times out, a subsequent update resumes with the objects
+        that remain.
+        """
+    csr = conn.cursor()
+    if batch_size:
+        conn.commit()
+    start = time.time()
+    counts = {}
+    while True:
+        batch_start = time.time()
+        csr.execute(f"set local lock_timeout = '{EXISTING_OBJECT_LOCK_TIMEOUT}'")
+        objects = _select_transferable_objects(csr, schema_name, batch_size)
+        if not objects:
+            break
+        statements = [ALTER_OBJECT_OWNER(kind=kind, name=name, owner=owner) for (kind, name, owner) in objects]
+        for combined in sql.batch(statements, STATEMENTS_PER_EXECUTE):
+            csr.execute(combined)
+        for (kind, name, owner) in objects:
+            counts[kind] = counts.get(kind, 0) + 1
+        if not batch_size:
+            break
+        conn.commit()
+        logging.info(f"schema_handler: transferred ownership of {len(objects)} objects in schema {schema_name} "
+                     f"in {time.time() - batch_start:.3f} seconds; {sum(counts.values())} transferred so far")
+    summary = ", ".join(f"{count} {kind}" for (kind, count) in sorted(counts.items())) or "no changes needed"
+    logging.info(f"schema_handler: transferred ownership of {sum(counts.values())} objects in schema {schema_name} "
+                 f"({summary}) in {time.time() - start:.3f} seconds")
+
+
+def _select_transferable_objects(csr, schema_name, limit):
+    """ Returns (kind, name, owner) tuples for the objects in a schema that aren't owned
+        by the schema's owner, where kind is the keyword used to alter them and owner
+        is the schema's owner. This excludes objects whose ownership follows another
+        object (indexes, sequences owned by a column, a range type's constructors),
+        and objects that belong to extensions. A limit of None returns all objects.
+        """
+    query = SCHEMA_OBJECTS + """
+          select  objects.kind, objects.name, quote_ident(pg_get_userbyid(n.nspowner))
+          from    objects
+          cross join n
+          where   objects.owner <> n.nspowner
+          and     not (objects.kind = 'sequence' and objects.follows_table)
+          order by objects.kind, objects.name
+          limit   %s
+          """
+    csr.execute(query, (sql.ident(schema_name), limit))
+    return csr.fetchall()
+
+
+def _clone_template(csr, schema_name, template_name):
+    """ Copies the objects in a template schema into a newly-created schema, as part
+        of the current transaction. The DDL is generated by a single catalog query,
+        which runs with the template as the search path so that references to its
+        objects are unqualified; it's then executed with the new schema as the search
+        path, so that those references resolve to the copies.
+
+        When planning, there's no template to examine, so a placeholder takes the
+        place of the generated DDL.
+        """
+    start = time.time()
+    planning = util.is_planning()
+    if not planning:
+        csr.execute("select nspname from pg_namespace where oid = to_regnamespace(%s)", (sql.ident(template_name),))
+        if not csr.fetchone():
+            raise Exception(f"template schema {template_name} does not exist")
+    csr.execute(SET_SEARCH_PATH(schema_name=template_name))
+    statements = _select_template_ddl(csr, template_name)
+    if planning:
+        statements = [f"-- statements generated from template schema {template_name}"]
+    csr.execute(SET_SEARCH_PATH(schema_name=schema_name))
+    csr.execute("set local check_function_bodies = off")
+    for ddl in statements:
+        csr.execute(ddl)
+    logging.info(f"schema_handler: copied template schema {template_name} to {schema_name} "
+                 f"using {len(statements)} statements in {time.time() - start:.3f} seconds")
+
+
+def _select_template_ddl(csr, template_name):
+    """ Returns the statements that recreate a template schema's types (enums,
+        domains, and composites), sequences, tables (including partitions), functions,
+        column defaults, constraints, indexes, and views, in an order that satisfies
+        their dependencies. Objects that are
+        created implicitly (identity sequences, constraint indexes, and anything
+        inherited by a partition) are omitted, as are extension members and the
+        functions that Postgres creates for a type (eg, range constructors).
+        """
+    query = """
+          with rels as
+                  (
+                  select  c.*
+                  from    pg_class c
+                  where   c.relnamespace = to_regnamespace(%s)
+                  and     not exists
+                          (
+                          select  1
+                          from    pg_depend e
+                          where   e.classid = 'pg_class'::regclass
+                          and     e.objid = c.oid
+                          and     e.deptype = 'e'
+                          )
+                  ),
+               types as
+                  (
+                  select  t.*
+                  from    pg_type t
+                  where   t.typnamespace = to_regnamespace(%s)
+                  and     not exists
+                          (
+                          select  1
+                          from    pg_depend e
+                          where   e.classid = 'pg_type'::regclass
+                          and     e.objid = t.oid
+                          and     e.deptype = 'e'
+                          )
+                  )
+          select  ddl
+          from    (
+                  select  -2 as pass,
+                          t.oid::int8 as seq,
+                          format('create type %I as enum (%s)',
+                                 t.typname,
+                                 (
+                                 select  coalesce(string_agg(quote_literal(e.enumlabel), ', ' order by e.enumsortorder), '')
+                                 from    pg_enum e
+                                 where   e.enumtypid = t.oid
+                                 )) as ddl
+                  from    types t
+                  where   t.typtype = 'e'
+                  union all
+                  select  -1,
+                          t.oid::int8,
+                          format('create domain %I as %s%s%s%s%s',
+                                 t.typname,
+                                 format_type(t.typbasetype, t.typtypmod),
+                                 (
+                                 select  ' collate ' || quote_ident(cl.collname)
+                                 from    pg_collation cl
+                                 where   cl.oid = t.typcollation
+                                 and     t.typcollation <> bt.typcollation
+                                 ),
+                                 case when t.typdefault is not null then ' default ' || t.typdefault else '' end,
+                                 case when t.typnotnull then ' not null' else '' end,
+                                 (
+                                 select  coalesce(string_agg(format(' constraint %I %s', k.conname, pg_get_constraintdef(k.oid)), '' order by k.oid), '')
+                                 from    pg_constraint k
+                                 where   k.contypid = t.oid
+                                 and     k.contype = 'c'
+                                 ))
+                  from    types t
+                  join    pg_type bt
+                  on      bt.oid = t.typbasetype
+                  where   t.typtype = 'd'
+                  union all
+                  select  0,
+                          t.oid::int8,
+                          format('create type %I as (%s)',
+                                 t.typname,
+                                 (
+                                 select  coalesce(string_agg(format('%I %s', a.attname, format_type(a.atttypid, a.atttypmod)), ', ' order by a.attnum), '')
+                                 from    pg_attribute a
+                                 where   a.attrelid = t.typrelid
+                                 and     a.attnum > 0
+                                 and     not a.attisdropped
+                                 ))
+                  from    types t
+                  join    pg_class c
+                  on      c.oid = t.typrelid
+                  where   t.typtype = 'c'
+                  and     c.relkind = 'c'
+                  union all
+                  select  1,
+                          c.oid::int8,
+                          format('create sequence %I as %s increment by %s minvalue %s maxvalue %s start with %s cache %s %s',
+                                 c.relname, format_type(s.seqtypid, null), s.seqincrement, s.seqmin, s.seqmax,
+                                 s.seqstart, s.seqcache, case when s.seqcycle then 'cycle' else 'no cycle' end) as ddl
+                  from    rels c
+                  join    pg_sequence s
+                  on      s.seqrelid = c.oid
+                  where   not exists
+                          (
+                          select  1
+                          from    pg_depend d
+                          where   d.classid = 'pg_class'::regclass
+                          and     d.objid = c.oid
+                          and     d.deptype = 'i'
+                          )
+                  union all
+                  select  2,
+                          c.oid::int8,
+                          format('create table %I (%s)%s',
+                                 c.relname,
+                                 coalesce(string_agg(
+                                     format('%I %s', a.attname, format_type(a.atttypid, a.atttypmod))
+                                     || case a.attidentity
+                                            when 'a' then ' generated always as identity'
+                                            when 'd' then ' generated by default as identity'
+                                            else ''
+                                        end
+                                     || case when a.attgenerated = 's' then ' generated always as (' || pg_get_expr(ad.adbin, ad.adrelid) || ') stored' else '' end
+                                     || case when a.attnotnull then ' not null' else '' end,
+                                     ', ' order by a.attnum), ''),
+                                 case when c.relkind = 'p' then ' partition by ' || pg_get_partkeydef(c.oid) else '' end)
+                  from    rels c
+                  left join pg_attribute a
+                  on      a.attrelid = c.oid
+                  and     a.attnum > 0
+                  and     not a.attisdropped
+                  left join pg_attrdef ad
+                  on      ad.adrelid = a.attrelid
+                  and     ad.adnum = a.attnum
+                  where   c.relkind in ('r', 'p')
+                  and     not c.relispartition
+                  group by c.oid, c.relname, c.relkind
+                  union all
+                  select  3,
+                          c.oid::int8,
+                          format('create table %I partition of %s %s%s',
+                                 c.relname, i.inhparent::regclass, pg_get_expr(c.relpartbound, c.oid),
+                                 case when c.relkind = 'p' then ' partition by ' || pg_get_partkeydef(c.oid) else '' end)
+                  from    rels c
+                  join    pg_inherits i
+                  on      i.inhrelid = c.oid
+                  where   c.relkind in ('r', 'p')
+                  and     c.relispartition
+                  union all
+                  select  4,
+                          p.oid::int8,
+                          'CREATE OR REPLACE ' || k.kind || ' ' || quote_ident(p.proname)
+                          || substr(pg_get_functiondef(p.oid),
+                                    length('CREATE OR REPLACE ' || k.kind || ' ' || quote_ident(n.nspname) || '.' || quote_ident(p.proname)) + 1)
+                  from    pg_proc p
+                  join    pg_namespace n
+                  on      n.oid = p.pronamespace
+                  cross join lateral (select case p.prokind when 'p' then 'PROCEDURE' else 'FUNCTION' end as kind) k
+                  where   p.pronamespace = to_regnamespace(%s)
+                  and     p.prokind in ('f', 'p')
+                  and     not exists
+                          (
+                          select  1
+                          from    pg_depend e
+                          where   e.classid = 'pg_proc'::regclass
+                          and     e.objid = p.oid
+                          and     e.deptype in ('e', 'i')
+                          )
+                  union all
+                  select  5,
+                          c.oid::int8,
+                          format('alter table %I alter column %I set default %s', c.relname, a.attname, pg_get_expr(ad.adbin, ad.adrelid))
+                  from    rels c
+                  join    pg_attribute a
+                  on      a.attrelid = c.oid
+                  join    pg_attrdef ad
+                  on      ad.adrelid = a.attrelid
+                  and     ad.adnum = a.attnum
+                  where   c.relkind in ('r', 'p')
+                  and     not c.relispartition
+                  and     a.attgenerated = ''
+                  and     not a.attisdropped
+                  union all
+                  select  case when k.contype = 'f' then 7 else 6 end,
+                          k.oid::int8,
+                          format('alter table %I add constraint %I %s', c.relname, k.conname, pg_get_constraintdef(k.oid))
+                  from    rels c
+                  join    pg_constraint k
+                  on      k.conrelid = c.oid
+                  where   k.contype in ('p', 'u', 'x', 'c', 'f')
+                  and     k.conislocal
+                  and     k.conparentid = 0
+                  union all
+                  select  6,
+                          x.indexrelid::int8,
+                          replace(replace(pg_get_indexdef(x.indexrelid), ' ON ONLY ', ' ON '),
+                                  ' ON ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname) || ' ',
+                                  ' ON ' || quote_ident(c.relname) || ' ')
+                  from    rels c
+                  join    pg_namespace n
+                  on      n.oid = c.relnamespace
+                  join    pg_index x
+                  on      x.indrelid = c.oid
+                  join    pg_class xc
+                  on      xc.oid = x.indexrelid
+                  where   not xc.relispartition
+                  and     not exists
+                          (
+                          select  1
+                          from    pg_constraint k
+                          where   k.conindid = x.indexrelid
+                          and     k.conrelid = c.oid
+                          )
+                  union all
+                  select  8,
+                          c.oid::int8,
+                          format('alter sequence %I owned by %I.%I', c.relname, t.relname, a.attname)
+                  from    rels c
+                  join    pg_depend d
+                  on      d.classid = 'pg_class'::regclass
+                  and     d.objid = c.oid
+                  and     d.refclassid = 'pg_class'::regclass
+                  and     d.deptype = 'a'
+                  join    pg_class t
+                  on      t.oid = d.refobjid
+                  join    pg_attribute a
+                  on      a.attrelid = d.refobjid
+                  and     a.attnum = d.refobjsubid
+                  where   c.relkind = 'S'
+                  union all
+                  select  9,
+                          c.oid::int8,
+                          format('create %s %I as %s',
+                                 case c.relkind when 'm' then 'materialized view' else 'view' end,
+                                 c.relname, rtrim(pg_get_viewdef(c.oid), ';'))
+                  from    rels c
+                  where   c.relkind in ('v', 'm')
+                  ) x
+          order by pass, seq
+          """
+    template_ident = sql.ident(template_name)
+    csr.execute(query, (template_ident, template_ident, template_ident))
+    return [row[0] for row in csr.fetchall()]
+
+
 def _extract_props(props):
     """ Extracts relevant properties as a tuple: (owner, is_public, is_readonly, users, ro_users).
         Can be called for either new or old props.
@@ -123,35 +687,97 @@ def _opt_rename_schema(conn, physical_id, schema_name):
         """
     if physical_id != schema_name:
         csr = conn.cursor()
-        csr.execute(f"alter schema {physical_id} rename to  {schema_name}")
+        csr.execute(RENAME_SCHEMA(old_name=physical_id, schema_name=schema_name))
         conn.commit()
     return schema_name
     
 
 
-def _apply_grants(csr, schema_name, recipient, is_readonly):
-    if is_readonly:
-        csr.execute(f"grant usage on schema {schema_name} to {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} grant select on tables to {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} grant select, usage on sequences to {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} grant execute on functions to {recipient}")
-    else:
-        csr.execute(f"grant all on schema {schema_name} to {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} grant all on tables to {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} grant all on sequences to {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} grant all on functions to {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} grant all on types to {recipient}")
-
-
-def _apply_revokes(csr, schema_name, recipient, is_readonly):
-    if is_readonly:
-        csr.execute(f"revoke usage on schema {schema_name} from {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} revoke select on tables from {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} revoke select, usage on sequences from {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} revoke execute on functions from {recipient}")
-    else:
-        csr.execute(f"revoke all on schema {schema_name} from {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} revoke all on tables from {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} revoke all on sequences from {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} revoke all on functions from {recipient}")
-        csr.execute(f"alter default privileges in schema {schema_name} revoke all on types from {recipient}")
\ No newline at end of file
+def _apply_grants(csr, schema_name, recipients):
+    """ Grants privileges on the schema, and default privileges for its future
+        objects, to (name, is_readonly) recipients. The statements are sent in
+        groups to minimize round-trips.
+        """
+    _execute_for_recipients(csr, GRANTS, schema_name, recipients)
+
+
+def _apply_revokes(csr, schema_name, recipients):
+    """ Revokes the privileges granted by _apply_grants().
+        """
+    _execute_for_recipients(csr, REVOKES, schema_name, recipients)
+
+
+def _execute_for_recipients(csr, statements_by_access, schema_name, recipients):
+    statements = [statement(schema_name=schema_name, recipient=recipient)
+                  for (recipient, is_readonly) in recipients
+                  for statement in statements_by_access[is_readonly]]
+    for combined in sql.batch(statements, STATEMENTS_PER_EXECUTE):
+        csr.execute(combined)
+
+
+def _apply_existing_object_privileges(csr, schema_name, recipients, is_revoke):
+    """ Grants or revokes privileges on objects that already exist in the schema.
+        Recipients are (name, is_readonly) tuples. Each object class is updated by
+        a single statement per access level, naming all recipients, so that each
+        catalog row is rewritten once regardless of how many recipients there are.
+        """
+    if not recipients:
+        return
+    csr.execute(f"set local lock_timeout = '{EXISTING_OBJECT_LOCK_TIMEOUT}'")
+    counts = _count_existing_objects(csr, schema_name)
+    action = "revoke" if is_revoke else "grant"
+    for (object_class, full_privs, ro_privs) in EXISTING_OBJECT_PRIVILEGES:
+        for (is_readonly, privs) in ((False, full_privs), (True, ro_privs)):
+            names = [name for (name, readonly) in recipients if readonly == is_readonly]
+            if not names:
+                continue
+            logging.info(f"schema_handler: {action} {privs} on {counts.get(object_class, 0)} existing {object_class} "
+                         f"in schema {schema_name} for {len(names)} recipient(s)")
+            start = time.time()
+            if is_revoke:
+                csr.execute(REVOKE_EXISTING(privs=privs, object_class=object_class, schema_name=schema_name, recipients=names))
+            else:
+                csr.execute(GRANT_EXISTING(privs=privs, object_class=object_class, schema_name=schema_name, recipients=names))
+            logging.info(f"schema_handler: {action} on existing {object_class} completed in {time.time() - start:.3f} seconds")
+
+
+def _retrieve_attributes(csr, schema_name):
+    """ Retrieves the schema's attributes, for Fn::GetAtt. Grantees are the roles
+        that have been granted a privilege by name, or "public".
+        """
+    query = """
+          select  n.oid::text                     as "Oid",
+                  pg_get_userbyid(n.nspowner)     as "Owner",
+                  array(
+                      select  case when a.grantee = 0 then 'public' else pg_get_userbyid(a.grantee)::text end
+                      from    aclexplode(coalesce(n.nspacl, acldefault('n', n.nspowner))) a
+                      where   a.privilege_type = 'USAGE'
+                      order by 1
+                  )                               as "UsageGrantees",
+                  array(
+                      select  case when a.grantee = 0 then 'public' else pg_get_userbyid(a.grantee)::text end
+                      from    aclexplode(coalesce(n.nspacl, acldefault('n', n.nspowner))) a
+                      where   a.privilege_type = 'CREATE'
+                      order by 1
+                  )                               as "CreateGrantees"
+          from    pg_namespace n
+          where   n.oid = to_regnamespace(%s)
+          """
+    return util.retrieve_attributes(csr, query, (sql.ident(schema_name),))
+
+
+def _count_existing_objects(csr, schema_name):
+    """ Returns a dict of the number of existing objects in each class, for logging.
+        """
+    csr.execute("""
+                select  (select count(*) from pg_class c where c.relnamespace = n.oid and c.relkind in ('r', 'p', 'v', 'm', 'f')),
+                        (select count(*) from pg_class c where c.relnamespace = n.oid and c.relkind = 'S'),
+                        (select count(*) from pg_proc p where p.pronamespace = n.oid and p.prokind in ('f', 'a', 'w'))
+                from    pg_namespace n
+                where   n.oid = %s::regnamespace
+                """,
+                (sql.ident(schema_name),))
+    row = csr.fetchone()
+    if row:
+        return dict(zip([x[0] for x in EXISTING_OBJECT_PRIVILEGES], row))
+    return {}
@@ -4,8 +4,11 @@
 from cf_postgres import util
 
 
+RESOURCE_NAME = "Testing"
+
+
 def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
-    if resource_type != "Testing":
+    if resource_type != RESOURCE_NAME:
         return False
     global saved_connection, saved_request_type, saved_resource_type, saved_physical_id, saved_props, saved_old_props
     saved_connection = conn
@@ -3,8 +3,11 @@
 
 import logging
 import sys
+import time
 
-from cf_postgres import util
+from collections import namedtuple
+
+from cf_postgres import sql, util
 from cf_postgres.constants import *
 
 
@@ -17,6 +20,45 @@ PROP_PASSWORD   = "Password"
 PROP_SECRET     = "UserSecretArn"
 PROP_CREATEDB   = "CreateDatabase"
 PROP_CREATEROLE = "CreateRole"
+PROP_CONNLIMIT  = "ConnectionLimit"
+PROP_SETTINGS   = "Settings"
+PROP_DBSETTINGS = "DatabaseSettings"
+PROP_ONDELETE   = "OnDelete"
+PROP_REASSIGNTO = "ReassignOwnedTo"
+
+# actions for objects owned by a user that's being deleted
+
+ON_DELETE_REASSIGN  = "reassign"
+ON_DELETE_DROP      = "dropowned"
+
+# attributes that may be changed by an update
+
+ATTR_PASSWORD   = "password"
+ATTR_CREATEDB   = "createdb"
+ATTR_CREATEROLE = "createrole"
+
+# connection limit and configuration parameters, new and old; parameters are held as
+# a dict of database name (None for all databases) to a dict of name and value
+
+RoleSettings = namedtuple("RoleSettings", ["connection_limit", "old_connection_limit", "parameters", "old_parameters"])
+
+# what to do with the user's objects when it's deleted; action is None to leave them
+# (which causes the delete to fail if there are any)
+
+DeleteOptions = namedtuple("DeleteOptions", ["action", "reassign_to", "admin_secret_arn"])
+
+# statements
+
+CREATE_USER         = sql.template("create user {username:ident} password {password:literal} {createdb} {createrole}")
+ALTER_USER          = sql.template("alter user {username:ident} {clauses}")
+DROP_USER           = sql.template("drop user {username:ident}")
+REASSIGN_OWNED      = sql.template("reassign owned by {username:ident} to {new_owner:role}")
+DROP_OWNED          = sql.template("drop owned by {username:ident}")
+CONNECTION_LIMIT    = sql.template("alter role {username:ident} connection limit {limit}")
+ROLE_TARGET         = sql.template("alter role {username:ident}")
+ROLE_DB_TARGET      = sql.template("alter role {username:ident} in database {database:ident}")
+SET_PARAMETER       = sql.template("{target} set {name:qualified} = {value}")
+RESET_PARAMETER     = sql.template("{target} reset {name:qualified}")
 
 
 def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
@@ -24,7 +66,10 @@ def try_handle(conn, request_type, resource_type, physical_id, props, old_props,
         return False
     (username, password, with_createdb, with_createrole) = load_user_info(props, response)
     if username:
-        handle(conn, request_type, physical_id, username, password, with_createdb, with_createrole, response)
+        changes = changed_attributes(props, old_props)
+        settings = extract_settings(props, old_props)
+        delete_options = extract_delete_options(props)
+        handle(conn, request_type, physical_id, username, password, with_createdb, with_createrole, changes, settings, delete_options, response)
     else:
         util.report_failure(response, "Must specify username or secret")
     return True
@@ -49,18 +94,63 @@ def load_user_info(props, response):
     return (username, password, with_createdb, with_createrole)
 
 
-def handle(conn, request_type, physical_id, username, password, with_createdb, with_createrole, response):
+def changed_attributes(props, old_props):
+    """ Compares new and old properties, returning the set of user attributes that
+        have changed. The password is considered changed if either the explicit
+        password or the secret ARN has changed; we don't retrieve the old secret
+        to compare its value.
+        """
+    changes = set()
+    if (props.get(PROP_PASSWORD) != old_props.get(PROP_PASSWORD)) or (props.get(PROP_SECRET) != old_props.get(PROP_SECRET)):
+        changes.add(ATTR_PASSWORD)
+    if util.get_boolean_prop(props, PROP_CREATEDB) != util.get_boolean_prop(old_props, PROP_CREATEDB):
+        changes.add(ATTR_CREATEDB)
+    if util.get_boolean_prop(props, PROP_CREATEROLE) != util.get_boolean_prop(old_props, PROP_CREATEROLE):
+        changes.add(ATTR_CREATEROLE)
+    return changes
+
+
+def extract_settings(props, old_props):
+    """ Extracts the connection limit and configuration parameters from new and old
+        properties. Parameter names are case-insensitive, so are converted to lowercase.
+        """
+    def parameters(p):
+        result = {}
+        for (database, values) in [(None, p.get(PROP_SETTINGS))] + list((p.get(PROP_DBSETTINGS) or {}).items()):
+            if values:
+                result[database] = dict((name.lower(), _normalize_value(value)) for (name, value) in values.items())
+        return result
+    return RoleSettings(
+        util.get_int_prop(props, PROP_CONNLIMIT),
+        util.get_int_prop(old_props, PROP_CONNLIMIT),
+        parameters(props),
+        parameters(old_props),
+        )
+
+
+def extract_delete_options(props):
+    """ Extracts the options that control deletion. The action is validated when the
+        user is deleted.
+        """
+    return DeleteOptions(
+        (props.get(PROP_ONDELETE) or "").lower() or None,
+        props.get(PROP_REASSIGNTO),
+        props.get(REQ_ADMIN_SECRET),
+        )
+
+
+def handle(conn, request_type, physical_id, username, password, with_createdb, with_createrole, changes, settings, delete_options, response):
     logging.info(f"user_handler: performing {request_type} for user {username}, resource {physical_id}")
     try:
         if request_type == ACTION_CREATE:
-            doCreate(conn, username, password, with_createdb, with_createrole, response)
+            doCreate(conn, username, password, with_createdb, with_createrole, settings, response)
         elif request_type == ACTION_UPDATE:
             if physical_id == username:
-                doUpdate(conn, username, password, with_createdb, with_createrole, response)
+                doUpdate(conn, username, password, with_createdb, with_createrole, changes, settings, response)
             else:
                 util.report_failure(response, "Can not update username", physical_id)
         elif request_type == ACTION_DELETE:
-            doDelete(conn, physical_id, response)
+            doDelete(conn, physical_id, delete_options, response)
         else:
             util.report_failure(response, f"user_handler: Unknown request type: {request_type}")
     except:
@@ -68,35 +158,197 @@ def handle(conn, request_type, physical_id, username, password, with_createdb, w
         conn.rollback()
 
 
-def doCreate(conn, username, password, with_createdb, with_createrole, response):
+def doCreate(conn, username, password, with_createdb, with_createrole, settings, response):
     logging.debug(f"user_handler.doCreate(): user {username}, with_createdb {with_createdb}, with_createrole {with_createrole}")
     csr = conn.cursor()
     createdb   = "CREATEDB" if with_createdb else "NOCREATEDB"
     createrole = "CREATEROLE" if with_createrole else "NOCREATEROLE"
-    if password:
-        csr.execute(f"create user {username} password '{password}' {createdb} {createrole}")
-    else:
-        csr.execute(f"create user {username} password NULL {createdb} {createrole}")
+    csr.execute(CREATE_USER(username=username, password=password or None, createdb=createdb, createrole=createrole))
+    apply_settings(csr, username, settings)
+    data = retrieve_attributes(csr, username)
     conn.commit()
-    util.report_success(response, username)
+    util.report_success(response, username, data)
 
 
-def doUpdate(conn, username, password, with_createdb, with_createrole, response):
-    logging.debug(f"user_handler.doUpdate(): user {username}, with_createdb {with_createdb}, with_createrole {with_createrole}")
+def doUpdate(conn, username, password, with_createdb, with_createrole, changes, settings, response):
+    logging.debug(f"user_handler.doUpdate(): user {username}, with_createdb {with_createdb}, with_createrole {with_createrole}, changes {sorted(changes)}")
+    clauses = []
+    if ATTR_PASSWORD in changes:
+        clauses.append(f"password {sql.literal(password or None)}")
+    if ATTR_CREATEROLE in changes:
+        clauses.append("CREATEROLE" if with_createrole else "NOCREATEROLE")
+    if ATTR_CREATEDB in changes:
+        clauses.append("CREATEDB" if with_createdb else "NOCREATEDB")
     csr = conn.cursor()
-    createdb   = "CREATEDB" if with_createdb else "NOCREATEDB"
-    createrole = "CREATEROLE" if with_createrole else "NOCREATEROLE"
-    if password:
-        csr.execute(f"alter user {username} password '{password}' {createrole} {createdb}")
+    if clauses:
+        csr.execute(ALTER_USER(username=username, clauses=" ".join(clauses)))
     else:
-        csr.execute(f"alter user {username} password NULL {createrole} {createdb}")
+        logging.info(f"user_handler.doUpdate(): no changes to attributes for user {username}")
+    apply_settings(csr, username, settings)
+    data = retrieve_attributes(csr, username)
     conn.commit()
-    util.report_success(response, username)
+    util.report_success(response, username, data)
 
 
-def doDelete(conn, username, response):
-    logging.debug(f"user_handler.doDelete(): user {username}")
+def doDelete(conn, username, delete_options, response):
+    logging.debug(f"user_handler.doDelete(): user {username}, on delete {delete_options.action}")
+    if delete_options.action:
+        release_owned_objects(conn, username, delete_options)
     csr = conn.cursor()
-    csr.execute(f"drop user {username}")
+    csr.execute(DROP_USER(username=username))
     conn.commit()
     util.report_success(response, username)
+
+
+def release_owned_objects(conn, username, delete_options):
+    """ Reassigns or drops the objects owned by the user, and revokes its privileges,
+        in every database where it has them, so that the user can be dropped. The
+        databases are identified by a single query of pg_shdepend, and processed
+        concurrently: the current database uses the existing connection, the others
+        use their own connections. Each database's changes are committed separately.
+        Raises if any database fails.
+        """
+    if delete_options.action == ON_DELETE_REASSIGN:
+        statements = [REASSIGN_OWNED(username=username, new_owner=delete_options.reassign_to or "current_user"),
+                      DROP_OWNED(username=username)]
+    elif delete_options.action == ON_DELETE_DROP:
+        statements = [DROP_OWNED(username=username)]
+    else:
+        raise Exception(f"{PROP_ONDELETE} must be either Reassign or DropOwned")
+    start = time.time()
+    (current_database, databases) = retrieve_dependent_databases(conn.cursor(), username)
+    if not databases:
+        logging.info(f"user_handler: user {username} has no dependencies")
+        return
+    def release(database):
+        if database == current_database:
+            _execute_and_commit(conn, statements)
+        else:
+            with util.open_connection(delete_options.admin_secret_arn, database) as db_conn:
+                _execute_and_commit(db_conn, statements)
+    max_workers = util.max_workers()
+    logging.info(f"user_handler: {delete_options.action} objects of user {username} in {len(databases)} databases "
+                 f"using up to {max_workers} threads")
+    results = util.run_concurrently(release, databases, max_workers)
+    failures = [f"{database}: {result}" for (database, result) in zip(databases, results) if isinstance(result, Exception)]
+    if failures:
+        raise Exception(f"failed for {len(failures)} of {len(databases)} databases: " + "; ".join(failures))
+    logging.info(f"user_handler: {delete_options.action} objects of user {username} in {len(databases)} databases "
+                 f"completed in {time.time() - start:.3f} seconds")
+
+
+def retrieve_dependent_databases(csr, username):
+    """ Returns the name of the current database, and a list of the databases where
+        the user owns objects or has been granted privileges. Dependencies on shared
+        objects (such as a database owned by the user) are attributed to the current
+        database, because they can be reassigned from any database.
+        """
+    csr.execute("""
+                select  current_database(),
+                        array(
+                            select  distinct coalesce(d.datname, current_database())
+                            from    pg_shdepend s
+                            left join pg_database d
+                            on      d.oid = s.dbid
+                            where   s.refclassid = 'pg_authid'::regclass
+                            and     s.refobjid = to_regrole(%s)
+                            order by 1
+                        )
+                """,
+                (sql.ident(username),))
+    row = csr.fetchone()
+    return (row[0], list(row[1])) if row else (None, [])
+
+
+def _execute_and_commit(conn, statements):
+    csr = conn.cursor()
+    for statement in statements:
+        csr.execute(statement)
+    conn.commit()
+
+
+def apply_settings(csr, username, settings):
+    """ Updates the user's connection limit and configuration parameters to match the
+        desired settings. Current values are read from the catalog, so that only
+        parameters whose values differ are set. Parameters are only reset if they
+        were previously specified by the resource; this lets the resource coexist
+        with settings made by other means.
+        """
+    if not (settings.parameters or settings.old_parameters or
+            settings.connection_limit is not None or settings.old_connection_limit is not None):
+        return
+    (current_limit, current_parameters) = retrieve_settings(csr, username)
+    connection_limit = settings.connection_limit
+    if connection_limit is None and settings.old_connection_limit is not None:
+        connection_limit = -1
+    if connection_limit is not None and connection_limit != current_limit:
+        csr.execute(CONNECTION_LIMIT(username=username, limit=connection_limit))
+    databases = set(settings.parameters.keys()) | set(settings.old_parameters.keys())
+    for database in sorted(databases, key=lambda x: x or ""):
+        target = ROLE_DB_TARGET(username=username, database=database) if database else ROLE_TARGET(username=username)
+        desired = settings.parameters.get(database, {})
+        previous = settings.old_parameters.get(database, {})
+        current = current_parameters.get(database, {})
+        for name in sorted(previous.keys()):
+            if name not in desired and name in current:
+                csr.execute(RESET_PARAMETER(target=target, name=name))
+        for (name, value) in sorted(desired.items()):
+            if current.get(name) != value:
+                csr.execute(SET_PARAMETER(target=target, name=name, value=_value_literal(value)))
+
+
+def retrieve_settings(csr, username):
+    """ Returns the user's current connection limit, and configuration parameters as
+        a dict of database name (None for all databases) to a dict of name and value.
+        """
+    csr.execute("""
+                select  r.rolconnlimit, d.datname, s.setconfig
+                from    pg_roles r
+                left join pg_db_role_setting s
+                on      s.setrole = r.oid
+                left join pg_database d
+                on      d.oid = s.setdatabase
+                where   r.oid = to_regrole(%s)
+                """,
+                (sql.ident(username),))
+    connection_limit = None
+    parameters = {}
+    for (limit, database, config) in csr.fetchall():
+        connection_limit = limit
+        for entry in (config or []):
+            (name, _, value) = entry.partition("=")
+            parameters.setdefault(database, {})[name.lower()] = value
+    return (connection_limit, parameters)
+
+
+def _normalize_value(value):
+    # list-valued parameters are stored with a single space after each comma
+    return ", ".join(part.strip() for part in str(value).split(","))
+
+
+def _value_literal(value):
+    # each element of a list-valued parameter is quoted separately
+    return ", ".join(sql.literal(part) for part in value.split(", "))
+
+
+def retrieve_attributes(csr, username):
+    """ Retrieves the user's attributes, for Fn::GetAtt.
+        """
+    query = """
+          select  r.oid::text         as "Oid",
+                  r.rolcanlogin       as "CanLogin",
+                  r.rolcreatedb       as "CreateDatabase",
+                  r.rolcreaterole     as "CreateRole",
+                  r.rolsuper          as "Superuser",
+                  r.rolconnlimit      as "ConnectionLimit",
+                  array(
+                      select  g.rolname::text
+                      from    pg_auth_members m
+                      join    pg_roles g on g.oid = m.roleid
+                      where   m.member = r.oid
+                      order by 1
+                  )                   as "MemberOf"
+          from    pg_roles r
+          where   r.oid = to_regrole(%s)
+          """
+    return util.retrieve_attributes(csr, query, (sql.ident(username),))
@@ -36,35 +36,10 @@ def create_user(username):
         return username
 
 
-def retrieve_user_info(username):
-    """ Retrieves the pg_roles row for the specified username, or None.
-        """
-    rows = util.select_as_dict(
-                local_pg8000_secret(None),
-                lambda c:  c.execute("select * from pg_roles where rolname = %s", (username,)))
-    if rows:
-        return rows[0]
-    else:
-        return None
-
-
-def retrieve_schema_info(schema_name):
-    """ Retrieves basic info about a schema.
-        """
-    sql = """
-          select  s.oid as schema_id,
-                  u.usename as owner_name
-          from    pg_namespace s
-          join    pg_user u on u.usesysid = s.nspowner
-          where   s.nspname = %s
-          """
-    return util.select_as_dict(
-                local_pg8000_secret(None),
-                lambda c:  c.execute(sql, (schema_name,)))
-
-
 Permission = namedtuple("Permission", ["permission", "object_type", "is_grantable"], defaults=[None, False])
 
+SchemaState = namedtuple("SchemaState", ["schema_id", "owner_name", "permissions", "default_permissions"])
+
 
 def _transform_permissions(data):
     """ Transforms the returned data from ACL queries into a dict keyed by grantee,
@@ -80,54 +55,204 @@ def _transform_permissions(data):
     return result
 
 
-def retrieve_schema_permissions(schema_name):
-    """ Retrieves the explicit permissions granted on a schema, as a dict of
-        grantee name to Permission instances.
+class CatalogInspector:
+    """ Retrieves the state of database objects, using a single connection for all
+        queries. Each query ends its transaction, so subsequent queries see changes
+        made by other connections. Use as a context manager, or call close().
+
+        Each method retrieves all of the state for an object with a single query.
         """
-    sql = """
-          with    grants as
-                  (
-                  select  nspname,
-                          (aclexplode(nspacl)).privilege_type as privilege_type,
-                          (aclexplode(nspacl)).grantee as grantee_oid,
-                          (aclexplode(nspacl)).is_grantable as is_grantable
-                  from    pg_namespace
-                  )
-          select  g.privilege_type,
-                  u.usename as grantee,
-                  g.is_grantable
-          from    grants g
-          left join pg_user u
-          on      u.usesysid = g.grantee_oid
-          where   g.nspname = %s
-          """
-    return _transform_permissions(util.select_as_dict(
-                local_pg8000_secret(None),
-                lambda c:  c.execute(sql, (schema_name,))))
+
+    def __init__(self, connection_info=None):
+        self._conn = util.connect_to_db(connection_info or local_pg8000_secret(None))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def role(self, role_name):
+        """ Returns the pg_roles row for the specified role, along with "member_of",
+            the set of roles that it belongs to. Returns None if the role doesn't exist.
+            """
+        sql = """
+              select  r.*,
+                      array(
+                          select  g.rolname::text
+                          from    pg_auth_members m
+                          join    pg_roles g on g.oid = m.roleid
+                          where   m.member = r.oid
+                      ) as member_of
+              from    pg_roles r
+              where   r.rolname = %s
+              """
+        row = self._select_one(sql, (role_name,))
+        if row:
+            row['member_of'] = set(row['member_of'] or [])
+        return row
+
+    def role_members(self, role_name):
+        """ Returns the names of the members of a role, as a set.
+            """
+        sql = """
+              select  array(
+                          select  m.rolname::text
+                          from    pg_auth_members a
+                          join    pg_roles m on m.oid = a.member
+                          where   a.roleid = r.oid
+                      ) as members
+              from    pg_roles r
+              where   r.rolname = %s
+              """
+        row = self._select_one(sql, (role_name,))
+        return set(row['members'] or []) if row else set()
+
+    def role_settings(self, role_name):
+        """ Returns the configuration parameters that are set for a role, as a dict of
+            database name (None for all databases) to a dict of parameter name and value.
+            """
+        sql = """
+              select  d.datname, s.setconfig
+              from    pg_db_role_setting s
+              left join pg_database d on d.oid = s.setdatabase
+              where   s.setrole = to_regrole(%s)
+              """
+        result = {}
+        for row in self._select(sql, (role_name,)):
+            result[row['datname']] = dict(entry.split("=", 1) for entry in row['setconfig'])
+        return result
+
+    def schema(self, schema_name):
+        """ Returns a SchemaState for the specified schema, None if it doesn't exist.
+            Permissions are dicts of grantee name to a set of Permission instances.
+            """
+        sql = """
+              select  s.oid as schema_id,
+                      u.rolname as owner_name,
+                      (
+                      select  json_agg(json_build_object(
+                                  'privilege_type',   a.privilege_type,
+                                  'grantee',          g.rolname,
+                                  'is_grantable',     a.is_grantable))
+                      from    aclexplode(s.nspacl) a
+                      left join pg_roles g on g.oid = a.grantee
+                      ) as permissions,
+                      (
+                      select  json_agg(json_build_object(
+                                  'object_type',      d.defaclobjtype,
+                                  'privilege_type',   a.privilege_type,
+                                  'grantee',          g.rolname,
+                                  'is_grantable',     a.is_grantable))
+                      from    pg_default_acl d
+                      cross join lateral aclexplode(d.defaclacl) a
+                      left join pg_roles g on g.oid = a.grantee
+                      where   d.defaclnamespace = s.oid
+                      ) as default_permissions
+              from    pg_namespace s
+              join    pg_roles u on u.oid = s.nspowner
+              where   s.nspname = %s
+              """
+        row = self._select_one(sql, (schema_name,))
+        if not row:
+            return None
+        return SchemaState(
+                row['schema_id'],
+                row['owner_name'],
+                _transform_permissions(row['permissions'] or []),
+                _transform_permissions(row['default_permissions'] or []))
+
+    def table_permissions(self, schema_name, table_name):
+        """ Retrieves the explicit permissions granted on a table, as a dict of
+            grantee name to Permission instances.
+            """
+        sql = """
+              select  a.privilege_type,
+                      g.rolname as grantee,
+                      a.is_grantable
+              from    pg_class c
+              join    pg_namespace s on s.oid = c.relnamespace
+              cross join lateral aclexplode(c.relacl) a
+              left join pg_roles g on g.oid = a.grantee
+              where   s.nspname = %s
+              and     c.relname = %s
+              """
+        return _transform_permissions(self._select(sql, (schema_name, table_name)))
+
+    def database(self, db_name):
+        """ Retrieves basic info about a database, or None if it doesn't exist.
+            """
+        sql = """
+              select  d.oid as database_id,
+                      r.rolname as owner_name,
+                      pg_encoding_to_char(d.encoding) as encoding,
+                      d.datconnlimit as connection_limit
+              from    pg_database d
+              join    pg_roles r on r.oid = d.datdba
+              where   d.datname = %s
+              """
+        return self._select_one(sql, (db_name,))
+
+    def _select(self, sql, args):
+        csr = self._conn.cursor()
+        try:
+            csr.execute(sql, args)
+            rows = csr.fetchall()
+            keys = [k[0] for k in csr.description]
+            return [dict(zip(keys, row)) for row in rows]
+        finally:
+            self._conn.rollback()
+
+    def _select_one(self, sql, args):
+        rows = self._select(sql, args)
+        return rows[0] if rows else None
+
+
+# the following functions are retained for compatibility; each opens its own
+# connection, so prefer CatalogInspector when making several checks
+
+def retrieve_user_info(username):
+    """ Retrieves the pg_roles row for the specified username, or None.
+        """
+    with CatalogInspector() as catalog:
+        return catalog.role(username)
+
+
+def retrieve_schema_info(schema_name):
+    """ Retrieves basic info about a schema, as a list that's empty if the schema
+        doesn't exist.
+        """
+    with CatalogInspector() as catalog:
+        state = catalog.schema(schema_name)
+    return [{ "schema_id": state.schema_id, "owner_name": state.owner_name }] if state else []
+
+
+def retrieve_schema_permissions(schema_name):
+    with CatalogInspector() as catalog:
+        state = catalog.schema(schema_name)
+    return state.permissions if state else {}
 
 
 def retrieve_default_schema_permissions(schema_name):
-    sql = """
-          with    grants as
-                  (
-                  select  s.nspname,
-                          d.defaclobjtype as object_type,
-                          (aclexplode(d.defaclacl)).privilege_type as privilege_type,
-                          (aclexplode(d.defaclacl)).grantee as grantee_oid,
-                          (aclexplode(d.defaclacl)).is_grantable as is_grantable
-                  from    pg_namespace s
-                  join    pg_default_acl d
-                  on      d.defaclnamespace = s.oid
-                  )
-          select  g.object_type,
-                  g.privilege_type,
-                  u.usename as grantee,
-                  g.is_grantable
-          from    grants g
-          left join pg_user u
-          on      u.usesysid = g.grantee_oid
-          where   g.nspname = %s
-          """
-    return _transform_permissions(util.select_as_dict(
-                local_pg8000_secret(None),
-                lambda c:  c.execute(sql, (schema_name,))))
+    with CatalogInspector() as catalog:
+        state = catalog.schema(schema_name)
+    return state.default_permissions if state else {}
+
+
+def retrieve_table_permissions(schema_name, table_name):
+    with CatalogInspector() as catalog:
+        return catalog.table_permissions(schema_name, table_name)
+
+
+def retrieve_database_info(db_name):
+    with CatalogInspector() as catalog:
+        return catalog.database(db_name)
+
+
+def retrieve_role_members(role_name):
+    with CatalogInspector() as catalog:
+        return catalog.role_members(role_name)
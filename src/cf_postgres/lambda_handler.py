@@ -21,36 +21,71 @@ import json
 import logging
 import os
 import sys
+import time
 import uuid
 
-import pg8000.dbapi
 import requests
 
-from cf_postgres import util
+from cf_postgres import ledger, tracing, util
 from cf_postgres.constants import *
-from cf_postgres.handlers import test_handler, user_handler, schema_handler
+from cf_postgres.plan import RecordingConnection
+from cf_postgres.handlers import test_handler, user_handler, schema_handler, database_handler, migration_handler, role_membership_handler, index_handler, partitions_handler, bundle_handler
 
 
 log_level = os.environ.get("LOG_LEVEL", logging.INFO)
 logging.getLogger().setLevel(log_level)
 
+# SnapStart runtime hooks are only available when deployed with SnapStart enabled
+try:
+    from snapshot_restore_py import register_before_snapshot, register_after_restore
+except ImportError:
+    register_before_snapshot = register_after_restore = None
+
 
 HANDLERS = [
     test_handler,
     user_handler,
     schema_handler,
+    database_handler,
+    migration_handler,
+    role_membership_handler,
+    index_handler,
+    partitions_handler,
+    bundle_handler,
+    ]
+
+# resources that apply to the entire cluster rather than a single database, so
+# can't be applied to multiple databases
+
+CLUSTER_RESOURCES = [
+    user_handler.RESOURCE_NAME,
+    database_handler.RESOURCE_NAME,
+    role_membership_handler.RESOURCE_NAME,
+    bundle_handler.RESOURCE_NAME,
     ]
 
 
 def handle(event, context):
     # print(json.dumps(event), file=sys.stderr)   # useful for debugging
+    if str(event.get(REQ_PLAN, "")).lower() == "true":
+        return plan(event)
+    if is_warm_up(event):
+        return warm_up(event)
+    with tracing.span("cf_postgres.handle", **tracing.event_attributes(event)) as span:
+        try:
+            response = process_event(event, context)
+            span.set_attribute(tracing.ATTR_STATUS, response.get(RSP_STATUS))
+        finally:
+            tracing.flush()
+
+
+def process_event(event, context):
+    """ Processes a CloudFormation event, sending the response unless the operation
+        will be resumed by a re-invocation. Returns the response.
+        """
+    util.set_deadline(context)
     response_url = event[REQ_RESPONSE_URL]
-    response = {
-        RSP_REQUEST_ID:     event[REQ_REQUEST_ID],
-        RSP_STACK_ID:       event[REQ_STACK_ID],
-        RSP_LOGICAL_ID:     event[REQ_LOGICAL_ID],
-        RSP_PHYSICAL_ID:    "to_be_populated",              # required, even for failure
-    }
+    response = new_response(event)
     try:
         request_type = event.get(REQ_REQUEST_TYPE)
         physical_id = event.get(REQ_PHYSICAL_ID)
@@ -61,35 +96,324 @@ def handle(event, context):
         print("resource_type = {resource_type}")
         print("secret_arn = {secret_arn}")
         if resource_type and secret_arn:
-            with open_connection(secret_arn) as conn:
-                try_handlers(conn, request_type, resource_type, physical_id, props, old_props, response)
+            if request_type == ACTION_DELETE and util.get_boolean_prop(props, REQ_EARLY_ACK):
+                if verify_early_delete(resource_type, physical_id, response):
+                    delete_after_acknowledgement(response_url, secret_arn, resource_type, physical_id, props, old_props, response)
+                    return response
+            else:
+                process(secret_arn, request_type, resource_type, physical_id, props, old_props, response)
+                if response.get(RSP_STATUS) == RSP_IN_PROGRESS:
+                    reinvoke(event, context)
+                    return response
     except Exception as ex:
         util.report_failure(response, f"Unhandled exception: \"{ex}\"")
         logging.error("unhandled exception", exc_info=True)
     send_response(response_url, response)
+    return response
+
+
+def new_response(event):
+    """ Creates a response for a CloudFormation event, populated with the fields
+        that identify the request.
+        """
+    return {
+        RSP_REQUEST_ID:     event[REQ_REQUEST_ID],
+        RSP_STACK_ID:       event[REQ_STACK_ID],
+        RSP_LOGICAL_ID:     event[REQ_LOGICAL_ID],
+        RSP_PHYSICAL_ID:    "to_be_populated",              # required, even for failure
+    }
+
+
+def plan(event):
+    """ Determines the SQL that would be executed for an event, without connecting
+        to the database or retrieving secrets. Handlers see an empty database: all
+        queries return no rows, and secrets contain placeholder values.
+
+        Returns a dict with the status, physical resource ID, and failure reason
+        (if any) that the handler would report, along with the list of statements.
+        If the resource specifies multiple databases, each database's statements
+        are preceded by a psql-style "\\connect".
+        """
+    response = {
+        RSP_PHYSICAL_ID:    "to_be_populated",
+    }
+    statements = []
+    try:
+        request_type = event.get(REQ_REQUEST_TYPE)
+        physical_id = event.get(REQ_PHYSICAL_ID)
+        props = event.get(REQ_PROPERTIES, {})
+        old_props = event.get(REQ_OLD_PROPERTIES, {})
+        resource_type = util.verify_property(props, response, REQ_RESOURCE_TYPE)
+        databases = target_databases(request_type, resource_type, props, response) if resource_type else None
+        if databases is not None:
+            with util.planning():
+                for database in (databases or [None]):
+                    conn = RecordingConnection()
+                    db_response = dict(response)
+                    try_handlers(conn, request_type, resource_type, physical_id, props, old_props, db_response)
+                    if database:
+                        statements.append(f"\\connect {database}")
+                    statements += conn.statements
+                    if db_response.get(RSP_STATUS) != RSP_SUCCESS:
+                        break
+            response = db_response
+    except Exception as ex:
+        util.report_failure(response, f"Unhandled exception: \"{ex}\"")
+    response[RSP_STATEMENTS] = statements
+    return response
 
 
-def open_connection(secret_arn):
-    """ Establishes the connection to the database. Any exceptions are allowed
-        to propagate.
+def is_warm_up(event):
+    """ Determines whether an event is a warm-up request: either an explicit request,
+        with a "WarmUp" field, or a scheduled event from EventBridge.
+        """
+    if str(event.get(REQ_WARM_UP, "")).lower() == "true":
+        return True
+    return event.get("source") == "aws.events" and event.get("detail-type") == "Scheduled Event"
+
+
+def warm_up(event):
+    """ Prepares the Lambda to handle requests, without sending a response to
+        CloudFormation: creates AWS clients, refreshes the cached admin secret, and
+        verifies that it can connect to the database. The admin secret is taken
+        from the event's "AdminSecretArn" field, defaulting to the prewarm secret.
+        Returns a dict with the status and elapsed time.
+        """
+    start = time.time()
+    result = {}
+    secret_arn = event.get(REQ_ADMIN_SECRET) or os.environ.get(ENV_PREWARM_SECRET)
+    try:
+        util.aws_client('secretsmanager')
+        if secret_arn:
+            util.invalidate_cached_secret(secret_arn)
+            with util.open_connection(secret_arn) as conn:
+                csr = conn.cursor()
+                csr.execute("select 1")
+                csr.fetchall()
+        result[RSP_STATUS] = RSP_SUCCESS
+    except Exception as ex:
+        logging.warning(f"warm-up failed: {ex}")
+        result[RSP_STATUS] = RSP_FAILURE
+        result[RSP_REASON] = str(ex)
+    result["ElapsedMillis"] = int((time.time() - start) * 1000)
+    logging.info(f"warm-up completed: {result}")
+    return result
+
+
+def process(secret_arn, request_type, resource_type, physical_id, props, old_props, response):
+    """ Connects to the database and invokes the handlers.
+        """
+    databases = target_databases(request_type, resource_type, props, response)
+    if databases is None:
+        return
+    if databases:
+        process_databases(secret_arn, databases, request_type, resource_type, physical_id, props, old_props, response)
+        return
+    with util.open_connection(secret_arn) as conn:
+        run_handlers(conn, request_type, resource_type, physical_id, props, old_props, response)
+
+
+def target_databases(request_type, resource_type, props, response):
+    """ Returns the list of databases that a resource applies to, an empty list if
+        it applies to the database named in the admin secret. Returns None, and
+        reports failure, if a cluster-level resource specifies databases; the only
+        exception is a delete (eg, the rollback of a failed create), which applies
+        once, to the secret's database.
+        """
+    databases = props.get(REQ_DATABASES) or []
+    if databases and resource_type in CLUSTER_RESOURCES:
+        if request_type == ACTION_DELETE:
+            logging.info(f"{resource_type} applies to the entire cluster; ignoring {REQ_DATABASES} for delete")
+            return []
+        util.report_failure(response, f"{REQ_DATABASES} can not be used with {resource_type} resources, "
+                                      f"which apply to the entire cluster")
+        return None
+    return databases
+
+
+def process_databases(secret_arn, databases, request_type, resource_type, physical_id, props, old_props, response):
+    """ Invokes the handlers for each of a list of databases, concurrently, with one
+        connection per database. Succeeds only if all databases succeed; otherwise
+        the failure reason identifies the databases that failed.
+
+        If any database reports that it's still in progress (eg, an index build),
+        the request is reported as in progress, so that it's re-invoked; failures
+        are not reported until then, to avoid orphaning the in-progress work.
         """
     connection_info = util.retrieve_pg8000_secret(secret_arn)
-    logging.info(f"connecting to {connection_info.get('host')}:{connection_info.get('port')}, "
-                f"database {connection_info.get('database')} as user {connection_info.get('user')}")
-    return pg8000.dbapi.connect(**connection_info)
+    def process_one(database):
+        db_response = dict(response)
+        with util.connect(dict(connection_info, database=database)) as conn:
+            run_handlers(conn, request_type, resource_type, physical_id, props, old_props, db_response)
+        return db_response
+    max_workers = util.max_workers()
+    logging.info(f"processing {len(databases)} databases using up to {max_workers} threads")
+    results = util.run_concurrently(process_one, databases, max_workers)
+    failures = []
+    successes = []
+    in_progress = []
+    for database, result in zip(databases, results):
+        if isinstance(result, Exception):
+            failures.append(f"{database}: {result}")
+        elif result.get(RSP_STATUS) == RSP_IN_PROGRESS:
+            in_progress.append(database)
+            successes.append(result)
+        elif result.get(RSP_STATUS) != RSP_SUCCESS:
+            failures.append(f"{database}: {result.get(RSP_REASON)}")
+        else:
+            successes.append(result)
+    if in_progress:
+        logging.info(f"in progress for {len(in_progress)} of {len(databases)} databases: {', '.join(in_progress)}")
+        util.report_in_progress(response, physical_id or successes[0][RSP_PHYSICAL_ID])
+    elif failures:
+        succeeded_id = successes[0][RSP_PHYSICAL_ID] if successes else None
+        util.report_failure(response, f"failed for {len(failures)} of {len(databases)} databases: " + "; ".join(failures),
+                            physical_id or succeeded_id)
+    else:
+        util.report_success(response, successes[0][RSP_PHYSICAL_ID], successes[0].get(RSP_DATA))
+
+
+def run_handlers(conn, request_type, resource_type, physical_id, props, old_props, response):
+    """ Invokes the handlers on an open connection, using the ledger if enabled.
+        """
+    if ledger.is_enabled():
+        try_handlers_with_ledger(conn, request_type, resource_type, physical_id, props, old_props, response)
+    else:
+        try_handlers(conn, request_type, resource_type, physical_id, props, old_props, response)
+
+
+def reinvoke(event, context):
+    """ Asynchronously invokes this Lambda with the same event, so that a handler
+        that ran out of time can resume its work. The event records the number of
+        re-invocations; raises if that exceeds the limit.
+        """
+    count = int(event.get(REQ_REINVOCATION, 0)) + 1
+    if count > MAX_REINVOCATIONS:
+        raise Exception(f"not complete after {MAX_REINVOCATIONS} invocations")
+    logging.info(f"request {event.get(REQ_REQUEST_ID)} in progress; re-invoking (attempt {count})")
+    util.aws_client('lambda').invoke(FunctionName=context.invoked_function_arn,
+                                     InvocationType="Event",
+                                     Payload=json.dumps(dict(event, **{REQ_REINVOCATION: count})))
+
+
+def verify_early_delete(resource_type, physical_id, response):
+    """ Validates a delete request before acknowledging it: there must be a physical
+        resource ID, and a handler for the resource type. Reports failure and returns
+        False if not.
+        """
+    if not physical_id:
+        util.report_failure(response, "Missing physical resource ID")
+        return False
+    if not any(getattr(handler, "RESOURCE_NAME", None) == resource_type for handler in HANDLERS):
+        util.report_failure(response, f"Unknown resource: \"{resource_type}\"")
+        return False
+    return True
+
+
+def delete_after_acknowledgement(response_url, secret_arn, resource_type, physical_id, props, old_props, response):
+    """ Reports success to CloudFormation, then performs the delete. Since CloudFormation
+        has already moved on, any failure is logged and recorded as a metric.
+        """
+    logging.info(f"acknowledging delete of {resource_type} {physical_id} before performing it")
+    delete_response = dict(response)
+    util.report_success(response, physical_id)
+    send_response(response_url, response)
+    try:
+        process(secret_arn, ACTION_DELETE, resource_type, physical_id, props, old_props, delete_response)
+    except Exception as ex:
+        util.report_failure(delete_response, f"Unhandled exception: \"{ex}\"", physical_id)
+    if delete_response.get(RSP_STATUS) == RSP_SUCCESS:
+        logging.info(f"completed acknowledged delete of {resource_type} {physical_id}")
+    else:
+        logging.error(f"acknowledged delete of {resource_type} {physical_id} failed: {delete_response.get(RSP_REASON)}")
+        util.emit_metric(METRIC_DELETE_FAILURES, 1, { "Resource": resource_type })
 
 
 def try_handlers(conn, request_type, resource_type, physical_id, props, old_props, response):
     """ Runs through the list of handlers, returning once one handles the resource.
         Fails the invocation if there aren't any handlers.
         """
-    for handler in HANDLERS:
-        if handler.try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
-            return
-    util.report_failure(response, f"Unknown resource: \"{resource_type}\"")
+    with tracing.span("cf_postgres.handler", **{tracing.ATTR_RESOURCE_TYPE: resource_type,
+                                                tracing.ATTR_REQUEST_TYPE: request_type,
+                                                tracing.ATTR_STACK_ID: response.get(RSP_STACK_ID),
+                                                tracing.ATTR_LOGICAL_ID: response.get(RSP_LOGICAL_ID)}) as span:
+        if span.is_recording():
+            conn = tracing.CountingConnection(conn)
+        for handler in HANDLERS:
+            if handler.try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+                break
+        else:
+            util.report_failure(response, f"Unknown resource: \"{resource_type}\"")
+        span.set_attribute(tracing.ATTR_STATUS, response.get(RSP_STATUS))
+        if span.is_recording():
+            span.set_attribute(tracing.ATTR_STATEMENTS, conn.statement_count)
+
+
+def try_handlers_with_ledger(conn, request_type, resource_type, physical_id, props, old_props, response):
+    """ Wraps try_handlers() with a check of the applied-state ledger. Requests that
+        have already been processed return their previous result, updates that don't
+        change the applied state are skipped, and other updates are diffed against
+        the applied state. Successful requests are then recorded.
+        """
+    ledger.ensure_tables(conn)
+    previous = ledger.find_processed_request(conn, response[RSP_REQUEST_ID])
+    if previous:
+        logging.info(f"request {response[RSP_REQUEST_ID]} already processed; physical ID {previous.physical_id}")
+        util.report_success(response, previous.physical_id, previous.data)
+        return
+    if request_type == ACTION_UPDATE:
+        applied = ledger.find_applied_state(conn, response[RSP_STACK_ID], response[RSP_LOGICAL_ID])
+        salt = ledger.resource_salt(response[RSP_STACK_ID], response[RSP_LOGICAL_ID])
+        if applied and applied.physical_id == physical_id:
+            if applied.fingerprint == ledger.fingerprint(props, salt):
+                logging.info(f"properties match applied state; no update needed for {physical_id}")
+                util.report_success(response, physical_id, applied.data)
+                ledger.record(conn, request_type, props, response)
+                return
+            old_props = ledger.restore(applied.props, props, salt)
+    try_handlers(conn, request_type, resource_type, physical_id, props, old_props, response)
+    if response.get(RSP_STATUS) == RSP_SUCCESS:
+        ledger.record(conn, request_type, props, response)
 
 
 def send_response(response_url, response):
     logging.info(f"sending response to {response_url}: {response}")
-    rsp = requests.put(response_url, data=json.dumps(response))
+    with tracing.span("cf_postgres.send_response", **{tracing.ATTR_STATUS: response.get(RSP_STATUS)}) as span:
+        rsp = requests.put(response_url, data=json.dumps(response))
+        span.set_attribute("http.response.status_code", rsp.status_code)
     logging.info(f"response status code: {rsp.status_code}")
+
+
+def prewarm():
+    """ Performs expensive setup (creating the Secrets Manager client, retrieving
+        the admin secret) when the module is loaded, so that it happens during the
+        Lambda init phase, where it's absorbed by provisioned concurrency or SnapStart.
+        Only runs if CF_POSTGRES_PREWARM_SECRET_ARN is set. Failures are logged and
+        ignored; the first invocation will try again.
+        """
+    secret_arn = os.environ.get(ENV_PREWARM_SECRET)
+    if not secret_arn:
+        return
+    start = time.time()
+    try:
+        util.aws_client('secretsmanager')
+        util.retrieve_pg8000_secret(secret_arn)
+        logging.info(f"prewarm completed in {time.time() - start:.3f} seconds")
+    except Exception as ex:
+        logging.warning(f"prewarm failed: {ex}")
+
+
+def before_snapshot():
+    # clients hold open sockets, and secrets shouldn't be persisted in the snapshot
+    util.reset_caches()
+
+
+def after_restore():
+    util.reset_caches()
+    prewarm()
+
+
+prewarm()
+if register_before_snapshot:
+    register_before_snapshot(before_snapshot)
+    register_after_restore(after_restore)
@@ -0,0 +1,231 @@
+# Copyright (c) Keith D Gregory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" An optional table of applied state, kept in the managed database. This lets the
+    Lambda recognize requests that it has already processed (eg, retries of a failed
+    invocation), and lets updates diff against what was actually applied rather than
+    what CloudFormation thinks was applied.
+
+    The ledger is enabled by setting the environment variable CF_POSTGRES_LEDGER_SCHEMA
+    to the name of the schema that holds its tables; the schema and tables are created
+    on first use.
+    """
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+
+from collections import namedtuple
+
+from cf_postgres import sql
+from cf_postgres.constants import *
+
+
+ENV_LEDGER_SCHEMA   = "CF_POSTGRES_LEDGER_SCHEMA"
+
+# properties that are not part of the resource definition
+IGNORED_PROPS       = ("ServiceToken",)
+
+# properties whose values must not be stored in plaintext
+REDACTED_PROPS      = ("Password",)
+
+
+ProcessedRequest = namedtuple("ProcessedRequest", ["physical_id", "data"])
+
+AppliedState = namedtuple("AppliedState", ["physical_id", "fingerprint", "props", "data"])
+
+
+def schema_name():
+    """ Returns the name of the ledger schema, None if the ledger is not enabled.
+        """
+    return os.environ.get(ENV_LEDGER_SCHEMA)
+
+
+def is_enabled():
+    return bool(schema_name())
+
+
+def resource_salt(stack_id, logical_id):
+    """ Returns the key used to hash a resource's properties. It's unique to the
+        resource, so identical passwords in different resources (or ledgers) have
+        different hashes, and can't be matched against a precomputed table.
+        """
+    return f"{stack_id}/{logical_id}"
+
+
+def fingerprint(props, salt):
+    """ Returns a stable hash of the provided resource properties.
+        """
+    return _hash(json.dumps(redact(props, salt), sort_keys=True), salt)
+
+
+def redact(props, salt):
+    """ Returns a copy of the provided properties with sensitive values replaced by
+        their hash. This includes values in nested resources (eg, a Bundle).
+        """
+    relevant = dict((k,v) for k,v in props.items() if k not in IGNORED_PROPS)
+    return _redact(relevant, salt)
+
+
+def restore(applied_props, props, salt):
+    """ Returns a copy of stored properties, suitable for use as "old" properties by
+        a handler. Redacted values are replaced by the current value if the hashes
+        match; otherwise they're left as hashes, which will compare as changed.
+        Values in nested resources are matched by position.
+        """
+    return _restore(applied_props, props, salt)
+
+
+def _redact(value, salt):
+    if isinstance(value, dict):
+        result = {}
+        for (k, v) in value.items():
+            if k in REDACTED_PROPS and v is not None and not isinstance(v, (dict, list)):
+                result[k] = _hash(v, salt)
+            else:
+                result[k] = _redact(v, salt)
+        return result
+    if isinstance(value, list):
+        return [_redact(v, salt) for v in value]
+    return value
+
+
+def _restore(applied, current, salt):
+    if isinstance(applied, dict) and isinstance(current, dict):
+        result = {}
+        for (k, v) in applied.items():
+            current_value = current.get(k)
+            if k in REDACTED_PROPS and current_value is not None and not isinstance(current_value, (dict, list)):
+                result[k] = current_value if hmac.compare_digest(str(v), _hash(current_value, salt)) else v
+            else:
+                result[k] = _restore(v, current_value, salt)
+        return result
+    if isinstance(applied, list) and isinstance(current, list):
+        return [_restore(v, current[n] if n < len(current) else None, salt) for (n, v) in enumerate(applied)]
+    return applied
+
+
+def ensure_tables(conn):
+    """ Creates the ledger schema and tables if they don't already exist.
+        """
+    schema = sql.ident(schema_name())
+    csr = conn.cursor()
+    csr.execute(f"create schema if not exists {schema}")
+    csr.execute(f"""
+                create table if not exists {schema}.processed_requests
+                (
+                    request_id      text not null primary key,
+                    stack_id        text not null,
+                    logical_id      text not null,
+                    request_type    text not null,
+                    physical_id     text not null,
+                    data            text,
+                    processed_at    timestamptz not null default now()
+                )
+                """)
+    csr.execute(f"""
+                create table if not exists {schema}.applied_state
+                (
+                    stack_id        text not null,
+                    logical_id      text not null,
+                    physical_id     text not null,
+                    fingerprint     text not null,
+                    properties      text not null,
+                    data            text,
+                    applied_at      timestamptz not null default now(),
+                    primary key (stack_id, logical_id)
+                )
+                """)
+    conn.commit()
+
+
+def find_processed_request(conn, request_id):
+    """ If the specified request has already been processed successfully, returns a
+        ProcessedRequest with the physical resource ID and data that it reported.
+        Otherwise returns None.
+        """
+    csr = conn.cursor()
+    csr.execute(f"select physical_id, data from {sql.ident(schema_name())}.processed_requests where request_id = %s",
+                (request_id,))
+    row = csr.fetchone()
+    conn.commit()
+    if row:
+        return ProcessedRequest(row[0], json.loads(row[1]) if row[1] else None)
+    return None
+
+
+def find_applied_state(conn, stack_id, logical_id):
+    """ Returns the last applied state for a resource, None if there isn't any.
+        """
+    csr = conn.cursor()
+    csr.execute(f"""
+                select  physical_id, fingerprint, properties, data
+                from    {sql.ident(schema_name())}.applied_state
+                where   stack_id = %s
+                and     logical_id = %s
+                """,
+                (stack_id, logical_id))
+    row = csr.fetchone()
+    conn.commit()
+    if row:
+        return AppliedState(row[0], row[1], json.loads(row[2]), json.loads(row[3]) if row[3] else None)
+    return None
+
+
+def record(conn, request_type, props, response):
+    """ Records a successful request, and updates (or removes) the applied state.
+        """
+    schema = sql.ident(schema_name())
+    request_id  = response[RSP_REQUEST_ID]
+    stack_id    = response[RSP_STACK_ID]
+    logical_id  = response[RSP_LOGICAL_ID]
+    physical_id = response[RSP_PHYSICAL_ID]
+    data        = json.dumps(response[RSP_DATA]) if response.get(RSP_DATA) else None
+    salt        = resource_salt(stack_id, logical_id)
+    logging.debug(f"ledger: recording {request_type} request {request_id} for {logical_id}")
+    csr = conn.cursor()
+    csr.execute(f"""
+                insert into {schema}.processed_requests
+                       (request_id, stack_id, logical_id, request_type, physical_id, data)
+                values (%s, %s, %s, %s, %s, %s)
+                on conflict (request_id) do nothing
+                """,
+                (request_id, stack_id, logical_id, request_type, physical_id, data))
+    if request_type == ACTION_DELETE:
+        # when a resource is replaced, CloudFormation deletes the old physical resource
+        # after the new one has been created with the same logical ID; that delete must
+        # not remove the replacement's state
+        csr.execute(f"delete from {schema}.applied_state where stack_id = %s and logical_id = %s and physical_id = %s",
+                    (stack_id, logical_id, physical_id))
+    else:
+        csr.execute(f"""
+                    insert into {schema}.applied_state
+                           (stack_id, logical_id, physical_id, fingerprint, properties, data)
+                    values (%s, %s, %s, %s, %s, %s)
+                    on conflict (stack_id, logical_id)
+                    do update set physical_id = excluded.physical_id,
+                                  fingerprint = excluded.fingerprint,
+                                  properties  = excluded.properties,
+                                  data        = excluded.data,
+                                  applied_at  = now()
+                    """,
+                    (stack_id, logical_id, physical_id, fingerprint(props, salt), json.dumps(redact(props, salt)), data))
+    conn.commit()
+
+
+def _hash(value, salt):
+    digest = hmac.new(salt.encode("utf-8"), str(value).encode("utf-8"), hashlib.sha256)
+    return "hmac-sha256:" + digest.hexdigest()
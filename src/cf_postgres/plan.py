@@ -0,0 +1,124 @@
+# Copyright (c) Keith D Gregory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Support for "plan" mode, in which an event is turned into the SQL that it would
+    execute, without connecting to a database or retrieving secrets.
+
+    Can be run from the command line, with one or more files containing events
+    (use "-" for standard input):
+
+        python -m cf_postgres.plan event.json
+    """
+
+import json
+import re
+import sys
+import textwrap
+
+
+PARAMS_COMMENT = " -- parameters: "
+
+# plans are written to logs and terminals, so password literals are masked
+
+PASSWORD_LITERAL = re.compile(r"(\bpassword\s+)'(?:[^']|'')*'", re.IGNORECASE)
+MASKED_PASSWORD  = "'********'"
+
+
+class RecordingConnection:
+    """ Stands in for a PG8000 connection, recording the statements that are
+        executed. Queries return no rows, so handlers see an empty database.
+        """
+
+    def __init__(self):
+        self.statements = []
+        self.autocommit = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        if not self.autocommit:
+            self.statements.append("commit")
+
+    def rollback(self):
+        if not self.autocommit:
+            self.statements.append("rollback")
+
+    def close(self):
+        pass
+
+
+class RecordingCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = []
+        self.rowcount = 0
+
+    def execute(self, sql, args=None):
+        self.conn.statements.append(render(sql, args))
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+def render(sql, args=None):
+    """ Normalizes a statement for display: indentation is removed, passwords are
+        masked, and any parameters are shown in a trailing comment.
+        """
+    sql = textwrap.dedent(sql).strip()
+    sql = PASSWORD_LITERAL.sub(lambda m: m.group(1) + MASKED_PASSWORD, sql)
+    if args:
+        sql += PARAMS_COMMENT + ", ".join(repr(arg) for arg in args)
+    return sql
+
+
+def main(argv):
+    from cf_postgres import lambda_handler
+    if not argv:
+        print(f"usage: python -m cf_postgres.plan EVENT_FILE [...]", file=sys.stderr)
+        return 2
+    exit_code = 0
+    for filename in argv:
+        if filename == "-":
+            event = json.load(sys.stdin)
+        else:
+            with open(filename) as f:
+                event = json.load(f)
+        result = lambda_handler.plan(event)
+        if len(argv) > 1:
+            print(f"-- {filename}")
+        for statement in result["Statements"]:
+            if statement.startswith("\\") or statement.startswith("--"):
+                print(statement)
+            else:
+                (sql, sep, params) = statement.partition(PARAMS_COMMENT)
+                print(f"{sql};{sep}{params}")
+        if result.get("Status") != "SUCCESS":
+            print(f"-- FAILED: {result.get('Reason')}")
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
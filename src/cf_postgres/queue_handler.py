@@ -0,0 +1,222 @@
+# Copyright (c) Keith D Gregory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Alternative entry-point that processes CloudFormation events delivered via an
+    SQS queue (optionally by way of an SNS topic). Events in a batch are grouped by
+    admin secret, and each group is processed using a single connection.
+
+    This may be invoked as a Lambda with an SQS event source, or used to drain a
+    queue from a long-running process (see drain()).
+    """
+
+import json
+import logging
+
+from collections import namedtuple
+
+from cf_postgres import lambda_handler, util
+from cf_postgres.constants import *
+from cf_postgres.handlers import user_handler, database_handler, schema_handler, role_membership_handler, migration_handler, partitions_handler, index_handler, bundle_handler
+
+
+# the order in which resources are created; deletes happen in reverse order, after
+# all creates and updates
+
+RESOURCE_ORDER = [
+    user_handler.RESOURCE_NAME,
+    database_handler.RESOURCE_NAME,
+    schema_handler.RESOURCE_NAME,
+    bundle_handler.RESOURCE_NAME,
+    role_membership_handler.RESOURCE_NAME,
+    migration_handler.RESOURCE_NAME,
+    partitions_handler.RESOURCE_NAME,
+    index_handler.RESOURCE_NAME,
+    ]
+
+
+Message = namedtuple("Message", ["message_id", "body"])
+
+
+def handle(event, context):
+    """ Lambda entry-point for an SQS event source. Returns the IDs of messages that
+        couldn't be processed, for use with ReportBatchItemFailures. This includes
+        messages whose handlers ran out of time, so that they'll be resumed when the
+        message is redelivered.
+        """
+    util.set_deadline(context)
+    messages = [Message(record["messageId"], record["body"]) for record in event.get("Records", [])]
+    failed_ids = process_messages(messages)
+    return {
+        "batchItemFailures": [{ "itemIdentifier": message_id } for message_id in failed_ids]
+    }
+
+
+def drain(queue, batch_size=10):
+    """ Repeatedly retrieves and processes batches of messages from a queue, until
+        the queue is empty. Messages that are processed are deleted; others remain
+        on the queue to be retried. Returns the number of messages processed.
+
+        The queue is an object with receive(max_messages), which returns a list of
+        Message, and delete(message_ids). See SqsQueue.
+        """
+    total = 0
+    while True:
+        messages = queue.receive(batch_size)
+        if not messages:
+            return total
+        failed_ids = set(process_messages(messages))
+        processed_ids = [m.message_id for m in messages if m.message_id not in failed_ids]
+        if processed_ids:
+            queue.delete(processed_ids)
+        total += len(processed_ids)
+
+
+def process_messages(messages):
+    """ Processes a batch of messages, returning the IDs of those that couldn't be
+        processed (because they're unparseable, or the response couldn't be sent).
+        A message that's processed unsuccessfully is still considered processed,
+        since its failure was reported to CloudFormation.
+        """
+    failed_ids = []
+    groups = {}
+    for message in messages:
+        try:
+            event = extract_event(message.body)
+            props = event.get(REQ_PROPERTIES, {})
+            groups.setdefault(props.get(REQ_ADMIN_SECRET), []).append((message, event))
+        except Exception as ex:
+            logging.error(f"unable to parse message {message.message_id}: {ex}")
+            failed_ids.append(message.message_id)
+    for secret_arn, entries in groups.items():
+        logging.info(f"processing {len(entries)} events for secret {secret_arn}")
+        failed_ids += process_group(secret_arn, sort_entries(entries))
+    return failed_ids
+
+
+def extract_event(body):
+    """ Parses a message body, which is either a CloudFormation event or an SNS
+        notification containing one.
+        """
+    content = json.loads(body)
+    if content.get("Type") == "Notification" and "Message" in content:
+        content = json.loads(content["Message"])
+    for field in (REQ_RESPONSE_URL, REQ_REQUEST_ID, REQ_STACK_ID, REQ_LOGICAL_ID):
+        if not content.get(field):
+            raise ValueError(f"not a CloudFormation event: missing {field}")
+    return content
+
+
+def sort_entries(entries):
+    """ Orders (message, event) tuples so that resources are created before the
+        resources that depend on them, and deleted after. The sort is stable, so
+        events for the same resource type retain their order.
+        """
+    def sort_key(entry):
+        event = entry[1]
+        resource_type = event.get(REQ_PROPERTIES, {}).get(REQ_RESOURCE_TYPE)
+        rank = RESOURCE_ORDER.index(resource_type) if resource_type in RESOURCE_ORDER else len(RESOURCE_ORDER)
+        if event.get(REQ_REQUEST_TYPE) == ACTION_DELETE:
+            return (1, -rank)
+        return (0, rank)
+    return sorted(entries, key=sort_key)
+
+
+def process_group(secret_arn, entries):
+    """ Processes all events for a single admin secret, using one connection, and
+        sends their responses. Events that fan out to multiple databases are handled
+        individually. Returns the IDs of messages whose responses couldn't be sent,
+        or that are still in progress.
+        """
+    responses = [lambda_handler.new_response(event) for (message, event) in entries]
+    conn = None
+    try:
+        for ((message, event), response) in zip(entries, responses):
+            if secret_arn and not event.get(REQ_PROPERTIES, {}).get(REQ_DATABASES):
+                if not conn:
+                    conn = util.open_connection(secret_arn)
+                process_event(conn, event, response)
+                if response.get(RSP_STATUS) == RSP_IN_PROGRESS:
+                    # the connection is still busy with the unfinished operation
+                    conn.close()
+                    conn = None
+            else:
+                process_event(None, event, response)
+    except Exception as ex:
+        logging.error(f"unable to process events for secret {secret_arn}", exc_info=True)
+        for response in responses:
+            if not response.get(RSP_STATUS):
+                util.report_failure(response, f"Unhandled exception: \"{ex}\"")
+    finally:
+        if conn:
+            conn.close()
+    failed_ids = []
+    for ((message, event), response) in zip(entries, responses):
+        if response.get(RSP_STATUS) == RSP_IN_PROGRESS:
+            logging.info(f"message {message.message_id} in progress; will resume when redelivered")
+            failed_ids.append(message.message_id)
+            continue
+        try:
+            lambda_handler.send_response(event[REQ_RESPONSE_URL], response)
+        except Exception as ex:
+            logging.error(f"unable to send response for message {message.message_id}: {ex}")
+            failed_ids.append(message.message_id)
+    return failed_ids
+
+
+def process_event(conn, event, response):
+    """ Processes a single event, using the provided connection if there is one;
+        otherwise the event is processed as a normal Lambda invocation would be.
+        Failures are recorded in the response.
+        """
+    try:
+        request_type = event.get(REQ_REQUEST_TYPE)
+        physical_id = event.get(REQ_PHYSICAL_ID)
+        props = event.get(REQ_PROPERTIES, {})
+        old_props = event.get(REQ_OLD_PROPERTIES, {})
+        resource_type = util.verify_property(props, response, REQ_RESOURCE_TYPE)
+        secret_arn = util.verify_property(props, response, REQ_ADMIN_SECRET)
+        if not (resource_type and secret_arn):
+            return
+        if conn:
+            lambda_handler.run_handlers(conn, request_type, resource_type, physical_id, props, old_props, response)
+        else:
+            lambda_handler.process(secret_arn, request_type, resource_type, physical_id, props, old_props, response)
+    except Exception as ex:
+        util.report_failure(response, f"Unhandled exception: \"{ex}\"")
+        logging.error("unhandled exception", exc_info=True)
+        if conn:
+            conn.rollback()
+
+
+class SqsQueue:
+    """ Adapts an SQS queue for use with drain().
+        """
+
+    def __init__(self, queue_url, wait_seconds=1):
+        self.queue_url = queue_url
+        self.wait_seconds = wait_seconds
+        self._client = util.aws_client('sqs')
+
+    def receive(self, max_messages):
+        # messages are identified by receipt handle, since that's needed to delete them
+        rsp = self._client.receive_message(QueueUrl=self.queue_url,
+                                           MaxNumberOfMessages=min(max_messages, 10),
+                                           WaitTimeSeconds=self.wait_seconds)
+        return [Message(m["ReceiptHandle"], m["Body"]) for m in rsp.get("Messages", [])]
+
+    def delete(self, message_ids):
+        for start in range(0, len(message_ids), 10):
+            entries = [{ "Id": str(n), "ReceiptHandle": receipt }
+                       for (n, receipt) in enumerate(message_ids[start:start+10])]
+            self._client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
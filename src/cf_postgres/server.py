@@ -0,0 +1,301 @@
+# Copyright (c) Keith D Gregory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Runs the handlers as a long-lived HTTP service, for use outside of Lambda.
+
+    Events are POSTed to any path, in the same form that CloudFormation sends them
+    to the Lambda. They're processed on a pool of worker threads, using a pool of
+    database connections per admin secret, and responses are PUT to the event's
+    ResponseURL; the POST itself returns as soon as the event is accepted. Plan and
+    warm-up events are processed immediately, and their results returned.
+
+    GET /health returns the service's status. On SIGTERM or SIGINT, the service stops
+    accepting events, waits for those in progress, and exits.
+
+        python -m cf_postgres.server --port 8080
+    """
+
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cf_postgres import lambda_handler, queue_handler, util
+from cf_postgres.constants import *
+
+
+DEFAULT_PORT        = 8080
+DEFAULT_WORKERS     = 16
+DEFAULT_POOL_SIZE   = 4
+
+# pooled connections that have been idle for longer than this are closed rather
+# than reused, since the database (or a firewall) may have dropped them
+
+MAX_IDLE_SECONDS    = 300
+
+
+class ConnectionPool:
+    """ Maintains open connections for each admin secret, up to a maximum number per
+        secret; callers wait if all connections are in use.
+        """
+
+    def __init__(self, max_size=DEFAULT_POOL_SIZE, max_idle_seconds=MAX_IDLE_SECONDS):
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self._lock = threading.Condition()
+        self._idle = {}         # secret ARN -> list of (connection, time released)
+        self._in_use = {}       # secret ARN -> count
+        self._closed = False
+
+    @contextmanager
+    def connection(self, secret_arn):
+        conn = self._acquire(secret_arn)
+        try:
+            yield conn
+        finally:
+            self._release(secret_arn, conn)
+
+    def close(self):
+        """ Closes all idle connections; connections that are in use are closed when
+            released.
+            """
+        with self._lock:
+            self._closed = True
+            idle = [conn for conns in self._idle.values() for (conn, _) in conns]
+            self._idle.clear()
+        for conn in idle:
+            _close_quietly(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "InUse":    sum(self._in_use.values()),
+                "Idle":     sum(len(conns) for conns in self._idle.values()),
+            }
+
+    def _acquire(self, secret_arn):
+        stale = []
+        with self._lock:
+            while True:
+                idle = self._idle.get(secret_arn, [])
+                while idle:
+                    (conn, released_at) = idle.pop()
+                    if time.time() - released_at < self.max_idle_seconds:
+                        self._in_use[secret_arn] = self._in_use.get(secret_arn, 0) + 1
+                        break
+                    stale.append(conn)
+                else:
+                    conn = None
+                if conn:
+                    break
+                if self._in_use.get(secret_arn, 0) < self.max_size:
+                    self._in_use[secret_arn] = self._in_use.get(secret_arn, 0) + 1
+                    break
+                self._lock.wait()
+        for stale_conn in stale:
+            _close_quietly(stale_conn)
+        if conn:
+            return conn
+        try:
+            return util.open_connection(secret_arn)
+        except:
+            self._release(secret_arn, None)
+            raise
+
+    def _release(self, secret_arn, conn):
+        # a connection that can't be rolled back is broken, and not reused
+        if conn:
+            try:
+                conn.rollback()
+                conn.autocommit = False
+            except Exception as ex:
+                logging.warning(f"discarding connection for {secret_arn}: {ex}")
+                _close_quietly(conn)
+                conn = None
+        with self._lock:
+            self._in_use[secret_arn] -= 1
+            if conn and not self._closed:
+                self._idle.setdefault(secret_arn, []).append((conn, time.time()))
+                conn = None
+            self._lock.notify_all()
+        if conn:
+            _close_quietly(conn)
+
+
+class Service:
+    """ Accepts events and processes them on a thread pool.
+        """
+
+    def __init__(self, workers=DEFAULT_WORKERS, pool_size=DEFAULT_POOL_SIZE):
+        self.pool = ConnectionPool(pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cf-postgres")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._processed = 0
+        self.draining = False
+
+    def submit(self, event):
+        """ Queues an event for processing. Returns False if the service is draining.
+            The event is queued while holding the lock, so that drain() can't shut
+            down the executor between the check and the submit.
+            """
+        with self._lock:
+            if self.draining:
+                return False
+            self._executor.submit(self._process, event)
+            self._pending += 1
+        return True
+
+    def drain(self):
+        """ Stops accepting events, and waits for those already accepted to complete.
+            """
+        with self._lock:
+            self.draining = True
+        logging.info(f"draining; {self._pending} events in progress")
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+        logging.info("drain complete")
+
+    def health(self):
+        with self._lock:
+            result = {
+                RSP_STATUS:     "DRAINING" if self.draining else "OK",
+                "Pending":      self._pending,
+                "Processed":    self._processed,
+            }
+        result["Connections"] = self.pool.stats()
+        return result
+
+    def _process(self, event):
+        try:
+            process_event(self.pool, event)
+        except Exception:
+            logging.error("unable to process event", exc_info=True)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._processed += 1
+
+
+def process_event(pool, event):
+    """ Processes a single event using a pooled connection, and sends its response.
+        Events that need connections to multiple databases, or that acknowledge a
+        delete before performing it, are processed as they would be by the Lambda.
+        """
+    props = event.get(REQ_PROPERTIES, {})
+    secret_arn = props.get(REQ_ADMIN_SECRET)
+    early_ack = event.get(REQ_REQUEST_TYPE) == ACTION_DELETE and util.get_boolean_prop(props, REQ_EARLY_ACK)
+    if not secret_arn or props.get(REQ_DATABASES) or early_ack:
+        lambda_handler.handle(event, None)
+        return
+    response = lambda_handler.new_response(event)
+    try:
+        with pool.connection(secret_arn) as conn:
+            queue_handler.process_event(conn, event, response)
+    except Exception as ex:
+        util.report_failure(response, f"Unhandled exception: \"{ex}\"")
+    lambda_handler.send_response(event[REQ_RESPONSE_URL], response)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Handles HTTP requests; the server must have a "service" attribute.
+        """
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            health = self.server.service.health()
+            self._send(200 if health[RSP_STATUS] == "OK" else 503, health)
+        else:
+            self._send(404, { RSP_REASON: "not found" })
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            event = json.loads(self.rfile.read(length))
+            if not isinstance(event, dict):
+                raise ValueError("not a JSON object")
+        except Exception as ex:
+            self._send(400, { RSP_REASON: f"invalid event: {ex}" })
+            return
+        if str(event.get(REQ_PLAN, "")).lower() == "true" or lambda_handler.is_warm_up(event):
+            self._send(200, lambda_handler.handle(event, None))
+        elif not event.get(REQ_RESPONSE_URL):
+            self._send(400, { RSP_REASON: f"missing {REQ_RESPONSE_URL}" })
+        elif self.server.service.submit(event):
+            self._send(202, { RSP_REQUEST_ID: event.get(REQ_REQUEST_ID) })
+        else:
+            self._send(503, { RSP_REASON: "service is draining" })
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+    def _send(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def create_server(host, port, service):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def shutdown(server):
+    """ Drains the service and stops the server. Health checks continue to be
+        answered (reporting that the service is draining) until the drain completes.
+        """
+    server.service.drain()
+    server.shutdown()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m cf_postgres.server", description="Runs the handlers as an HTTP service")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="number of worker threads (default: %(default)s)")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="maximum connections per admin secret (default: %(default)s)")
+    args = parser.parse_args(argv)
+    server = create_server(args.host, args.port, Service(args.workers, args.pool_size))
+    def on_signal(signum, frame):
+        logging.info(f"received signal {signum}; shutting down")
+        threading.Thread(target=shutdown, args=(server,)).start()
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    logging.info(f"listening on {args.host}:{args.port}")
+    server.serve_forever()
+    server.server_close()
+    return 0
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
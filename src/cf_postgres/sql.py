@@ -0,0 +1,189 @@
+# Copyright (c) Keith D Gregory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Builds SQL statements from names supplied as resource properties.
+
+    Names follow the rules for SQL identifiers as they'd be written in a script: a
+    name that's a valid unquoted identifier is case-insensitive (it's folded to
+    lowercase), while any other name (one containing a dash, say) is used exactly
+    as given. A name that's already enclosed in double quotes is used as-is.
+
+    Statements are built from templates, which are parsed once and cached. Each
+    placeholder specifies how its value is rendered:
+
+        GRANT_ROLE = sql.template("grant {role:ident} to {members:roles}")
+        csr.execute(GRANT_ROLE(role="readers", members=["argle", "bargle"]))
+    """
+
+import functools
+import re
+import string
+
+
+# keywords that can't be used as unquoted names (everything other than Postgres'
+# "unreserved" keywords); quoting an unreserved keyword would be harmless, but
+# these are the ones that matter
+
+KEYWORDS = frozenset("""
+    all analyse analyze and any array as asc asymmetric both case cast check collate
+    column constraint create current_catalog current_date current_role current_time
+    current_timestamp current_user default deferrable desc distinct do else end except
+    false fetch for foreign from grant group having in initially intersect into lateral
+    leading limit localtime localtimestamp not null offset on only or order placing
+    primary references returning select session_user some symmetric system_user table
+    then to trailing true union unique user using variadic when where window with
+
+    authorization binary collation concurrently cross current_schema freeze full ilike
+    inner is isnull join left like natural notnull outer overlaps right similar
+    tablesample verbose
+
+    between bigint bit boolean char character coalesce dec decimal exists extract float
+    greatest grouping inout int integer interval json json_array json_arrayagg
+    json_exists json_object json_objectagg json_query json_scalar json_serialize
+    json_table json_value least merge_action national nchar none normalize nullif
+    numeric out overlay position precision real row setof smallint substring time
+    timestamp treat trim values varchar xmlattributes xmlconcat xmlelement xmlexists
+    xmlforest xmlnamespaces xmlparse xmlpi xmlroot xmlserialize xmltable
+    """.split())
+
+# role specifications that are keywords rather than names
+
+ROLE_KEYWORDS = frozenset(["public", "current_user", "session_user", "current_role"])
+
+_UNQUOTED = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+_SAFE = re.compile(r"[a-z_][a-z0-9_$]*")
+_NAME_PART = re.compile(r'"(?:[^"]|"")*"|[^."]+')
+
+
+@functools.lru_cache(maxsize=16384)
+def name(identifier):
+    """ Returns the name as it appears in the catalog, for use as a query parameter.
+        """
+    if len(identifier) > 1 and identifier.startswith('"') and identifier.endswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    if _UNQUOTED.fullmatch(identifier):
+        return identifier.lower()
+    return identifier
+
+
+@functools.lru_cache(maxsize=16384)
+def ident(identifier):
+    """ Returns the name as it should appear in a statement: unquoted if possible,
+        otherwise in double quotes.
+        """
+    return quote(name(identifier))
+
+
+def quote(actual):
+    """ Returns a name that's already in catalog form (eg, from a query, or from
+        name()) as it should appear in a statement. Unlike ident(), this never
+        folds case.
+        """
+    if _SAFE.fullmatch(actual) and actual not in KEYWORDS:
+        return actual
+    return '"' + actual.replace('"', '""') + '"'
+
+
+def quote_all(actuals):
+    return ", ".join(quote(a) for a in actuals)
+
+
+def split(identifier):
+    """ Splits a name that may be qualified by a schema into its parts, as given
+        (ie, without folding or removing quotes).
+        """
+    return _NAME_PART.findall(identifier)
+
+
+def qualified(identifier):
+    """ Quotes a name that may be qualified by a schema (or database and schema).
+        """
+    return ".".join(ident(part) for part in split(identifier))
+
+
+@functools.lru_cache(maxsize=16384)
+def role(identifier):
+    """ Quotes a role name, passing through "PUBLIC" and the CURRENT_USER family.
+        """
+    if identifier.lower() in ROLE_KEYWORDS:
+        return identifier.upper()
+    return ident(identifier)
+
+
+def roles(identifiers):
+    return ", ".join(role(r) for r in identifiers)
+
+
+def literal(value):
+    """ Returns a string literal, or NULL if the value is None. Assumes that
+        standard_conforming_strings is on (the default since Postgres 9.1).
+        """
+    if value is None:
+        return "NULL"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class Template:
+    """ A statement with named placeholders, in str.format() syntax, where the format
+        spec identifies how the value is rendered: ident, qualified, role, roles,
+        name or names (for catalog-form names), literal, or raw (the default, for
+        fragments generated by the handler).
+        """
+
+    RENDERERS = {
+        "ident":        ident,
+        "qualified":    qualified,
+        "role":         role,
+        "roles":        roles,
+        "name":         quote,
+        "names":        quote_all,
+        "literal":      literal,
+        "raw":          str,
+        }
+
+    def __init__(self, text):
+        self.text = text
+        # the text is split into literal parts and empty slots, with a (slot index,
+        # field, renderer) tuple for each placeholder; calling the template fills a
+        # copy of the parts and joins it, which avoids re-parsing the format string
+        self._parts = []
+        self._fields = []
+        for (literal_text, field, spec, conversion) in string.Formatter().parse(text):
+            if literal_text:
+                self._parts.append(literal_text)
+            if field is not None:
+                self._fields.append((len(self._parts), field, self.RENDERERS[spec or "raw"]))
+                self._parts.append(None)
+        self._fields = tuple(self._fields)
+
+    def __call__(self, **values):
+        parts = self._parts.copy()
+        for (index, field, renderer) in self._fields:
+            parts[index] = renderer(values[field])
+        return "".join(parts)
+
+
+@functools.lru_cache(maxsize=None)
+def template(text):
+    """ Returns the parsed template for a statement.
+        """
+    return Template(text)
+
+
+def batch(statements, size):
+    """ Combines statements into groups of at most size statements, each of which can
+        be sent to the database in a single round-trip (this requires the simple query
+        protocol, which PG8000 uses for a statement without parameters).
+        """
+    return [";\n".join(statements[n:n + size]) for n in range(0, len(statements), size)]
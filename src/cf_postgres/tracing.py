@@ -0,0 +1,154 @@
+# Copyright (c) Keith D Gregory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Optional OpenTelemetry tracing. If the OpenTelemetry API isn't installed, spans
+    are no-ops. If it is, spans go to the global tracer provider (which is configured
+    by the AWS Distro for OpenTelemetry Lambda layer), unless configure() has been
+    called with an exporter.
+    """
+
+from contextlib import contextmanager
+
+from cf_postgres.constants import *
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+
+TRACER_NAME = "cf_postgres"
+
+# span attributes
+
+ATTR_STACK_ID       = "cloudformation.stack_id"
+ATTR_LOGICAL_ID     = "cloudformation.logical_resource_id"
+ATTR_REQUEST_ID     = "cloudformation.request_id"
+ATTR_REQUEST_TYPE   = "cloudformation.request_type"
+ATTR_RESOURCE_TYPE  = "cf_postgres.resource_type"
+ATTR_STATUS         = "cf_postgres.status"
+ATTR_STATEMENTS     = "cf_postgres.statement_count"
+
+
+# the provider created by configure(); None to use the global provider
+_provider = None
+
+
+def configure(exporter):
+    """ Sends spans to the provided exporter, as each span ends; requires the
+        OpenTelemetry SDK. Passing None reverts to the global tracer provider.
+        """
+    global _provider
+    if _provider:
+        _provider.shutdown()
+        _provider = None
+    if exporter:
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+        _provider = TracerProvider()
+        _provider.add_span_processor(SimpleSpanProcessor(exporter))
+
+
+def is_available():
+    return otel_trace is not None
+
+
+@contextmanager
+def span(name, **attributes):
+    """ Starts a span as a child of the current span, yielding the span (or a no-op
+        stand-in if tracing isn't available). Attributes with None values are omitted.
+        An exception that escapes the span is recorded on it.
+        """
+    if otel_trace is None:
+        yield _NO_OP_SPAN
+        return
+    provider = _provider or otel_trace.get_tracer_provider()
+    tracer = provider.get_tracer(TRACER_NAME)
+    with tracer.start_as_current_span(name, attributes={k: v for (k, v) in attributes.items() if v is not None}) as current:
+        yield current
+
+
+def event_attributes(event):
+    """ Returns the attributes that identify a CloudFormation event, as keyword
+        arguments for span().
+        """
+    return {
+        ATTR_STACK_ID:      event.get(REQ_STACK_ID),
+        ATTR_LOGICAL_ID:    event.get(REQ_LOGICAL_ID),
+        ATTR_REQUEST_ID:    event.get(REQ_REQUEST_ID),
+        ATTR_REQUEST_TYPE:  event.get(REQ_REQUEST_TYPE),
+        ATTR_RESOURCE_TYPE: event.get(REQ_PROPERTIES, {}).get(REQ_RESOURCE_TYPE),
+        }
+
+
+def flush():
+    """ Exports any buffered spans; called at the end of an invocation, because the
+        Lambda may be frozen before a background export happens.
+        """
+    if otel_trace is None:
+        return
+    provider = _provider or otel_trace.get_tracer_provider()
+    if hasattr(provider, "force_flush"):
+        provider.force_flush()
+
+
+class CountingConnection:
+    """ Wraps a database connection, counting the statements executed through its
+        cursors. All other operations are passed through.
+        """
+
+    def __init__(self, conn):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "statement_count", 0)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return self._conn.__exit__(*args)
+
+    def cursor(self):
+        return _CountingCursor(self, self._conn.cursor())
+
+
+class _CountingCursor:
+
+    def __init__(self, counter, csr):
+        self._counter = counter
+        self._csr = csr
+
+    def __getattr__(self, name):
+        return getattr(self._csr, name)
+
+    def execute(self, *args, **kwargs):
+        object.__setattr__(self._counter, "statement_count", self._counter.statement_count + 1)
+        return self._csr.execute(*args, **kwargs)
+
+
+class _NoOpSpan:
+
+    def set_attribute(self, key, value):
+        pass
+
+    def is_recording(self):
+        return False
+
+
+_NO_OP_SPAN = _NoOpSpan()
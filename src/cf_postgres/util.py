@@ -17,12 +17,19 @@
     """
 
 import boto3
+import contextvars
 import json
 import logging
+import os
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import pg8000.dbapi
 
+from cf_postgres import tracing
 from cf_postgres.constants import *
 
 
@@ -48,6 +55,17 @@ def get_boolean_prop(props, name, default=False):
         return default
 
 
+def get_int_prop(props, name, default=None):
+    """ Retrieves a numeric property. CloudFormation passes all scalar values as
+        strings, so this will convert; a non-numeric value raises ValueError.
+        """
+    value = props.get(name)
+    if value is None or value == "":
+        return default
+    else:
+        return int(value)
+
+
 def report_success(response, physical_resource_id, data=None):
     """ Populates the response for successful operation. Must include a valid
         resource ID, may include a dict of additional data that can be accessed
@@ -69,22 +87,177 @@ def report_failure(response, reason, physical_resource_id=None):
     response[RSP_PHYSICAL_ID]   = physical_resource_id or "unknown"
 
 
+def report_in_progress(response, physical_resource_id):
+    """ Populates the response for an operation that couldn't be completed before
+        the invocation deadline. This is not sent to CloudFormation; instead, the
+        request is re-submitted so that the handler can resume.
+        """
+    logging.info(f"request in progress: {physical_resource_id}")
+    response[RSP_STATUS]        = RSP_IN_PROGRESS
+    response[RSP_PHYSICAL_ID]   = physical_resource_id
+
+
+def retrieve_attributes(csr, sql, args):
+    """ Executes a query that returns at most one row, and returns that row as a
+        dict for the Data element of a response (where it's accessed via Fn::GetAtt).
+        Keys are the column names, so should be quoted in the query. CloudFormation
+        attributes are strings, so values are converted: booleans are "true" or
+        "false", and lists are joined with commas. Null values are omitted. Returns
+        None if there's no row.
+        """
+    csr.execute(sql, args)
+    row = csr.fetchone()
+    if not row:
+        return None
+    result = {}
+    for (column, value) in zip([d[0] for d in csr.description], row):
+        if value is None:
+            continue
+        elif isinstance(value, bool):
+            result[column] = "true" if value else "false"
+        elif isinstance(value, (list, tuple)):
+            result[column] = ",".join(str(v) for v in value)
+        else:
+            result[column] = str(value)
+    return result
+
+
+def emit_metric(name, value, dimensions, unit="Count"):
+    """ Writes a CloudWatch metric to stdout, using embedded metric format. Lambda
+        forwards this to CloudWatch Logs, which extracts the metric.
+        """
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace":    METRIC_NAMESPACE,
+                "Dimensions":   [ list(dimensions.keys()) ],
+                "Metrics":      [{ "Name": name, "Unit": unit }],
+                }],
+            },
+        name: value,
+        }
+    record.update(dimensions)
+    print(json.dumps(record))
+
+
+# the time (from time.time()) by which the current invocation must complete, if known;
+# this is shared by all threads, since they're working on the same invocation
+
+_deadline = None
+
+
+def set_deadline(context):
+    """ Records the deadline for the current invocation, from the Lambda context
+        object. If there's no context (eg, running outside of Lambda), there is no
+        deadline.
+        """
+    global _deadline
+    if context and hasattr(context, "get_remaining_time_in_millis"):
+        _deadline = time.time() + context.get_remaining_time_in_millis() / 1000
+    else:
+        _deadline = None
+
+
+def seconds_remaining():
+    """ Returns the number of seconds until the current invocation's deadline, None
+        if there isn't a deadline.
+        """
+    if _deadline is None:
+        return None
+    return _deadline - time.time()
+
+
+# AWS clients and connection secrets are cached for the life of the Lambda
+# execution environment; reset_caches() discards them
+
+_cache_lock = threading.Lock()
+_clients = {}
+_secret_cache = {}
+
+
+def aws_client(service_name):
+    """ Returns a client for the named AWS service, creating it on first use.
+        """
+    with _cache_lock:
+        client = _clients.get(service_name)
+        if not client:
+            client = boto3.client(service_name)
+            _clients[service_name] = client
+        return client
+
+
+def reset_caches():
+    """ Discards all cached clients and secrets.
+        """
+    with _cache_lock:
+        _clients.clear()
+        _secret_cache.clear()
+
+
+# set while generating a plan, so that secrets are not retrieved
+_planning = threading.local()
+
+
+@contextmanager
+def planning():
+    """ Within this context, retrieve_json_secret() returns placeholder values rather
+        than calling Secrets Manager. Applies only to the current thread.
+        """
+    _planning.active = True
+    try:
+        yield
+    finally:
+        _planning.active = False
+
+
+def is_planning():
+    """ Returns True if called within a planning() context.
+        """
+    return getattr(_planning, "active", False)
+
+
 def retrieve_json_secret(secret_arn):
     """ Retrieves the named secret and parses its contents as JSON.
         """
+    if is_planning():
+        return placeholder_secret(secret_arn)
     logging.debug(f"retrieving secret: {secret_arn}")
-    sm_client = boto3.client('secretsmanager')
-    secret_json = sm_client.get_secret_value(SecretId=secret_arn)['SecretString']
+    with tracing.span("cf_postgres.retrieve_secret", **{"aws.secretsmanager.secret_arn": secret_arn}):
+        sm_client = aws_client('secretsmanager')
+        secret_json = sm_client.get_secret_value(SecretId=secret_arn)['SecretString']
     return json.loads(secret_json)
 
 
+def placeholder_secret(secret_arn):
+    """ Returns a secret that identifies its fields without revealing values; used
+        when generating a plan.
+        """
+    return {
+        DB_SECRET_USERNAME: f"<{secret_arn}:{DB_SECRET_USERNAME}>",
+        DB_SECRET_PASSWORD: "********",
+        DB_SECRET_HOSTNAME: f"<{secret_arn}:{DB_SECRET_HOSTNAME}>",
+        DB_SECRET_PORT:     "5432",
+        DB_SECRET_DATABASE: f"<{secret_arn}:{DB_SECRET_DATABASE}>",
+    }
+
+
 def retrieve_pg8000_secret(secret_arn):
     """ Retrieves the named secret, which is presumed to contain standard RDS
         connection information, and extracts the keyword arguments used for a
         PG8000 connection.
+
+        The result is cached, for CF_POSTGRES_SECRET_CACHE_TTL seconds (default 300,
+        0 to disable). Call invalidate_cached_secret() if the cached credentials are
+        rejected, in case the secret has been rotated.
         """
+    now = time.time()
+    with _cache_lock:
+        cached = _secret_cache.get(secret_arn)
+    if cached and cached[0] > now:
+        return dict(cached[1])
     secret = retrieve_json_secret(secret_arn)
-    return {
+    connection_info = {
         'user':             secret[DB_SECRET_USERNAME],
         'password':         secret[DB_SECRET_PASSWORD],
         'host':             secret[DB_SECRET_HOSTNAME],
@@ -92,6 +265,51 @@ def retrieve_pg8000_secret(secret_arn):
         'database':         secret[DB_SECRET_DATABASE],
         'application_name': "cf-postgres",
     }
+    ttl = int(os.environ.get(ENV_SECRET_CACHE_TTL, DEFAULT_SECRET_CACHE_TTL))
+    if ttl > 0:
+        with _cache_lock:
+            _secret_cache[secret_arn] = (now + ttl, dict(connection_info))
+    return connection_info
+
+
+def invalidate_cached_secret(secret_arn):
+    with _cache_lock:
+        _secret_cache.pop(secret_arn, None)
+
+
+def open_connection(secret_arn, database=None):
+    """ Establishes a connection using the information in the named secret, optionally
+        to a different database than the secret specifies. Any exceptions are allowed
+        to propagate.
+
+        Connection information is cached, so if the database rejects the cached
+        credentials (perhaps because the secret was rotated), this retrieves the
+        secret again and makes a second attempt.
+        """
+    def attempt():
+        connection_info = retrieve_pg8000_secret(secret_arn)
+        if database:
+            connection_info["database"] = database
+        return connect(connection_info)
+    try:
+        return attempt()
+    except pg8000.dbapi.DatabaseError as ex:
+        if sqlstate(ex) not in (SQLSTATE_INVALID_PASSWORD, SQLSTATE_INVALID_AUTHORIZATION):
+            raise
+        logging.warning(f"authentication failed; retrieving secret {secret_arn} and retrying")
+        invalidate_cached_secret(secret_arn)
+        return attempt()
+
+
+def connect(connection_info):
+    """ Establishes a connection using explicit connection information. Any
+        exceptions are allowed to propagate.
+        """
+    logging.info(f"connecting to {connection_info.get('host')}:{connection_info.get('port')}, "
+                f"database {connection_info.get('database')} as user {connection_info.get('user')}")
+    with tracing.span("cf_postgres.connect", **{"db.system": "postgresql", "db.name": connection_info.get('database'),
+                                               "server.address": connection_info.get('host')}):
+        return pg8000.dbapi.connect(**connection_info)
 
 
 def connect_to_db(connection_info):
@@ -110,6 +328,39 @@ def connect_to_db(connection_info):
     raise Exception("timed-out waiting for container to start")
 
 
+def max_workers():
+    """ Returns the maximum number of threads to use for concurrent operations,
+        from the environment (default 4).
+        """
+    return int(os.environ.get(ENV_MAX_WORKERS, DEFAULT_MAX_WORKERS))
+
+
+def run_concurrently(fn, items, max_workers):
+    """ Invokes the function for each of the items, using a pool with at most the
+        specified number of threads. Returns a list of results, in the same order
+        as the items; if an invocation raises, its exception takes the place of
+        its result. Each invocation runs in a copy of the caller's context, so that
+        (for example) tracing spans are attributed to the caller's span.
+        """
+    def invoke(item):
+        try:
+            return fn(item)
+        except Exception as ex:
+            return ex
+    contexts = [contextvars.copy_context() for item in items]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        return list(pool.map(lambda ctx, item: ctx.run(invoke, item), contexts, items))
+
+
+def sqlstate(ex):
+    """ Extracts the Postgres error code (SQLSTATE) from a PG8000 exception, None
+        if the exception doesn't have one.
+        """
+    if ex.args and isinstance(ex.args[0], dict):
+        return ex.args[0].get('C')
+    return None
+
+
 def select_as_dict(connection_info, fn):
     """ Executes a query and transforms the results to a name-value dict.
         The query is passed as a function of the cursor object:
@@ -0,0 +1,96 @@
+""" Measures the cost of generating statements for large grant lists. This isn't a
+    test (pytest doesn't collect it); run it from the project root:
+
+        PYTHONPATH=src python tests/benchmark_sql.py [GRANTEES]
+
+    Reports the time to plan a Schema resource that grants to the specified number
+    of users (half of them read-only), along with the time to build the same
+    statements using templates and using unquoted f-strings.
+    """
+
+import sys
+import time
+
+from cf_postgres import lambda_handler, sql
+from cf_postgres.handlers import schema_handler
+
+
+DEFAULT_GRANTEES = 10000
+REPETITIONS = 5
+
+
+def make_event(grantees):
+    users = [f"app_user_{n}" for n in range(0, grantees, 2)]
+    ro_users = [f"App-Reader-{n}" for n in range(1, grantees, 2)]
+    return {
+        "RequestType":          "Create",
+        "ResourceProperties":   {
+                                "Resource":         "Schema",
+                                "Name":             "example",
+                                "Owner":            "app_owner",
+                                "Users":            users,
+                                "ReadOnlyUsers":    ro_users,
+                                "GrantExisting":    "true",
+                                },
+        }
+
+
+def build_with_templates(recipients):
+    statements = []
+    for (recipient, is_readonly) in recipients:
+        for statement in schema_handler.GRANTS[is_readonly]:
+            statements.append(statement(schema_name="example", recipient=recipient))
+    return statements
+
+
+def build_with_fstrings(recipients):
+    statements = []
+    schema_name = "example"
+    for (recipient, is_readonly) in recipients:
+        if is_readonly:
+            statements.append(f"grant usage on schema {schema_name} to {recipient}")
+            statements.append(f"alter default privileges in schema {schema_name} grant select on tables to {recipient}")
+            statements.append(f"alter default privileges in schema {schema_name} grant select, usage on sequences to {recipient}")
+            statements.append(f"alter default privileges in schema {schema_name} grant execute on functions to {recipient}")
+        else:
+            statements.append(f"grant all on schema {schema_name} to {recipient}")
+            statements.append(f"alter default privileges in schema {schema_name} grant all on tables to {recipient}")
+            statements.append(f"alter default privileges in schema {schema_name} grant all on sequences to {recipient}")
+            statements.append(f"alter default privileges in schema {schema_name} grant all on functions to {recipient}")
+            statements.append(f"alter default privileges in schema {schema_name} grant all on types to {recipient}")
+    return statements
+
+
+def timed(fn, *args):
+    """ Returns the best elapsed time of several runs, along with the last result.
+        """
+    best = None
+    for n in range(REPETITIONS):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result)
+
+
+def main(argv):
+    grantees = int(argv[1]) if len(argv) > 1 else DEFAULT_GRANTEES
+    event = make_event(grantees)
+    props = event["ResourceProperties"]
+    recipients = [(u, False) for u in props["Users"]] + [(u, True) for u in props["ReadOnlyUsers"]]
+
+    (elapsed, result) = timed(lambda_handler.plan, event)
+    print(f"plan for {grantees} grantees: {len(result['Statements'])} statements in {elapsed * 1000:.1f} ms "
+          f"({result['Status']})")
+
+    (elapsed, statements) = timed(build_with_templates, recipients)
+    print(f"templates:  {len(statements)} statements in {elapsed * 1000:.1f} ms")
+    (elapsed, statements) = timed(build_with_fstrings, recipients)
+    print(f"f-strings:  {len(statements)} statements in {elapsed * 1000:.1f} ms (no quoting)")
+
+    batches = sql.batch(statements, schema_handler.STATEMENTS_PER_EXECUTE)
+    print(f"batched:    {len(batches)} round-trips of up to {schema_handler.STATEMENTS_PER_EXECUTE} statements")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
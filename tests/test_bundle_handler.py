@@ -0,0 +1,185 @@
+""" Unit tests for the Bundle resource. These use a recording connection, so verify
+    the order of the bundled resources' statements and the single commit.
+    """
+
+import pytest
+from unittest.mock import ANY
+
+from cf_postgres import lambda_handler
+from cf_postgres.handlers import bundle_handler
+from cf_postgres.plan import RecordingConnection, RecordingCursor
+
+
+################################################################################
+# properties from the default event
+################################################################################
+
+RESOURCE_TYPE       = "Bundle"
+ADMIN_SECRET_ARN    = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-admin-5z4FyE"
+PHYSICAL_ID         = "User:app_owner,User:app_reader,Schema:app"
+
+
+################################################################################
+## fixtures and helpers
+################################################################################
+
+@pytest.fixture
+def default_props():
+    # the schema is listed first, but depends on the users
+    return {
+        "Resource":         RESOURCE_TYPE,
+        "AdminSecretArn":   ADMIN_SECRET_ARN,
+        "Resources": [
+            { "Resource": "Schema", "Name": "app", "Owner": "app_owner", "ReadOnlyUsers": ["app_reader"] },
+            { "Resource": "User",   "Username": "app_owner", "Password": "secret1" },
+            { "Resource": "User",   "Username": "app_reader", "Password": "secret2" },
+            ],
+        }
+
+
+@pytest.fixture
+def response_holder():
+    return {}
+
+
+class FailingConnection(RecordingConnection):
+    """ Records statements, raising when one starts with a given prefix.
+        """
+
+    def __init__(self, prefix):
+        super().__init__()
+        self.prefix = prefix
+
+    def cursor(self):
+        conn = self
+        class FailingCursor(RecordingCursor):
+            def execute(self, sql, args=None):
+                if sql.startswith(conn.prefix):
+                    raise Exception("permission denied")
+                super().execute(sql, args)
+        return FailingCursor(self)
+
+
+def ddl(conn):
+    # omits queries, so that tests can focus on the statements that change things, and
+    # splits batched statements
+    return [s for batch in conn.statements for s in batch.split(";\n") if not s.startswith("select") and not s.startswith("with")]
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create(default_props, response_holder):
+    conn = RecordingConnection()
+    assert bundle_handler.try_handle(conn, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    statements = ddl(conn)
+    assert statements[0] == "create user app_owner password '********' NOCREATEDB NOCREATEROLE"
+    assert statements[1] == "create user app_reader password '********' NOCREATEDB NOCREATEROLE"
+    assert statements[2] == "create schema if not exists app authorization app_owner"
+    assert "grant usage on schema app to app_reader" in statements
+    assert conn.statements[-1] == "commit"
+    assert conn.statements.count("commit") == 1
+    assert "rollback" not in conn.statements
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": PHYSICAL_ID,
+                              }
+
+
+def test_update(default_props, response_holder):
+    old_props = default_props
+    new_props = dict(default_props, Resources=[
+        { "Resource": "Schema", "Name": "app", "Owner": "app_owner", "Users": ["app_writer"] },
+        { "Resource": "User",   "Username": "app_owner", "Password": "secret1" },
+        { "Resource": "User",   "Username": "app_writer", "Password": "secret3" },
+        ])
+    conn = RecordingConnection()
+    assert bundle_handler.try_handle(conn, "Update", RESOURCE_TYPE, PHYSICAL_ID, new_props, old_props, response_holder)
+    statements = ddl(conn)
+    assert statements[0] == "create user app_writer password '********' NOCREATEDB NOCREATEROLE"
+    assert "revoke usage on schema app from app_reader" in statements
+    assert "grant all on schema app to app_writer" in statements
+    assert statements[-2:] == ["drop user app_reader", "commit"]
+    assert conn.statements.count("commit") == 1
+    assert response_holder["Status"] == "SUCCESS"
+    assert response_holder["PhysicalResourceId"] == PHYSICAL_ID
+
+
+def test_update_renames_schema(default_props, response_holder):
+    old_props = default_props
+    old_props["Resources"][0]["Cascade"] = "true"
+    new_props = dict(default_props, Resources=[dict(default_props["Resources"][0], Name="application")] + default_props["Resources"][1:])
+    conn = RecordingConnection()
+    assert bundle_handler.try_handle(conn, "Update", RESOURCE_TYPE, PHYSICAL_ID, new_props, old_props, response_holder)
+    statements = ddl(conn)
+    assert "alter schema app rename to  application" in statements
+    assert not any(s.startswith("drop") for s in statements)
+    assert conn.statements.count("commit") == 1
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_refuses_ambiguous_schema_rename(default_props, response_holder):
+    old_props = dict(default_props, Resources=[
+        { "Resource": "Schema", "Name": "app", "Cascade": "true" },
+        { "Resource": "Schema", "Name": "reporting" },
+        ])
+    new_props = dict(default_props, Resources=[
+        { "Resource": "Schema", "Name": "application" },
+        ])
+    conn = RecordingConnection()
+    assert bundle_handler.try_handle(conn, "Update", RESOURCE_TYPE, PHYSICAL_ID, new_props, old_props, response_holder)
+    assert conn.statements == ["rollback"]
+    assert response_holder["Status"] == "FAILED"
+    assert "can not determine whether schemas app have been renamed or removed" in response_holder["Reason"]
+
+
+def test_delete(default_props, response_holder):
+    conn = RecordingConnection()
+    assert bundle_handler.try_handle(conn, "Delete", RESOURCE_TYPE, PHYSICAL_ID, default_props, {}, response_holder)
+    assert ddl(conn) == [
+        "drop schema if exists app",
+        "drop user app_reader",
+        "drop user app_owner",
+        "commit",
+        ]
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": PHYSICAL_ID,
+                              }
+
+
+def test_failure_rolls_back_bundle(default_props, response_holder):
+    conn = FailingConnection("create schema")
+    assert bundle_handler.try_handle(conn, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert "commit" not in conn.statements
+    assert conn.statements[-1] == "rollback"
+    assert conn.statements.count("rollback") == 1
+    assert response_holder == {
+                              "Status": "FAILED",
+                              "PhysicalResourceId": "unknown",
+                              "Reason": ANY,
+                              }
+    assert "Schema app" in response_holder["Reason"]
+    assert "permission denied" in response_holder["Reason"]
+
+
+@pytest.mark.parametrize("resources, message", [
+    ([{ "Resource": "Database", "Name": "example" }],   "unsupported resource type: Database"),
+    ([{ "Resource": "Schema" }],                         "Schema does not specify a name"),
+    ([{ "Resource": "User", "Username": "argle" },
+      { "Resource": "User", "Username": "argle" }],     "User argle is specified more than once"),
+    ])
+def test_invalid_resources(default_props, response_holder, resources, message):
+    conn = RecordingConnection()
+    default_props["Resources"] = resources
+    assert bundle_handler.try_handle(conn, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert conn.statements == ["rollback"]
+    assert response_holder["Status"] == "FAILED"
+    assert message in response_holder["Reason"]
+
+
+def test_plan(default_props):
+    result = lambda_handler.plan({ "RequestType": "Create", "ResourceProperties": default_props })
+    assert result["Status"] == "SUCCESS"
+    assert result["Statements"].count("commit") == 1
@@ -0,0 +1,200 @@
+""" Unit tests for the Database sub-resource. These tests verify the behavior of
+    the handler, along with the SQL that it generates; the integration tests
+    verify that the SQL actually does what it's supposed to.
+    """
+
+import copy
+import pytest
+from unittest.mock import Mock, ANY
+
+import pg8000.dbapi
+
+from cf_postgres.handlers import database_handler
+
+
+################################################################################
+# properties from the default event
+################################################################################
+
+RESOURCE_TYPE       = "Database"
+DB_NAME             = "example"
+OWNER               = "me"
+TEMPLATE            = "example_template"
+ENCODING            = "UTF8"
+CONNECTION_LIMIT    = 20
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def mock_connection():
+    conn = Mock()
+    # first query retrieves server version (if needed), second retrieves attributes
+    conn.cursor.return_value.fetchone.side_effect = [(150004,), None]
+    return conn
+
+
+@pytest.fixture
+def default_props():
+    return {
+        'Name':             DB_NAME,
+        'Owner':            OWNER,
+        'Template':         TEMPLATE,
+        'Encoding':         ENCODING,
+        'ConnectionLimit':  str(CONNECTION_LIMIT),
+        }
+
+
+@pytest.fixture
+def response_holder():
+    return {}
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(database_handler.time, 'sleep', Mock())
+
+
+def executed_sql(conn):
+    # excludes the query that retrieves attributes, which is verified separately
+    return [c[0][0] for c in conn.cursor.return_value.execute.call_args_list if "from    pg_database" not in c[0][0]]
+
+
+def in_use_error():
+    return pg8000.dbapi.DatabaseError({'S': 'ERROR', 'C': '55006', 'M': 'source database is being accessed by other users'})
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_extract_props(default_props):
+    (owner_name, template_name, encoding, connection_limit) = database_handler._extract_props(default_props)
+    assert owner_name == OWNER
+    assert template_name == TEMPLATE
+    assert encoding == ENCODING
+    assert connection_limit == CONNECTION_LIMIT
+
+
+def test_create_all_properties(mock_connection, default_props, response_holder):
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection)[-1] == \
+        f"create database {DB_NAME} owner {OWNER} template {TEMPLATE} strategy file_copy encoding '{ENCODING}' connection limit {CONNECTION_LIMIT}"
+    assert mock_connection.autocommit == False
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": DB_NAME,
+                              }
+
+
+def test_create_from_template_old_server(mock_connection, response_holder):
+    mock_connection.cursor.return_value.fetchone.side_effect = [(140009,), None]
+    props = { 'Name': DB_NAME, 'Template': TEMPLATE }
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    assert executed_sql(mock_connection)[-1] == f"create database {DB_NAME} template {TEMPLATE}"
+
+
+def test_create_returns_attributes(mock_connection, response_holder):
+    csr = mock_connection.cursor.return_value
+    csr.description = [("Oid",), ("Owner",), ("Encoding",), ("ConnectionLimit",)]
+    csr.fetchone.side_effect = [("16400", OWNER, ENCODING, -1)]
+    props = { 'Name': DB_NAME }
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    assert csr.execute.call_args[0][1] == (DB_NAME,)
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": DB_NAME,
+                              "Data": {
+                                  "Oid":             "16400",
+                                  "Owner":           OWNER,
+                                  "Encoding":        ENCODING,
+                                  "ConnectionLimit": "-1",
+                                  },
+                              }
+
+
+def test_create_minimal(mock_connection, response_holder):
+    props = { 'Name': DB_NAME }
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    assert executed_sql(mock_connection) == [ f"create database {DB_NAME}" ]
+
+
+def test_create_retries_when_template_in_use(no_sleep, mock_connection, default_props, response_holder):
+    csr = mock_connection.cursor.return_value
+    csr.execute.side_effect = [None, in_use_error(), in_use_error(), None, None]
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert csr.execute.call_count == 5
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_create_gives_up_when_template_in_use(no_sleep, mock_connection, default_props, response_holder):
+    csr = mock_connection.cursor.return_value
+    csr.execute.side_effect = [None] + [in_use_error()] * database_handler.TEMPLATE_RETRY_COUNT
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert csr.execute.call_count == database_handler.TEMPLATE_RETRY_COUNT + 1
+    assert response_holder == {
+                              "Status": "FAILED",
+                              "PhysicalResourceId": ANY,
+                              "Reason": ANY
+                              }
+    assert mock_connection.autocommit == False
+
+
+def test_create_does_not_retry_other_errors(no_sleep, mock_connection, default_props, response_holder):
+    csr = mock_connection.cursor.return_value
+    csr.execute.side_effect = [None, pg8000.dbapi.DatabaseError({'C': '42P04', 'M': 'database already exists'})]
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert csr.execute.call_count == 2
+    assert response_holder["Status"] == "FAILED"
+
+
+def test_update(mock_connection, default_props, response_holder):
+    old_props = copy.deepcopy(default_props)
+    default_props['Name'] = "renamed"
+    default_props['Owner'] = "someone_else"
+    del default_props['ConnectionLimit']
+    mock_connection.cursor.return_value.fetchone.side_effect = [None]
+    assert database_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, DB_NAME, default_props, old_props, response_holder)
+    assert executed_sql(mock_connection) == [
+        f"alter database {DB_NAME} rename to renamed",
+        f"alter database renamed owner to someone_else",
+        f"alter database renamed connection limit -1",
+        ]
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": "renamed",
+                              }
+
+
+def test_update_remove_owner(mock_connection, default_props, response_holder):
+    old_props = copy.deepcopy(default_props)
+    old_props['Owner'] = "someone_else"
+    default_props.pop('Owner', None)
+    mock_connection.cursor.return_value.fetchone.side_effect = [None]
+    assert database_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, DB_NAME, default_props, old_props, response_holder)
+    assert executed_sql(mock_connection) == [ f"alter database {DB_NAME} owner to CURRENT_USER" ]
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_no_changes(mock_connection, default_props, response_holder):
+    mock_connection.cursor.return_value.fetchone.side_effect = [None]
+    assert database_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, DB_NAME, default_props, copy.deepcopy(default_props), response_holder)
+    assert executed_sql(mock_connection) == []
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_delete(mock_connection, default_props, response_holder):
+    assert database_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, DB_NAME, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [ f"drop database if exists {DB_NAME}" ]
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": DB_NAME,
+                              }
+
+
+def test_missing_name(mock_connection, response_holder):
+    assert database_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, {}, {}, response_holder)
+    mock_connection.cursor.assert_not_called()
+    assert response_holder["Status"] == "FAILED"
@@ -0,0 +1,210 @@
+""" Unit tests for the Index sub-resource. These verify the SQL that the handler
+    generates, and its behavior when a build is already underway or takes longer
+    than the invocation.
+    """
+
+import pytest
+import threading
+
+from unittest.mock import Mock, ANY
+
+from cf_postgres import util
+from cf_postgres.handlers import index_handler
+
+
+################################################################################
+# properties from the default event
+################################################################################
+
+RESOURCE_TYPE       = "Index"
+INDEX_NAME          = "example_idx"
+TABLE_NAME          = "example.things"
+QUALIFIED_NAME      = "example.example_idx"
+CREATE_SQL          = "create index concurrently example_idx on example.things using btree (a, lower(b)) where c is not null"
+
+# rows returned by the state query
+VALID               = (True, None, None, None, None, None, None)
+INVALID             = (False, None, None, None, None, None, None)
+BUILDING            = (False, 1234, "building index: scanning table", 100, 1000, None, None)
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def mock_connection():
+    conn = Mock()
+    conn.cursor.return_value.fetchone.return_value = None
+    return conn
+
+
+@pytest.fixture
+def default_props():
+    return {
+        'Name':     INDEX_NAME,
+        'Table':    TABLE_NAME,
+        'Columns':  ["a", "lower(b)"],
+        'Where':    "c is not null",
+        }
+
+
+@pytest.fixture
+def response_holder():
+    return {}
+
+
+@pytest.fixture(autouse=True)
+def no_deadline(monkeypatch):
+    monkeypatch.setattr(util, 'seconds_remaining', Mock(return_value=None))
+    monkeypatch.setattr(index_handler, 'POLL_INTERVAL', 0.01)
+
+
+def set_states(conn, *states):
+    conn.cursor.return_value.fetchone.side_effect = list(states) + [None]
+
+
+def executed_sql(conn):
+    return [c[0][0] for c in conn.cursor.return_value.execute.call_args_list
+            if not c[0][0].strip().startswith("select")]
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create(mock_connection, default_props, response_holder):
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [ CREATE_SQL ]
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][1] == (QUALIFIED_NAME,)
+    assert mock_connection.autocommit == False
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": QUALIFIED_NAME,
+                              }
+
+
+def test_create_unique_with_method(mock_connection, response_holder):
+    props = {
+        'Name':     INDEX_NAME,
+        'Table':    "things",
+        'Columns':  ["a"],
+        'Unique':   "true",
+        'Method':   "hash",
+        }
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    assert executed_sql(mock_connection) == [ "create unique index concurrently example_idx on things using hash (a)" ]
+    assert response_holder["PhysicalResourceId"] == INDEX_NAME
+
+
+def test_create_already_valid(mock_connection, default_props, response_holder):
+    set_states(mock_connection, VALID)
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == []
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_create_drops_invalid_index(mock_connection, default_props, response_holder):
+    set_states(mock_connection, INVALID, None)
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [
+        f"drop index concurrently if exists {QUALIFIED_NAME}",
+        CREATE_SQL,
+        ]
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_create_waits_for_existing_build(mock_connection, default_props, response_holder):
+    set_states(mock_connection, BUILDING, BUILDING, VALID)
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == []
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_create_existing_build_past_deadline(mock_connection, default_props, response_holder):
+    util.seconds_remaining.return_value = index_handler.DEADLINE_MARGIN
+    set_states(mock_connection, BUILDING)
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == []
+    assert response_holder == {
+                              "Status": "IN_PROGRESS",
+                              "PhysicalResourceId": QUALIFIED_NAME,
+                              }
+
+
+def test_create_build_past_deadline(mock_connection, default_props, response_holder):
+    util.seconds_remaining.return_value = index_handler.DEADLINE_MARGIN + 0.05
+    release = threading.Event()
+    csr = mock_connection.cursor.return_value
+    def execute(sql, args=None):
+        if sql.startswith("create"):
+            release.wait(5)
+    csr.execute.side_effect = execute
+    try:
+        assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    finally:
+        release.set()
+    assert response_holder == {
+                              "Status": "IN_PROGRESS",
+                              "PhysicalResourceId": QUALIFIED_NAME,
+                              }
+
+
+def test_create_build_failure(mock_connection, default_props, response_holder):
+    csr = mock_connection.cursor.return_value
+    def execute(sql, args=None):
+        if sql.startswith("create"):
+            raise Exception("duplicate key")
+    csr.execute.side_effect = execute
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert response_holder == {
+                              "Status": "FAILED",
+                              "PhysicalResourceId": ANY,
+                              "Reason": ANY,
+                              }
+    assert "duplicate key" in response_holder["Reason"]
+    assert mock_connection.autocommit == False
+
+
+def test_update_new_name(mock_connection, default_props, response_holder):
+    old_props = dict(default_props, Name="old_idx")
+    assert index_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, "example.old_idx", default_props, old_props, response_holder)
+    assert executed_sql(mock_connection) == [ CREATE_SQL ]
+    assert response_holder["PhysicalResourceId"] == QUALIFIED_NAME
+
+
+def test_update_same_definition(mock_connection, default_props, response_holder):
+    set_states(mock_connection, VALID)
+    assert index_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, QUALIFIED_NAME, default_props, dict(default_props), response_holder)
+    assert executed_sql(mock_connection) == []
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_changed_definition_requires_new_name(mock_connection, default_props, response_holder):
+    old_props = dict(default_props, Columns=["a"])
+    assert index_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, QUALIFIED_NAME, default_props, old_props, response_holder)
+    assert executed_sql(mock_connection) == []
+    assert response_holder["Status"] == "FAILED"
+
+
+def test_delete(mock_connection, default_props, response_holder):
+    assert index_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, QUALIFIED_NAME, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [ f"drop index concurrently if exists {QUALIFIED_NAME}" ]
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": QUALIFIED_NAME,
+                              }
+
+
+def test_quoted_names(mock_connection, default_props, response_holder):
+    default_props['Name'] = "Things-Idx"
+    default_props['Table'] = 'App."Event Log"'
+    assert index_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [
+        'create index concurrently "Things-Idx" on app."Event Log" using btree (a, lower(b)) where c is not null' ]
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][1] == ('app."Things-Idx"',)
+    assert response_holder["PhysicalResourceId"] == "App.Things-Idx"
+    response_holder.clear()
+    mock_connection.cursor.return_value.execute.reset_mock()
+    assert index_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, "App.Things-Idx", default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [ 'drop index concurrently if exists app."Things-Idx"' ]
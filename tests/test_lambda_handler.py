@@ -1,6 +1,8 @@
 import copy
 import json
 import pytest
+import threading
+import time
 
 from unittest.mock import Mock, MagicMock, patch, sentinel, ANY
 
@@ -66,7 +68,7 @@ def send_response_mock():
 
 @pytest.fixture
 def patched_lambda(monkeypatch, open_connection_mock, send_response_mock):
-    monkeypatch.setattr(lambda_handler, 'open_connection', open_connection_mock)
+    monkeypatch.setattr(lambda_handler.util, 'open_connection', open_connection_mock)
     monkeypatch.setattr(lambda_handler, 'send_response', send_response_mock)
 
 
@@ -209,3 +211,364 @@ def test_user_resource(patched_lambda, event, open_connection_mock, send_respons
         "PhysicalResourceId": ANY,
     })
     assert "Unknown resource" not in send_response_mock.mock_calls[0][1][1]["Reason"]
+
+
+def test_database_resource(patched_lambda, event, open_connection_mock, send_response_mock):
+    event["ResourceProperties"]["Resource"] = "Database"
+    lambda_handler.handle(event, None)
+    send_response_mock.assert_called_once()
+    assert send_response_mock.mock_calls[0][1][1]["Status"] == "FAILED"
+    assert "Unknown resource" not in send_response_mock.mock_calls[0][1][1]["Reason"]
+
+
+# the following tests verify integration with the applied-state ledger; the
+# ledger itself is mocked
+
+@pytest.fixture
+def mock_ledger(monkeypatch):
+    mock = Mock()
+    mock.is_enabled.return_value = True
+    mock.find_processed_request.return_value = None
+    mock.find_applied_state.return_value = None
+    mock.fingerprint.side_effect = lambda props, salt: json.dumps(props, sort_keys=True)
+    mock.restore.side_effect = lambda applied_props, props, salt: applied_props
+    monkeypatch.setattr(lambda_handler, 'ledger', mock)
+    return mock
+
+
+def test_ledger_records_success(patched_lambda, mock_ledger, event, send_response_mock):
+    event["RequestType"] = "Create"
+    lambda_handler.handle(event, None)
+    assert test_handler.saved_request_type == "Create"
+    mock_ledger.ensure_tables.assert_called_once_with(sentinel.connection)
+    mock_ledger.record.assert_called_once_with(sentinel.connection, "Create", event["ResourceProperties"], ANY)
+    assert send_response_mock.mock_calls[0][1][1]["Status"] == "SUCCESS"
+
+
+def test_ledger_duplicate_request(patched_lambda, mock_ledger, event, send_response_mock):
+    test_handler.saved_request_type = None
+    mock_ledger.find_processed_request.return_value = Mock(physical_id="previous", data={ "Oid": "1234" })
+    event["RequestType"] = "Create"
+    lambda_handler.handle(event, None)
+    assert test_handler.saved_request_type == None
+    mock_ledger.find_processed_request.assert_called_once_with(sentinel.connection, EXPECTED_REQUEST_ID)
+    mock_ledger.record.assert_not_called()
+    send_response_mock.assert_called_once_with(
+        EXPECTED_RESPONSE_URL,
+        {
+            "Status": "SUCCESS",
+            "StackId": EXPECTED_STACK_ID,
+            "RequestId": EXPECTED_REQUEST_ID,
+            "LogicalResourceId": EXPECTED_LOGICAL_ID,
+            "PhysicalResourceId": "previous",
+            "Data": { "Oid": "1234" },
+        })
+
+
+def test_ledger_update_matches_applied_state(patched_lambda, mock_ledger, event, send_response_mock):
+    test_handler.saved_request_type = None
+    mock_ledger.find_applied_state.return_value = Mock(
+            physical_id=EXPECTED_PHYSICAL_ID,
+            fingerprint=json.dumps(event["ResourceProperties"], sort_keys=True),
+            props=event["ResourceProperties"],
+            data={ "Oid": "1234" })
+    event["RequestType"] = "Update"
+    event["PhysicalResourceId"] = EXPECTED_PHYSICAL_ID
+    event["OldResourceProperties"] = { "Argle": "Bargle" }
+    lambda_handler.handle(event, None)
+    assert test_handler.saved_request_type == None
+    mock_ledger.find_applied_state.assert_called_once_with(sentinel.connection, EXPECTED_STACK_ID, EXPECTED_LOGICAL_ID)
+    mock_ledger.record.assert_called_once()
+    assert send_response_mock.mock_calls[0][1][1]["Status"] == "SUCCESS"
+    assert send_response_mock.mock_calls[0][1][1]["PhysicalResourceId"] == EXPECTED_PHYSICAL_ID
+    assert send_response_mock.mock_calls[0][1][1]["Data"] == { "Oid": "1234" }
+
+
+def test_ledger_update_diffs_against_applied_state(patched_lambda, mock_ledger, event, send_response_mock):
+    applied_props = { "Argle": "Wargle" }
+    mock_ledger.find_applied_state.return_value = Mock(
+            physical_id=EXPECTED_PHYSICAL_ID,
+            fingerprint="something different",
+            props=applied_props)
+    event["RequestType"] = "Update"
+    event["PhysicalResourceId"] = EXPECTED_PHYSICAL_ID
+    event["OldResourceProperties"] = { "Argle": "Bargle" }
+    lambda_handler.handle(event, None)
+    assert test_handler.saved_request_type == "Update"
+    assert test_handler.saved_old_props == applied_props
+    mock_ledger.record.assert_called_once()
+
+
+# the following tests verify acknowledging deletes before performing them
+
+def test_early_delete_acknowledged_before_processing(patched_lambda, event, open_connection_mock, send_response_mock):
+    test_handler.saved_request_type = None
+    handler_state_at_response = []
+    send_response_mock.side_effect = lambda url, rsp: handler_state_at_response.append(test_handler.saved_request_type)
+    event["RequestType"] = "Delete"
+    event["PhysicalResourceId"] = EXPECTED_PHYSICAL_ID
+    event["ResourceProperties"]["AcknowledgeDeleteEarly"] = "true"
+    lambda_handler.handle(event, None)
+    assert handler_state_at_response == [None]
+    assert test_handler.saved_request_type == "Delete"
+    open_connection_mock.assert_called_once_with(EXPECTED_SECRET_ARN)
+    send_response_mock.assert_called_once_with(
+        EXPECTED_RESPONSE_URL,
+        {
+            "Status": "SUCCESS",
+            "StackId": EXPECTED_STACK_ID,
+            "RequestId": EXPECTED_REQUEST_ID,
+            "LogicalResourceId": EXPECTED_LOGICAL_ID,
+            "PhysicalResourceId": EXPECTED_PHYSICAL_ID,
+        })
+
+
+def test_early_delete_failure_recorded_as_metric(monkeypatch, patched_lambda, event, send_response_mock):
+    metric_mock = Mock()
+    monkeypatch.setattr(lambda_handler.util, 'emit_metric', metric_mock)
+    monkeypatch.setattr(lambda_handler, 'try_handlers', Mock(side_effect=Exception("I don't work!")))
+    event["RequestType"] = "Delete"
+    event["PhysicalResourceId"] = EXPECTED_PHYSICAL_ID
+    event["ResourceProperties"]["AcknowledgeDeleteEarly"] = "true"
+    lambda_handler.handle(event, None)
+    assert send_response_mock.call_count == 1
+    assert send_response_mock.mock_calls[0][1][1]["Status"] == "SUCCESS"
+    metric_mock.assert_called_once_with("AcknowledgedDeleteFailures", 1, { "Resource": EXPECTED_RESOURCE_TYPE })
+
+
+def test_early_delete_validates_resource_type(patched_lambda, event, open_connection_mock, send_response_mock):
+    event["RequestType"] = "Delete"
+    event["PhysicalResourceId"] = EXPECTED_PHYSICAL_ID
+    event["ResourceProperties"]["Resource"] = "Bogus"
+    event["ResourceProperties"]["AcknowledgeDeleteEarly"] = "true"
+    lambda_handler.handle(event, None)
+    open_connection_mock.assert_not_called()
+    send_response_mock.assert_called_once()
+    assert send_response_mock.mock_calls[0][1][1]["Status"] == "FAILED"
+    assert "Unknown resource" in send_response_mock.mock_calls[0][1][1]["Reason"]
+
+
+def test_early_acknowledgement_ignored_for_create(patched_lambda, event, send_response_mock):
+    test_handler.saved_request_type = None
+    handler_state_at_response = []
+    send_response_mock.side_effect = lambda url, rsp: handler_state_at_response.append(test_handler.saved_request_type)
+    event["RequestType"] = "Create"
+    event["ResourceProperties"]["AcknowledgeDeleteEarly"] = "true"
+    lambda_handler.handle(event, None)
+    assert handler_state_at_response == ["Create"]
+
+
+
+# the following tests verify fan-out across multiple databases
+
+@pytest.fixture
+def connect_mock(monkeypatch):
+    def connect(connection_info):
+        if connection_info["database"] == "broken":
+            raise Exception("unable to connect")
+        conn = MagicMock()
+        conn.__enter__ = Mock(return_value=connection_info["database"])
+        conn.__exit__ = Mock(return_value=False)
+        return conn
+    mock = Mock(side_effect=connect)
+    monkeypatch.setattr(lambda_handler.util, 'connect', mock)
+    monkeypatch.setattr(lambda_handler.util, 'retrieve_pg8000_secret', Mock(return_value={ "host": "example.com", "database": "postgres" }))
+    return mock
+
+
+def test_multiple_databases(patched_lambda, connect_mock, event, open_connection_mock, send_response_mock):
+    event["RequestType"] = "Create"
+    event["ResourceProperties"]["Databases"] = ["tenant1", "tenant2", "tenant3"]
+    lambda_handler.handle(event, None)
+    open_connection_mock.assert_not_called()
+    assert sorted(c[0][0]["database"] for c in connect_mock.call_args_list) == ["tenant1", "tenant2", "tenant3"]
+    assert all(c[0][0]["host"] == "example.com" for c in connect_mock.call_args_list)
+    send_response_mock.assert_called_once_with(
+        EXPECTED_RESPONSE_URL,
+        {
+            "Status": "SUCCESS",
+            "StackId": EXPECTED_STACK_ID,
+            "RequestId": EXPECTED_REQUEST_ID,
+            "LogicalResourceId": EXPECTED_LOGICAL_ID,
+            "PhysicalResourceId": EXPECTED_PHYSICAL_ID,
+        })
+
+
+def test_multiple_databases_with_failure(patched_lambda, connect_mock, event, send_response_mock):
+    event["RequestType"] = "Create"
+    event["ResourceProperties"]["Databases"] = ["tenant1", "broken", "tenant3"]
+    lambda_handler.handle(event, None)
+    assert connect_mock.call_count == 3
+    send_response_mock.assert_called_once()
+    response = send_response_mock.mock_calls[0][1][1]
+    assert response["Status"] == "FAILED"
+    assert response["PhysicalResourceId"] == EXPECTED_PHYSICAL_ID
+    assert "1 of 3" in response["Reason"]
+    assert "broken: unable to connect" in response["Reason"]
+    assert "tenant1" not in response["Reason"]
+
+
+@pytest.mark.parametrize("resource_type", ["User", "Database", "RoleMembership", "Bundle"])
+def test_multiple_databases_rejected_for_cluster_resources(patched_lambda, connect_mock, event, open_connection_mock, send_response_mock, resource_type):
+    event["RequestType"] = "Create"
+    event["ResourceProperties"]["Resource"] = resource_type
+    event["ResourceProperties"]["Databases"] = ["tenant1", "tenant2"]
+    lambda_handler.handle(event, None)
+    connect_mock.assert_not_called()
+    open_connection_mock.assert_not_called()
+    response = send_response_mock.mock_calls[0][1][1]
+    assert response["Status"] == "FAILED"
+    assert response["Reason"] == f"Databases can not be used with {resource_type} resources, which apply to the entire cluster"
+
+
+def test_multiple_databases_ignored_for_cluster_resource_delete(patched_lambda, connect_mock, event, open_connection_mock, send_response_mock):
+    event["RequestType"] = "Delete"
+    event["PhysicalResourceId"] = "argle"
+    event["ResourceProperties"]["Resource"] = "User"
+    event["ResourceProperties"]["Databases"] = ["tenant1", "tenant2"]
+    lambda_handler.handle(event, None)
+    connect_mock.assert_not_called()
+    open_connection_mock.assert_called_once_with(EXPECTED_SECRET_ARN)
+
+
+def test_run_concurrently_bounds_threads():
+    lock = threading.Lock()
+    active = [0, 0]
+    def fn(x):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        if x == 3:
+            raise ValueError("three")
+        return x * 2
+    results = lambda_handler.util.run_concurrently(fn, list(range(10)), 3)
+    assert active[1] <= 3
+    assert results[:3] == [0, 2, 4]
+    assert isinstance(results[3], ValueError)
+    assert results[4:] == [8, 10, 12, 14, 16, 18]
+
+
+# the following tests verify prewarming
+
+def test_prewarm(monkeypatch):
+    client_mock = Mock()
+    retrieve_mock = Mock()
+    monkeypatch.setattr(lambda_handler.util, 'aws_client', client_mock)
+    monkeypatch.setattr(lambda_handler.util, 'retrieve_pg8000_secret', retrieve_mock)
+    lambda_handler.prewarm()
+    retrieve_mock.assert_not_called()
+    monkeypatch.setenv("CF_POSTGRES_PREWARM_SECRET_ARN", EXPECTED_SECRET_ARN)
+    lambda_handler.prewarm()
+    client_mock.assert_called_once_with('secretsmanager')
+    retrieve_mock.assert_called_once_with(EXPECTED_SECRET_ARN)
+    # failures must not prevent the module from loading
+    retrieve_mock.side_effect = Exception("no network")
+    lambda_handler.prewarm()
+
+
+# the following tests verify warm-up events
+
+@pytest.mark.parametrize("warm_up_event", [
+    { "WarmUp": True, "AdminSecretArn": EXPECTED_SECRET_ARN },
+    { "WarmUp": "true", "AdminSecretArn": EXPECTED_SECRET_ARN },
+    { "source": "aws.events", "detail-type": "Scheduled Event", "detail": {} },
+    ])
+def test_warm_up(monkeypatch, patched_lambda, mock_connection, open_connection_mock, send_response_mock, warm_up_event):
+    monkeypatch.setenv("CF_POSTGRES_PREWARM_SECRET_ARN", EXPECTED_SECRET_ARN)
+    mock_connection.__enter__.return_value = Mock()
+    invalidate_mock = Mock()
+    monkeypatch.setattr(lambda_handler.util, 'aws_client', Mock())
+    monkeypatch.setattr(lambda_handler.util, 'invalidate_cached_secret', invalidate_mock)
+    result = lambda_handler.handle(warm_up_event, None)
+    assert result == { "Status": "SUCCESS", "ElapsedMillis": ANY }
+    invalidate_mock.assert_called_once_with(EXPECTED_SECRET_ARN)
+    open_connection_mock.assert_called_once_with(EXPECTED_SECRET_ARN)
+    mock_connection.__enter__.return_value.cursor.return_value.execute.assert_called_once_with("select 1")
+    send_response_mock.assert_not_called()
+
+
+def test_warm_up_without_secret(monkeypatch, patched_lambda, open_connection_mock, send_response_mock):
+    monkeypatch.setattr(lambda_handler.util, 'aws_client', Mock())
+    result = lambda_handler.handle({ "WarmUp": True }, None)
+    assert result["Status"] == "SUCCESS"
+    open_connection_mock.assert_not_called()
+    send_response_mock.assert_not_called()
+
+
+def test_warm_up_failure(monkeypatch, patched_lambda, open_connection_mock, send_response_mock):
+    monkeypatch.setattr(lambda_handler.util, 'aws_client', Mock())
+    monkeypatch.setattr(lambda_handler.util, 'invalidate_cached_secret', Mock())
+    open_connection_mock.side_effect = Exception("connection refused")
+    result = lambda_handler.handle({ "WarmUp": True, "AdminSecretArn": EXPECTED_SECRET_ARN }, None)
+    assert result == { "Status": "FAILED", "Reason": "connection refused", "ElapsedMillis": ANY }
+    send_response_mock.assert_not_called()
+
+
+# the following tests verify resumption of handlers that run out of time
+
+@pytest.fixture
+def in_progress_handler(monkeypatch):
+    def run_handlers(conn, request_type, resource_type, physical_id, props, old_props, response):
+        lambda_handler.util.report_in_progress(response, EXPECTED_PHYSICAL_ID)
+    monkeypatch.setattr(lambda_handler, 'run_handlers', run_handlers)
+
+
+@pytest.fixture
+def lambda_context(monkeypatch):
+    # the deadline is module state; this ensures that it's reset after the test
+    monkeypatch.setattr(lambda_handler.util, '_deadline', None)
+    context = Mock()
+    context.invoked_function_arn = EXPECTED_SERVICE_TOKEN
+    context.get_remaining_time_in_millis.return_value = 900000
+    return context
+
+
+def test_in_progress_reinvokes(monkeypatch, patched_lambda, in_progress_handler, lambda_context, event, send_response_mock):
+    client_mock = Mock()
+    monkeypatch.setattr(lambda_handler.util, 'aws_client', Mock(return_value=client_mock))
+    event["RequestType"] = "Create"
+    lambda_handler.handle(event, lambda_context)
+    assert 899 < lambda_handler.util.seconds_remaining() <= 900
+    send_response_mock.assert_not_called()
+    client_mock.invoke.assert_called_once_with(FunctionName=EXPECTED_SERVICE_TOKEN, InvocationType="Event", Payload=ANY)
+    payload = json.loads(client_mock.invoke.call_args[1]["Payload"])
+    assert payload == dict(event, Reinvocation=1)
+
+
+def test_in_progress_gives_up_after_limit(monkeypatch, patched_lambda, in_progress_handler, lambda_context, event, send_response_mock):
+    client_mock = Mock()
+    monkeypatch.setattr(lambda_handler.util, 'aws_client', Mock(return_value=client_mock))
+    event["RequestType"] = "Create"
+    event["Reinvocation"] = lambda_handler.MAX_REINVOCATIONS
+    lambda_handler.handle(event, lambda_context)
+    client_mock.invoke.assert_not_called()
+    send_response_mock.assert_called_once_with(EXPECTED_RESPONSE_URL, {
+        "Status": "FAILED",
+        "Reason": ANY,
+        "StackId": EXPECTED_STACK_ID,
+        "RequestId": EXPECTED_REQUEST_ID,
+        "LogicalResourceId": EXPECTED_LOGICAL_ID,
+        "PhysicalResourceId": ANY,
+        })
+
+
+def test_multiple_databases_in_progress(monkeypatch, patched_lambda, connect_mock, lambda_context, event, send_response_mock):
+    # one database is still building; the request must be resumed rather than failed
+    def run_handlers(conn, request_type, resource_type, physical_id, props, old_props, response):
+        if conn == "tenant2":
+            lambda_handler.util.report_in_progress(response, EXPECTED_PHYSICAL_ID)
+        else:
+            lambda_handler.util.report_success(response, EXPECTED_PHYSICAL_ID)
+    monkeypatch.setattr(lambda_handler, 'run_handlers', run_handlers)
+    client_mock = Mock()
+    monkeypatch.setattr(lambda_handler.util, 'aws_client', Mock(return_value=client_mock))
+    event["RequestType"] = "Create"
+    event["ResourceProperties"]["Databases"] = ["tenant1", "tenant2"]
+    response = lambda_handler.process_event(event, lambda_context)
+    assert response["Status"] == "IN_PROGRESS"
+    assert response["PhysicalResourceId"] == EXPECTED_PHYSICAL_ID
+    send_response_mock.assert_not_called()
+    client_mock.invoke.assert_called_once()
@@ -0,0 +1,199 @@
+""" Unit tests for the applied-state ledger. These verify the transformations of
+    properties, and that the database functions pass the correct values; actual
+    SQL is exercised by the integration tests.
+    """
+
+import json
+import pytest
+from unittest.mock import Mock, ANY
+
+from cf_postgres import ledger
+
+
+################################################################################
+# values that will be asserted
+################################################################################
+
+LEDGER_SCHEMA   = "cf_postgres_ledger"
+REQUEST_ID      = "602e48af-49ab-4c5b-b856-95a2e84b66c9"
+STACK_ID        = "arn:aws:cloudformation:us-east-1:123456789012:stack/CF-Postgres-Example-4/388d1040-18a6-11ed-8d5d-0e8fec9940a1"
+LOGICAL_ID      = "User"
+PHYSICAL_ID     = "tester"
+PASSWORD        = "tester-123"
+SALT            = ledger.resource_salt(STACK_ID, LOGICAL_ID)
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setenv(ledger.ENV_LEDGER_SCHEMA, LEDGER_SCHEMA)
+
+
+@pytest.fixture
+def mock_connection():
+    return Mock()
+
+
+@pytest.fixture
+def props():
+    return {
+        "ServiceToken":     "arn:aws:lambda:us-east-1:123456789012:function:cf_postgres",
+        "Resource":         "User",
+        "Username":         PHYSICAL_ID,
+        "Password":         PASSWORD,
+        }
+
+
+@pytest.fixture
+def response():
+    return {
+        "RequestId":            REQUEST_ID,
+        "StackId":              STACK_ID,
+        "LogicalResourceId":    LOGICAL_ID,
+        "PhysicalResourceId":   PHYSICAL_ID,
+        "Status":               "SUCCESS",
+        }
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_enabled_by_environment(monkeypatch):
+    monkeypatch.delenv(ledger.ENV_LEDGER_SCHEMA, raising=False)
+    assert not ledger.is_enabled()
+    monkeypatch.setenv(ledger.ENV_LEDGER_SCHEMA, LEDGER_SCHEMA)
+    assert ledger.is_enabled()
+    assert ledger.schema_name() == LEDGER_SCHEMA
+
+
+def test_fingerprint_ignores_service_token_and_order(props):
+    reordered = dict(reversed(list(props.items())))
+    reordered["ServiceToken"] = "something_else"
+    assert ledger.fingerprint(props, SALT) == ledger.fingerprint(reordered, SALT)
+    props["Password"] = "changed"
+    assert ledger.fingerprint(props, SALT) != ledger.fingerprint(reordered, SALT)
+
+
+def test_redact_and_restore(props):
+    redacted = ledger.redact(props, SALT)
+    assert "ServiceToken" not in redacted
+    assert redacted["Username"] == PHYSICAL_ID
+    assert redacted["Password"] != PASSWORD
+    assert PASSWORD not in json.dumps(redacted)
+    # same password: restored to plaintext so that it compares as unchanged
+    assert ledger.restore(redacted, props, SALT)["Password"] == PASSWORD
+    # different password: left as hash so that it compares as changed
+    props["Password"] = "changed"
+    assert ledger.restore(redacted, props, SALT)["Password"] == redacted["Password"]
+
+
+def test_redacted_values_are_salted_by_resource(props):
+    redacted = ledger.redact(props, SALT)
+    other = ledger.redact(props, ledger.resource_salt(STACK_ID, "OtherUser"))
+    assert redacted["Password"] != other["Password"]
+    assert ledger.restore(other, props, SALT)["Password"] == other["Password"]
+    assert ledger.fingerprint(props, SALT) != ledger.fingerprint(props, ledger.resource_salt(STACK_ID, "OtherUser"))
+
+
+def test_ensure_tables_only_creates(enabled, mock_connection):
+    csr = mock_connection.cursor.return_value
+    ledger.ensure_tables(mock_connection)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    assert all(" if not exists " in sql for sql in executed)
+    assert not any("alter table" in sql for sql in executed)
+    mock_connection.commit.assert_called_once()
+
+def test_find_processed_request(enabled, mock_connection):
+    csr = mock_connection.cursor.return_value
+    csr.fetchone.return_value = (PHYSICAL_ID, '{"Oid": "1234"}')
+    assert ledger.find_processed_request(mock_connection, REQUEST_ID) == (PHYSICAL_ID, { "Oid": "1234" })
+    csr.execute.assert_called_once_with(ANY, (REQUEST_ID,))
+    assert LEDGER_SCHEMA in csr.execute.call_args[0][0]
+    csr.fetchone.return_value = None
+    assert ledger.find_processed_request(mock_connection, REQUEST_ID) == None
+
+
+def test_find_applied_state(enabled, mock_connection, props):
+    csr = mock_connection.cursor.return_value
+    csr.fetchone.return_value = (PHYSICAL_ID, "abc", json.dumps(ledger.redact(props, SALT)), '{"Oid": "1234"}')
+    applied = ledger.find_applied_state(mock_connection, STACK_ID, LOGICAL_ID)
+    csr.execute.assert_called_once_with(ANY, (STACK_ID, LOGICAL_ID))
+    assert applied.physical_id == PHYSICAL_ID
+    assert applied.fingerprint == "abc"
+    assert applied.props == ledger.redact(props, SALT)
+    assert applied.data == { "Oid": "1234" }
+
+
+def test_record_update(enabled, mock_connection, props, response):
+    csr = mock_connection.cursor.return_value
+    ledger.record(mock_connection, "Update", props, response)
+    assert csr.execute.call_count == 2
+    assert csr.execute.call_args_list[0][0][1] == (REQUEST_ID, STACK_ID, LOGICAL_ID, "Update", PHYSICAL_ID, None)
+    assert csr.execute.call_args_list[1][0][1] == (STACK_ID, LOGICAL_ID, PHYSICAL_ID, ledger.fingerprint(props, SALT), json.dumps(ledger.redact(props, SALT)), None)
+    mock_connection.commit.assert_called_once()
+
+
+def test_record_stores_data_with_request(enabled, mock_connection, props, response):
+    csr = mock_connection.cursor.return_value
+    response["Data"] = { "Oid": "1234" }
+    ledger.record(mock_connection, "Create", props, response)
+    assert csr.execute.call_args_list[0][0][1] == (REQUEST_ID, STACK_ID, LOGICAL_ID, "Create", PHYSICAL_ID, '{"Oid": "1234"}')
+    assert csr.execute.call_args_list[1][0][1][5] == '{"Oid": "1234"}'
+
+def test_record_delete(enabled, mock_connection, props, response):
+    csr = mock_connection.cursor.return_value
+    ledger.record(mock_connection, "Delete", props, response)
+    assert csr.execute.call_count == 2
+    assert "delete from" in csr.execute.call_args_list[1][0][0]
+    assert csr.execute.call_args_list[1][0][1] == (STACK_ID, LOGICAL_ID, PHYSICAL_ID)
+    mock_connection.commit.assert_called_once()
+
+
+def test_record_delete_after_replacement(enabled, mock_connection, props, response):
+    # the replacement is recorded first, then CloudFormation deletes the old resource
+    csr = mock_connection.cursor.return_value
+    replacement = dict(response, RequestId="replacement-request", PhysicalResourceId="replacement")
+    ledger.record(mock_connection, "Update", props, replacement)
+    ledger.record(mock_connection, "Delete", props, response)
+    (stmt, args) = csr.execute.call_args_list[3][0]
+    assert "physical_id = %s" in stmt
+    assert args == (STACK_ID, LOGICAL_ID, PHYSICAL_ID)
+
+
+def test_record_bundle(enabled, mock_connection, response):
+    props = {
+        "Resource":     "Bundle",
+        "Resources":    [
+                        { "Resource": "Schema", "Name": "example", "Users": ["argle", "bargle"] },
+                        { "Resource": "User", "Username": "argle", "Password": PASSWORD },
+                        { "Resource": "User", "Username": "bargle", "Password": "bargle-456" },
+                        ],
+        }
+    csr = mock_connection.cursor.return_value
+    ledger.record(mock_connection, "Create", props, response)
+    stored = csr.execute.call_args_list[1][0][1][4]
+    assert PASSWORD not in stored
+    assert "bargle-456" not in stored
+    redacted = json.loads(stored)
+    assert redacted["Resources"][0] == props["Resources"][0]
+    assert redacted["Resources"][1]["Username"] == "argle"
+    # unchanged passwords are restored, changed passwords are left as hashes
+    props["Resources"][2]["Password"] = "changed"
+    restored = ledger.restore(redacted, props, SALT)
+    assert restored["Resources"][1]["Password"] == PASSWORD
+    assert restored["Resources"][2]["Password"] == redacted["Resources"][2]["Password"]
+    assert ledger.fingerprint(props, SALT) != csr.execute.call_args_list[1][0][1][3]
+
+
+def test_quoted_schema_name(monkeypatch, mock_connection, props, response):
+    monkeypatch.setenv(ledger.ENV_LEDGER_SCHEMA, "CF-Ledger")
+    csr = mock_connection.cursor.return_value
+    ledger.ensure_tables(mock_connection)
+    ledger.record(mock_connection, "Update", props, response)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    assert executed[0] == 'create schema if not exists "CF-Ledger"'
+    assert all('"CF-Ledger".' in sql for sql in executed[1:])
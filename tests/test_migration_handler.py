@@ -0,0 +1,175 @@
+""" Unit tests for the Migration sub-resource. These tests verify the handler's
+    flow and script parsing; the integration tests verify that scripts are
+    actually applied.
+    """
+
+import hashlib
+import pytest
+from unittest.mock import Mock, ANY
+
+from cf_postgres.handlers import migration_handler
+
+
+################################################################################
+# properties from the default event
+################################################################################
+
+RESOURCE_TYPE       = "Migration"
+MIGRATION_NAME      = "example"
+
+SCRIPT_1            = "create table example ( id int primary key );\ninsert into example values (1);\n"
+SCRIPT_2            = "create index concurrently example_idx on example (id)"
+
+
+def checksum(sql):
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def mock_connection():
+    conn = Mock()
+    conn.cursor.return_value.fetchall.return_value = []
+    return conn
+
+
+@pytest.fixture
+def default_props():
+    return {
+        'Name':             MIGRATION_NAME,
+        'Scripts':          [
+                            { "Version": "001", "Sql": SCRIPT_1 },
+                            { "Version": "002", "Sql": SCRIPT_2, "Transactional": "false" },
+                            ],
+        }
+
+
+@pytest.fixture
+def response_holder():
+    return {}
+
+
+def executed_sql(conn):
+    return [c[0][0].strip() for c in conn.cursor.return_value.execute.call_args_list]
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_split_statements():
+    script = """
+             create table a (x text default 'semi;colon', "we;ird" int);
+             -- comment; with semicolon
+             insert into a values (E'it\\'s; fine', 1);
+             /* block /* nested; */ still; */ select 1;
+             create function f() returns int as $body$ select 1; $body$ language sql;
+             prepare p as select $1::int;
+             trailing statement
+             """
+    expected = list(migration_handler._split_statements([script]))
+    assert len(expected) == 6
+    assert expected[0] == """create table a (x text default 'semi;colon', "we;ird" int)"""
+    assert expected[3] == "create function f() returns int as $body$ select 1; $body$ language sql"
+    assert expected[5] == "trailing statement"
+    # results must not depend on how the script is broken into chunks
+    for size in range(1, 20):
+        chunks = [script[i:i+size] for i in range(0, len(script), size)]
+        assert list(migration_handler._split_statements(chunks)) == expected
+
+
+def test_apply_all_scripts(mock_connection, default_props, response_holder):
+    assert migration_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    executed = executed_sql(mock_connection)
+    assert executed[3:] == [
+        "create table example ( id int primary key )",
+        "insert into example values (1)",
+        "insert into cf_postgres.migrations (migration_name, version, checksum, elapsed_ms) values (%s, %s, %s, %s)",
+        "create index concurrently example_idx on example (id)",
+        "insert into cf_postgres.migrations (migration_name, version, checksum, elapsed_ms) values (%s, %s, %s, %s)",
+        ]
+    inserts = [c[0][1] for c in mock_connection.cursor.return_value.execute.call_args_list if len(c[0]) > 1 and "insert" in c[0][0]]
+    assert inserts == [
+        (MIGRATION_NAME, "001", checksum(SCRIPT_1), ANY),
+        (MIGRATION_NAME, "002", checksum(SCRIPT_2), ANY),
+        ]
+    assert mock_connection.autocommit == False
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": MIGRATION_NAME,
+                              "Data": { "Version": "002", "AppliedCount": "2" },
+                              }
+
+
+def test_skips_applied_scripts(mock_connection, default_props, response_holder):
+    mock_connection.cursor.return_value.fetchall.return_value = [("001", checksum(SCRIPT_1))]
+    default_props['TrackingSchema'] = "tracking"
+    assert migration_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, MIGRATION_NAME, default_props, {}, response_holder)
+    executed = executed_sql(mock_connection)
+    assert executed[0] == "create schema if not exists tracking"
+    assert executed[3:] == [
+        "create index concurrently example_idx on example (id)",
+        "insert into tracking.migrations (migration_name, version, checksum, elapsed_ms) values (%s, %s, %s, %s)",
+        ]
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_fails_if_applied_script_changed(mock_connection, default_props, response_holder):
+    mock_connection.cursor.return_value.fetchall.return_value = [("001", checksum("something else"))]
+    assert migration_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, MIGRATION_NAME, default_props, {}, response_holder)
+    assert len(executed_sql(mock_connection)) == 3
+    assert response_holder == {
+                              "Status": "FAILED",
+                              "PhysicalResourceId": MIGRATION_NAME,
+                              "Reason": ANY
+                              }
+    assert "001" in response_holder["Reason"]
+
+
+def test_apply_from_file(monkeypatch, tmp_path, mock_connection, response_holder):
+    monkeypatch.setenv("CF_POSTGRES_MIGRATIONS_DIR", str(tmp_path))
+    monkeypatch.setattr(migration_handler, "READ_CHUNK_SIZE", 7)
+    (tmp_path / "001.sql").write_text(SCRIPT_1)
+    props = {
+        'Name':     MIGRATION_NAME,
+        'Scripts':  [ { "Version": "001", "File": "001.sql" } ],
+        }
+    assert migration_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    executed = executed_sql(mock_connection)
+    assert executed[3:5] == [
+        "create table example ( id int primary key )",
+        "insert into example values (1)",
+        ]
+    assert mock_connection.cursor.return_value.execute.call_args_list[-1][0][1] == (MIGRATION_NAME, "001", checksum(SCRIPT_1), ANY)
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_file_outside_migrations_directory(monkeypatch, tmp_path, mock_connection, response_holder):
+    monkeypatch.setenv("CF_POSTGRES_MIGRATIONS_DIR", str(tmp_path))
+    props = {
+        'Name':     MIGRATION_NAME,
+        'Scripts':  [ { "Version": "001", "File": "../passwd" } ],
+        }
+    assert migration_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    assert response_holder["Status"] == "FAILED"
+
+
+def test_delete_does_not_touch_database(mock_connection, default_props, response_holder):
+    assert migration_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, MIGRATION_NAME, default_props, {}, response_holder)
+    mock_connection.cursor.assert_not_called()
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": MIGRATION_NAME,
+                              }
+
+
+def test_quoted_tracking_schema(mock_connection, default_props, response_holder):
+    mock_connection.cursor.return_value.fetchall.return_value = [("001", checksum(SCRIPT_1))]
+    default_props['TrackingSchema'] = "Schema-Migrations"
+    assert migration_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, MIGRATION_NAME, default_props, {}, response_holder)
+    executed = executed_sql(mock_connection)
+    assert executed[0] == 'create schema if not exists "Schema-Migrations"'
+    assert executed[-1] == 'insert into "Schema-Migrations".migrations (migration_name, version, checksum, elapsed_ms) values (%s, %s, %s, %s)'
@@ -0,0 +1,182 @@
+""" Unit tests for the Partitions sub-resource. These verify the SQL that the handler
+    generates for a given set of existing partitions and date.
+    """
+
+import datetime
+import pytest
+
+from unittest.mock import Mock, ANY
+
+from cf_postgres.handlers import partitions_handler
+
+
+################################################################################
+# properties from the default event
+################################################################################
+
+RESOURCE_TYPE       = "Partitions"
+TABLE_NAME          = "app.events"
+TODAY               = datetime.date(2024, 3, 6)     # a Wednesday
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def mock_connection():
+    conn = Mock()
+    conn.cursor.return_value.fetchall.return_value = []
+    return conn
+
+
+@pytest.fixture
+def default_props():
+    return {
+        'Table':        TABLE_NAME,
+        'Interval':     "day",
+        'Lookahead':    "2",
+        }
+
+
+@pytest.fixture
+def response_holder():
+    return {}
+
+
+@pytest.fixture(autouse=True)
+def today(monkeypatch):
+    monkeypatch.setattr(partitions_handler, '_today', lambda: TODAY)
+
+
+def set_existing(conn, *names):
+    conn.cursor.return_value.fetchall.return_value = [(name,) for name in names]
+
+
+def executed_sql(conn):
+    return [c[0][0] for c in conn.cursor.return_value.execute.call_args_list
+            if not c[0][0].strip().startswith(("select", "set"))]
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create(mock_connection, default_props, response_holder):
+    assert partitions_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][1] == (TABLE_NAME,)
+    assert executed_sql(mock_connection) == [
+        "create table if not exists app.events_20240306 partition of app.events for values from ('2024-03-06') to ('2024-03-07')",
+        "create table if not exists app.events_20240307 partition of app.events for values from ('2024-03-07') to ('2024-03-08')",
+        "create table if not exists app.events_20240308 partition of app.events for values from ('2024-03-08') to ('2024-03-09')",
+        ]
+    mock_connection.commit.assert_called_once()
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": TABLE_NAME,
+                              "Data": {
+                                  "Count":  "3",
+                                  "Oldest": "app.events_20240306",
+                                  "Newest": "app.events_20240308",
+                                  },
+                              }
+
+
+def test_update_with_retention(mock_connection, default_props, response_holder):
+    default_props['Retention'] = "2"
+    set_existing(mock_connection, "events_20240302", "events_20240303", "events_20240304", "events_20240305",
+                                  "events_20240306", "events_default", "events_old")
+    assert partitions_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, TABLE_NAME, default_props, dict(default_props), response_holder)
+    assert executed_sql(mock_connection) == [
+        "create table if not exists app.events_20240307 partition of app.events for values from ('2024-03-07') to ('2024-03-08')",
+        "create table if not exists app.events_20240308 partition of app.events for values from ('2024-03-08') to ('2024-03-09')",
+        "alter table app.events detach partition app.events_20240302",
+        "alter table app.events detach partition app.events_20240303",
+        ]
+    mock_connection.commit.assert_called_once()
+    assert response_holder["Data"] == {
+                                      "Count":  "5",
+                                      "Oldest": "app.events_20240304",
+                                      "Newest": "app.events_20240308",
+                                      }
+
+
+def test_drop_expired(mock_connection, default_props, response_holder):
+    default_props['Retention'] = "0"
+    default_props['ExpireAction'] = "Drop"
+    set_existing(mock_connection, "events_20240305", "events_20240306", "events_20240307", "events_20240308")
+    assert partitions_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, TABLE_NAME, default_props, dict(default_props), response_holder)
+    assert executed_sql(mock_connection) == [ "drop table app.events_20240305" ]
+
+
+@pytest.mark.parametrize("interval,expected", [
+    ("week",    [("20240304", "2024-03-04", "2024-03-11"), ("20240311", "2024-03-11", "2024-03-18")]),
+    ("month",   [("202403",   "2024-03-01", "2024-04-01"), ("202404",   "2024-04-01", "2024-05-01")]),
+    ("year",    [("2024",     "2024-01-01", "2025-01-01"), ("2025",     "2025-01-01", "2026-01-01")]),
+    ])
+def test_intervals(mock_connection, default_props, response_holder, interval, expected):
+    default_props['Interval'] = interval
+    default_props['Lookahead'] = "1"
+    assert partitions_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [
+        f"create table if not exists app.events_{suffix} partition of app.events for values from ('{lower}') to ('{upper}')"
+        for (suffix, lower, upper) in expected
+        ]
+
+
+def test_month_retention_crosses_year(mock_connection, default_props, response_holder):
+    default_props['Interval'] = "month"
+    default_props['Lookahead'] = "0"
+    default_props['Retention'] = "3"
+    set_existing(mock_connection, "events_202311", "events_202312", "events_202401", "events_202403")
+    assert partitions_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, TABLE_NAME, default_props, dict(default_props), response_holder)
+    assert executed_sql(mock_connection) == [ "alter table app.events detach partition app.events_202311" ]
+
+
+def test_invalid_interval(mock_connection, default_props, response_holder):
+    default_props['Interval'] = "fortnight"
+    assert partitions_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert response_holder["Status"] == "FAILED"
+    mock_connection.commit.assert_not_called()
+
+
+def test_interval_change_not_allowed(mock_connection, default_props, response_holder):
+    old_props = dict(default_props, Interval="month")
+    assert partitions_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, TABLE_NAME, default_props, old_props, response_holder)
+    assert response_holder["Status"] == "FAILED"
+    assert executed_sql(mock_connection) == []
+
+
+def test_delete(mock_connection, default_props, response_holder):
+    assert partitions_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, TABLE_NAME, default_props, {}, response_holder)
+    mock_connection.cursor.return_value.execute.assert_not_called()
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": TABLE_NAME,
+                              }
+
+
+def test_exception(mock_connection, default_props, response_holder):
+    mock_connection.cursor.return_value.execute.side_effect = Exception("I don't work!")
+    assert partitions_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    mock_connection.rollback.assert_called_once()
+    assert response_holder == {
+                              "Status": "FAILED",
+                              "PhysicalResourceId": ANY,
+                              "Reason": ANY
+                              }
+
+
+def test_quoted_table_name(mock_connection, default_props, response_holder):
+    default_props['Table'] = 'App."Event-Log"'
+    default_props['Retention'] = "1"
+    set_existing(mock_connection, "Event-Log_20240304", "Event-Log_20240305")
+    assert partitions_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, default_props['Table'], default_props, dict(default_props), response_holder)
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][1] == ('app."Event-Log"',)
+    assert executed_sql(mock_connection) == [
+        'create table if not exists app."Event-Log_20240306" partition of app."Event-Log" for values from (\'2024-03-06\') to (\'2024-03-07\')',
+        'create table if not exists app."Event-Log_20240307" partition of app."Event-Log" for values from (\'2024-03-07\') to (\'2024-03-08\')',
+        'create table if not exists app."Event-Log_20240308" partition of app."Event-Log" for values from (\'2024-03-08\') to (\'2024-03-09\')',
+        'alter table app."Event-Log" detach partition app."Event-Log_20240304"',
+        ]
+    assert response_holder["Data"]["Oldest"] == 'app."Event-Log_20240305"'
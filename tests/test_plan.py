@@ -0,0 +1,183 @@
+""" Unit tests for plan mode. These run real handlers against a recording connection,
+    so verify the SQL that each would execute.
+    """
+
+import json
+import pytest
+from unittest.mock import Mock, ANY
+
+from cf_postgres import lambda_handler, plan, util
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def event():
+    return {
+        "RequestType":          "Create",
+        "ResourceProperties": {
+            "Resource":         "User",
+            "AdminSecretArn":   "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-admin-5z4FyE",
+            "Username":         "argle",
+            "Password":         "bargle",
+        }
+      }
+
+
+@pytest.fixture
+def no_external_calls(monkeypatch):
+    # plan mode must not touch Secrets Manager, the database, or the response URL
+    monkeypatch.setattr(util.boto3, 'client', Mock(side_effect=Exception("called Secrets Manager")))
+    monkeypatch.setattr(lambda_handler.util, 'open_connection', Mock(side_effect=Exception("connected to database")))
+    monkeypatch.setattr(lambda_handler, 'send_response', Mock(side_effect=Exception("sent response")))
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_plan_create_user(no_external_calls, event):
+    result = lambda_handler.plan(event)
+    assert result == {
+                     "Status": "SUCCESS",
+                     "PhysicalResourceId": "argle",
+                     "Statements": [
+                        "create user argle password '********' NOCREATEDB NOCREATEROLE",
+                        ANY,
+                        "commit",
+                        ],
+                     }
+
+
+def test_plan_uses_placeholder_secret(no_external_calls, event):
+    del event["ResourceProperties"]["Username"]
+    del event["ResourceProperties"]["Password"]
+    event["ResourceProperties"]["UserSecretArn"] = "user-secret"
+    result = lambda_handler.plan(event)
+    assert result["Statements"][0] == "create user \"<user-secret:username>\" password '********' NOCREATEDB NOCREATEROLE"
+
+
+def test_plan_update_without_changes(no_external_calls, event):
+    event["RequestType"] = "Update"
+    event["PhysicalResourceId"] = "argle"
+    event["OldResourceProperties"] = dict(event["ResourceProperties"])
+    result = lambda_handler.plan(event)
+    assert result["Status"] == "SUCCESS"
+    # the only query retrieves the user's attributes
+    assert len(result["Statements"]) == 2
+    assert result["Statements"][0].startswith("select")
+    assert result["Statements"][0].endswith("-- parameters: 'argle'")
+    assert result["Statements"][1] == "commit"
+
+
+def test_plan_schema_with_parameters(no_external_calls):
+    event = {
+        "RequestType":          "Create",
+        "ResourceProperties": {
+            "Resource":         "Schema",
+            "Name":             "example",
+            "Owner":            "argle",
+            "Users":            ["bargle"],
+            "GrantExisting":    "true",
+        }
+      }
+    result = lambda_handler.plan(event)
+    assert result["Status"] == "SUCCESS"
+    assert result["Statements"][0] == "create schema if not exists example authorization argle"
+    assert "-- parameters: 'example'" in "\n".join(result["Statements"])
+    assert result["Statements"][-1] == "commit"
+
+
+def test_plan_schema_from_template(no_external_calls, tmp_path, capsys):
+    event = {
+        "RequestType":          "Create",
+        "ResourceProperties": {
+            "Resource":         "Schema",
+            "Name":             "tenant_1",
+            "Template":         "tenant_template",
+        }
+      }
+    result = lambda_handler.plan(event)
+    assert result["Status"] == "SUCCESS"
+    statements = result["Statements"]
+    assert "set local search_path to tenant_template" in statements
+    assert "-- statements generated from template schema tenant_template" in statements
+    assert statements.index("set local search_path to tenant_1") > statements.index("set local search_path to tenant_template")
+    event_file = tmp_path / "event.json"
+    event_file.write_text(json.dumps(event))
+    assert plan.main([str(event_file)]) == 0
+    assert "\n-- statements generated from template schema tenant_template\n" in capsys.readouterr().out
+
+def test_plan_multiple_databases(no_external_calls):
+    event = {
+        "RequestType":          "Create",
+        "ResourceProperties": {
+            "Resource":         "Schema",
+            "Name":             "example",
+            "Databases":        ["tenant1", "tenant2"],
+        }
+      }
+    result = lambda_handler.plan(event)
+    assert result["Status"] == "SUCCESS"
+    assert result["Statements"] == [
+        "\\connect tenant1",
+        "create schema if not exists example",
+        ANY,
+        "commit",
+        "\\connect tenant2",
+        "create schema if not exists example",
+        ANY,
+        "commit",
+        ]
+
+
+def test_plan_multiple_databases_for_cluster_resource(no_external_calls, event):
+    event["ResourceProperties"]["Databases"] = ["tenant1", "tenant2"]
+    result = lambda_handler.plan(event)
+    assert result["Status"] == "FAILED"
+    assert result["Reason"] == "Databases can not be used with User resources, which apply to the entire cluster"
+    assert result["Statements"] == []
+
+
+def test_plan_failure(no_external_calls, event):
+    event["RequestType"] = "Update"
+    event["PhysicalResourceId"] = "someone_else"
+    result = lambda_handler.plan(event)
+    assert result["Status"] == "FAILED"
+    assert result["Reason"] == "Can not update username"
+    assert result["Statements"] == []
+
+
+def test_plan_via_handle(no_external_calls, event):
+    event["Plan"] = True
+    result = lambda_handler.handle(event, None)
+    assert result["Status"] == "SUCCESS"
+    assert len(result["Statements"]) == 3
+
+
+def test_cli(no_external_calls, tmp_path, capsys, event):
+    event_file = tmp_path / "event.json"
+    event_file.write_text(json.dumps(event))
+    assert plan.main([str(event_file)]) == 0
+    output = capsys.readouterr().out
+    assert output.startswith("create user argle password '********' NOCREATEDB NOCREATEROLE;\n")
+    assert output.endswith("; -- parameters: 'argle'\ncommit;\n")
+
+
+def test_cli_failure(no_external_calls, tmp_path, capsys, event):
+    event["ResourceProperties"]["Resource"] = "Bogus"
+    event_file = tmp_path / "event.json"
+    event_file.write_text(json.dumps(event))
+    assert plan.main([str(event_file)]) == 1
+    assert "FAILED: Unknown resource" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("create user argle password 'bar''gle' NOCREATEDB",    "create user argle password '********' NOCREATEDB"),
+    ("alter user argle PASSWORD 'bargle' CREATEDB",         "alter user argle PASSWORD '********' CREATEDB"),
+    ("alter user argle password NULL",                      "alter user argle password NULL"),
+    ])
+def test_render_masks_passwords(sql, expected):
+    assert plan.render(sql) == expected
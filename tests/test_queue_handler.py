@@ -0,0 +1,217 @@
+""" Unit tests for the queue-based entry point. These use an in-memory queue, and
+    mock the database connection and response.
+    """
+
+import json
+import pytest
+
+from unittest.mock import Mock, ANY
+
+from cf_postgres import lambda_handler, queue_handler
+
+
+SECRET_1    = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-admin-5z4FyE"
+SECRET_2    = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-2-admin-9qqMq4"
+
+
+class InMemoryQueue:
+    """ Implements the queue interface used by queue_handler.drain().
+        """
+
+    def __init__(self, bodies):
+        self.messages = [queue_handler.Message(f"msg-{n}", body) for (n, body) in enumerate(bodies)]
+        self.receive_calls = 0
+
+    def receive(self, max_messages):
+        self.receive_calls += 1
+        return list(self.messages[:max_messages])
+
+    def delete(self, message_ids):
+        self.messages = [m for m in self.messages if m.message_id not in message_ids]
+
+
+################################################################################
+## fixtures and helpers
+################################################################################
+
+def make_event(request_id, request_type, resource_type, secret_arn=SECRET_1, **props):
+    return {
+        "RequestType":          request_type,
+        "ResponseURL":          f"https://example.com/{request_id}",
+        "StackId":              "arn:aws:cloudformation:us-east-1:123456789012:stack/Example/388d1040",
+        "RequestId":            request_id,
+        "LogicalResourceId":    f"Resource{request_id}",
+        "PhysicalResourceId":   f"physical-{request_id}" if request_type != "Create" else None,
+        "ResourceProperties":   dict(props, Resource=resource_type, AdminSecretArn=secret_arn),
+        }
+
+
+def sqs_event(*events):
+    return {
+        "Records": [{ "messageId": f"msg-{n}", "body": json.dumps(e) } for (n, e) in enumerate(events)]
+        }
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    # records the secret for each opened connection
+    opened = []
+    def open_connection(secret_arn):
+        conn = Mock()
+        conn.secret_arn = secret_arn
+        opened.append(conn)
+        return conn
+    monkeypatch.setattr(lambda_handler.util, 'open_connection', Mock(side_effect=open_connection))
+    return opened
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    # records (request ID, resource type, request type, secret) as handlers are invoked
+    calls = []
+    def run_handlers(conn, request_type, resource_type, physical_id, props, old_props, response):
+        calls.append((response["RequestId"], resource_type, request_type, conn.secret_arn))
+        if props.get("Fail"):
+            lambda_handler.util.report_failure(response, "failed", physical_id)
+        else:
+            lambda_handler.util.report_success(response, f"physical-{response['RequestId']}")
+    monkeypatch.setattr(lambda_handler, 'run_handlers', run_handlers)
+    return calls
+
+
+@pytest.fixture
+def send_response_mock(monkeypatch):
+    mock = Mock()
+    monkeypatch.setattr(lambda_handler, 'send_response', mock)
+    return mock
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_groups_by_secret_and_orders_by_dependency(connections, handled, send_response_mock):
+    event = sqs_event(
+        make_event("1", "Create", "Schema"),
+        make_event("2", "Delete", "User"),
+        make_event("3", "Create", "User", SECRET_2),
+        make_event("4", "Create", "User"),
+        make_event("5", "Delete", "Schema"),
+        make_event("6", "Update", "RoleMembership"),
+        )
+    result = queue_handler.handle(event, None)
+    assert result == { "batchItemFailures": [] }
+    assert [c.secret_arn for c in connections] == [SECRET_1, SECRET_2]
+    assert handled == [
+        ("4", "User",           "Create", SECRET_1),
+        ("1", "Schema",         "Create", SECRET_1),
+        ("6", "RoleMembership", "Update", SECRET_1),
+        ("5", "Schema",         "Delete", SECRET_1),
+        ("2", "User",           "Delete", SECRET_1),
+        ("3", "User",           "Create", SECRET_2),
+        ]
+    for conn in connections:
+        conn.close.assert_called_once()
+    assert send_response_mock.call_count == 6
+    send_response_mock.assert_any_call("https://example.com/3", {
+        "Status":               "SUCCESS",
+        "RequestId":            "3",
+        "StackId":              ANY,
+        "LogicalResourceId":    "Resource3",
+        "PhysicalResourceId":   "physical-3",
+        })
+
+
+def test_failure_does_not_affect_other_events(connections, handled, send_response_mock):
+    event = sqs_event(
+        make_event("1", "Create", "User", Fail="true"),
+        make_event("2", "Create", "Schema"),
+        )
+    assert queue_handler.handle(event, None) == { "batchItemFailures": [] }
+    assert len(connections) == 1
+    responses = dict((c[0][1]["RequestId"], c[0][1]) for c in send_response_mock.call_args_list)
+    assert responses["1"]["Status"] == "FAILED"
+    assert responses["2"]["Status"] == "SUCCESS"
+
+
+def test_connection_failure_reported_for_all_events(monkeypatch, handled, send_response_mock):
+    monkeypatch.setattr(lambda_handler.util, 'open_connection', Mock(side_effect=Exception("connection refused")))
+    event = sqs_event(
+        make_event("1", "Create", "User"),
+        make_event("2", "Create", "Schema"),
+        )
+    assert queue_handler.handle(event, None) == { "batchItemFailures": [] }
+    assert handled == []
+    assert send_response_mock.call_count == 2
+    for c in send_response_mock.call_args_list:
+        assert c[0][1]["Status"] == "FAILED"
+        assert "connection refused" in c[0][1]["Reason"]
+
+
+def test_sns_envelope(connections, handled, send_response_mock):
+    notification = {
+        "Type":     "Notification",
+        "Message":  json.dumps(make_event("1", "Create", "User")),
+        }
+    event = { "Records": [{ "messageId": "msg-0", "body": json.dumps(notification) }] }
+    assert queue_handler.handle(event, None) == { "batchItemFailures": [] }
+    assert handled == [("1", "User", "Create", SECRET_1)]
+
+
+def test_unparseable_and_unsent_messages_are_retried(connections, handled, send_response_mock):
+    send_response_mock.side_effect = lambda url, response: \
+        (_ for _ in ()).throw(Exception("timeout")) if response["RequestId"] == "2" else None
+    event = sqs_event(
+        make_event("1", "Create", "User"),
+        make_event("2", "Create", "Schema"),
+        { "WarmUp": True },
+        )
+    event["Records"].append({ "messageId": "msg-3", "body": "not json" })
+    result = queue_handler.handle(event, None)
+    assert sorted(result["batchItemFailures"], key=lambda x: x["itemIdentifier"]) == [
+        { "itemIdentifier": "msg-1" },
+        { "itemIdentifier": "msg-2" },
+        { "itemIdentifier": "msg-3" },
+        ]
+
+
+def test_fan_out_uses_normal_processing(monkeypatch, connections, handled, send_response_mock):
+    process_mock = Mock(side_effect=lambda secret_arn, request_type, resource_type, physical_id, props, old_props, response:
+                            lambda_handler.util.report_success(response, "fanned-out"))
+    monkeypatch.setattr(lambda_handler, 'process', process_mock)
+    event = sqs_event(
+        make_event("1", "Create", "User"),
+        make_event("2", "Create", "Schema", Databases=["tenant1", "tenant2"]),
+        )
+    queue_handler.handle(event, None)
+    assert handled == [("1", "User", "Create", SECRET_1)]
+    process_mock.assert_called_once_with(SECRET_1, "Create", "Schema", None, ANY, {}, ANY)
+    responses = dict((c[0][1]["RequestId"], c[0][1]) for c in send_response_mock.call_args_list)
+    assert responses["2"]["PhysicalResourceId"] == "fanned-out"
+
+
+def test_drain(connections, handled, send_response_mock):
+    queue = InMemoryQueue([json.dumps(make_event(str(n), "Create", "User")) for n in range(25)])
+    assert queue_handler.drain(queue, batch_size=10) == 25
+    assert queue.messages == []
+    assert queue.receive_calls == 4
+    assert len(connections) == 3
+    assert len(handled) == 25
+
+
+def test_drain_leaves_failed_messages(connections, handled, send_response_mock):
+    queue = InMemoryQueue(["not json"])
+    queue.receive = Mock(side_effect=[list(queue.messages), []])
+    assert queue_handler.drain(queue) == 0
+    assert len(queue.messages) == 1
+
+
+def test_in_progress_messages_are_redelivered(monkeypatch, connections, send_response_mock):
+    def run_handlers(conn, request_type, resource_type, physical_id, props, old_props, response):
+        lambda_handler.util.report_in_progress(response, "example.idx")
+    monkeypatch.setattr(lambda_handler, 'run_handlers', run_handlers)
+    result = queue_handler.handle(sqs_event(make_event("1", "Create", "Index"), make_event("2", "Create", "Index")), None)
+    assert result == { "batchItemFailures": [{ "itemIdentifier": "msg-0" }, { "itemIdentifier": "msg-1" }] }
+    send_response_mock.assert_not_called()
+    # each unfinished operation leaves its connection busy, so isn't reused
+    assert len(connections) == 2
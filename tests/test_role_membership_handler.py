@@ -0,0 +1,138 @@
+""" Unit tests for the RoleMembership sub-resource. These tests verify the SQL that
+    the handler generates for a given set of current and desired members.
+    """
+
+import pytest
+from unittest.mock import Mock, ANY
+
+from cf_postgres.handlers import role_membership_handler
+
+
+################################################################################
+# properties from the default event
+################################################################################
+
+RESOURCE_TYPE       = "RoleMembership"
+ROLE_NAME           = "readers"
+MEMBERS             = ["argle", "bargle", "wargle"]
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def mock_connection():
+    conn = Mock()
+    conn.cursor.return_value.fetchall.return_value = []
+    return conn
+
+
+@pytest.fixture
+def default_props():
+    return {
+        'Role':     ROLE_NAME,
+        'Members':  MEMBERS,
+        }
+
+
+@pytest.fixture
+def response_holder():
+    return {}
+
+
+def set_current_members(conn, *rows):
+    conn.cursor.return_value.fetchall.return_value = list(rows)
+
+
+def executed_sql(conn):
+    return [c[0][0] for c in conn.cursor.return_value.execute.call_args_list][1:]
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_create(mock_connection, default_props, response_holder):
+    set_current_members(mock_connection, (ROLE_NAME, "bargle"), (ROLE_NAME, "someone_else"))
+    assert role_membership_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][1] == ([ROLE_NAME],)
+    assert executed_sql(mock_connection) == [ f"grant {ROLE_NAME} to argle, wargle" ]
+    mock_connection.commit.assert_called_once()
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": ROLE_NAME,
+                              "Data": { "Members": "argle,bargle,someone_else,wargle" },
+                              }
+
+
+def test_create_all_existing(mock_connection, default_props, response_holder):
+    set_current_members(mock_connection, *[(ROLE_NAME, m) for m in MEMBERS])
+    assert role_membership_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == []
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update(mock_connection, default_props, response_holder):
+    old_props = {
+        'Role':     ROLE_NAME,
+        'Members':  ["argle", "bargle", "foo", "bar"],
+        }
+    set_current_members(mock_connection, (ROLE_NAME, "argle"), (ROLE_NAME, "bargle"), (ROLE_NAME, "foo"), (ROLE_NAME, "someone_else"))
+    assert role_membership_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, ROLE_NAME, default_props, old_props, response_holder)
+    # "bar" was managed but is no longer a member; "someone_else" was never managed
+    assert executed_sql(mock_connection) == [
+        f"revoke {ROLE_NAME} from foo",
+        f"grant {ROLE_NAME} to wargle",
+        ]
+    mock_connection.commit.assert_called_once()
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_change_role(mock_connection, default_props, response_holder):
+    old_props = {
+        'Role':     "writers",
+        'Members':  ["argle", "bargle"],
+        }
+    set_current_members(mock_connection, ("writers", "argle"), ("writers", "bargle"), (ROLE_NAME, "argle"))
+    assert role_membership_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, "writers", default_props, old_props, response_holder)
+    assert executed_sql(mock_connection) == [
+        "revoke writers from argle, bargle",
+        f"grant {ROLE_NAME} to bargle, wargle",
+        ]
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": ROLE_NAME,
+                              "Data": { "Members": "argle,bargle,wargle" },
+                              }
+
+
+def test_delete(mock_connection, default_props, response_holder):
+    set_current_members(mock_connection, (ROLE_NAME, "argle"), (ROLE_NAME, "wargle"), (ROLE_NAME, "someone_else"))
+    assert role_membership_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, ROLE_NAME, default_props, {}, response_holder)
+    assert executed_sql(mock_connection) == [ f"revoke {ROLE_NAME} from argle, wargle" ]
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": ROLE_NAME,
+                              }
+
+
+def test_create_quoted_names(mock_connection, default_props, response_holder):
+    default_props['Role'] = "app-readers"
+    default_props['Members'] = ["Argle", '"Bargle"', "user"]
+    set_current_members(mock_connection, ("app-readers", "argle"))
+    assert role_membership_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][1] == (["app-readers"],)
+    assert executed_sql(mock_connection) == [ 'grant "app-readers" to "Bargle", "user"' ]
+    assert response_holder["Data"] == { "Members": "Bargle,argle,user" }
+
+
+def test_exception(mock_connection, default_props, response_holder):
+    mock_connection.cursor.return_value.execute.side_effect = Exception("I don't work!")
+    assert role_membership_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    mock_connection.rollback.assert_called_once()
+    assert response_holder == {
+                              "Status": "FAILED",
+                              "PhysicalResourceId": ANY,
+                              "Reason": ANY
+                              }
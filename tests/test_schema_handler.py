@@ -39,7 +39,9 @@ CASCADE_STR         = "true"
 
 @pytest.fixture
 def mock_connection():
-    return Mock()
+    conn = Mock()
+    conn.cursor.return_value.fetchone.return_value = None
+    return conn
 
 
 @pytest.fixture
@@ -89,6 +91,11 @@ def do_delete_spy(monkeypatch):
     return spy
 
 
+def executed_statements(csr):
+    # grants and revokes are sent in batches; this splits them into individual statements
+    return [sql for c in csr.execute.call_args_list for sql in c[0][0].split(";\n")]
+
+
 ################################################################################
 ## testcases
 ##
@@ -152,4 +159,254 @@ def test_exception_in_action_method(monkeypatch, mock_connection, default_props,
                               "Status": "FAILED",
                               "PhysicalResourceId": ANY,
                               "Reason": ANY
-                              } 
\ No newline at end of file
+                              } 
+
+def test_create_returns_attributes(mock_connection, default_props, response_holder):
+    csr = mock_connection.cursor.return_value
+    csr.description = [("Oid",), ("Owner",), ("UsageGrantees",), ("CreateGrantees",)]
+    csr.fetchone.return_value = ("16390", OWNER, ["argle", "bargle", "public"], ["argle", "bargle"])
+    assert schema_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    assert csr.execute.call_args[0][1] == (SCHEMA_NAME,)
+    mock_connection.commit.assert_called_once()
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": SCHEMA_NAME,
+                              "Data": {
+                                  "Oid":            "16390",
+                                  "Owner":          OWNER,
+                                  "UsageGrantees":  "argle,bargle,public",
+                                  "CreateGrantees": "argle,bargle",
+                                  },
+                              }
+
+
+def test_create_batches_grants(mock_connection, default_props, response_holder):
+    default_props['Public'] = "false"
+    default_props['Users'] = [f"user_{n}" for n in range(30)]
+    default_props['ReadOnlyUsers'] = []
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    batches = [c[0][0] for c in csr.execute.call_args_list if c[0][0].startswith("grant all on schema")]
+    assert [sql.count(";") + 1 for sql in batches] == [100, 50]
+    assert batches[0].startswith("grant all on schema example to user_0;\nalter default privileges in schema example grant all on tables to user_0;\n")
+    assert batches[1].endswith("alter default privileges in schema example grant all on types to user_29")
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_create_grant_existing(mock_connection, default_props, response_holder):
+    default_props['Public'] = "false"
+    default_props['GrantExisting'] = "true"
+    csr = mock_connection.cursor.return_value
+    csr.fetchone.side_effect = [(10000, 20, 5), None]
+    assert schema_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    existing = [sql for sql in executed if " on all " in sql]
+    assert existing == [
+        "grant all on all tables in schema example to argle, bargle",
+        "grant select on all tables in schema example to foo, bar, baz",
+        "grant all on all sequences in schema example to argle, bargle",
+        "grant select, usage on all sequences in schema example to foo, bar, baz",
+        "grant all on all functions in schema example to argle, bargle",
+        "grant execute on all functions in schema example to foo, bar, baz",
+        ]
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_create_quoted_names(mock_connection, default_props, response_holder):
+    default_props['Name'] = "App-Data"
+    default_props['Users'] = ["Argle", "user"]
+    default_props['ReadOnlyUsers'] = []
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    executed = executed_statements(csr)
+    assert executed[0] == 'create schema if not exists "App-Data" authorization me'
+    assert 'grant all on schema "App-Data" to PUBLIC' in executed
+    assert 'grant all on schema "App-Data" to argle' in executed
+    assert 'alter default privileges in schema "App-Data" grant all on tables to "user"' in executed
+    assert csr.execute.call_args[0][1] == ('"App-Data"',)
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_grant_existing(mock_connection, default_props, response_holder):
+    default_props['GrantExisting'] = "true"
+    old_props = copy.deepcopy(default_props)
+    old_props['Users'] = ["argle", "wargle"]
+    old_props['ReadOnlyUsers'] = ["foo", "bar"]
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, SCHEMA_NAME, default_props, old_props, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    existing = [sql for sql in executed if " on all " in sql]
+    assert existing == [
+        "revoke all on all tables in schema example from wargle",
+        "revoke all on all sequences in schema example from wargle",
+        "revoke all on all functions in schema example from wargle",
+        "grant all on all tables in schema example to bargle",
+        "grant select on all tables in schema example to baz",
+        "grant all on all sequences in schema example to bargle",
+        "grant select, usage on all sequences in schema example to baz",
+        "grant all on all functions in schema example to bargle",
+        "grant execute on all functions in schema example to baz",
+        ]
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_public_to_private_grant_existing(mock_connection, default_props, response_holder):
+    default_props['GrantExisting'] = "true"
+    old_props = copy.deepcopy(default_props)
+    default_props['Public'] = "false"
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, SCHEMA_NAME, default_props, old_props, response_holder)
+    executed = executed_statements(csr)
+    assert "revoke all on schema example from PUBLIC" in executed
+    assert [sql for sql in executed if sql.startswith("grant ")] == []
+    assert [sql for sql in executed if " on all " in sql] == [
+        "revoke all on all tables in schema example from PUBLIC",
+        "revoke all on all sequences in schema example from PUBLIC",
+        "revoke all on all functions in schema example from PUBLIC",
+        ]
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_private_to_public_grant_existing(mock_connection, default_props, response_holder):
+    default_props['GrantExisting'] = "true"
+    old_props = copy.deepcopy(default_props)
+    old_props['Public'] = "false"
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, SCHEMA_NAME, default_props, old_props, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    assert [sql for sql in executed if sql.startswith("revoke ")] == []
+    assert [sql for sql in executed if " on all " in sql] == [
+        "grant all on all tables in schema example to PUBLIC",
+        "grant all on all sequences in schema example to PUBLIC",
+        "grant all on all functions in schema example to PUBLIC",
+        ]
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_no_grant_existing_by_default(mock_connection, default_props, response_holder):
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    assert [sql for sql in executed if " on all " in sql] == []
+
+
+def test_create_from_template(mock_connection, default_props, response_holder):
+    default_props['Template'] = "template"
+    csr = mock_connection.cursor.return_value
+    csr.fetchone.side_effect = [("template",), None]
+    csr.fetchall.return_value = [
+        ("create sequence s as bigint increment by 1 minvalue 1 maxvalue 9223372036854775807 start with 1 cache 1 no cycle",),
+        ("create table t (id integer not null, x text)",),
+        ("alter table t alter column id set default nextval('s'::regclass)",),
+        ("alter table t add constraint t_pkey PRIMARY KEY (id)",),
+        ]
+    assert schema_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    executed = executed_statements(csr)
+    start = executed.index("set local search_path to template")
+    assert executed[start + 2:start + 8] == [
+        "set local search_path to example",
+        "set local check_function_bodies = off",
+        "create sequence s as bigint increment by 1 minvalue 1 maxvalue 9223372036854775807 start with 1 cache 1 no cycle",
+        "create table t (id integer not null, x text)",
+        "alter table t alter column id set default nextval('s'::regclass)",
+        "alter table t add constraint t_pkey PRIMARY KEY (id)",
+        ]
+    # the template is copied after default privileges are granted, so that they apply
+    assert executed.index("alter default privileges in schema example grant all on tables to argle") < start
+    calls = [c[0] for c in csr.execute.call_args_list]
+    assert calls[calls.index(("set local search_path to template",)) + 1][1] == ("template", "template", "template")
+    mock_connection.commit.assert_called_once()
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": SCHEMA_NAME,
+                              }
+
+
+def test_create_from_missing_template(mock_connection, default_props, response_holder):
+    default_props['Template'] = "template"
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, default_props, {}, response_holder)
+    csr.fetchall.assert_not_called()
+    mock_connection.commit.assert_not_called()
+    mock_connection.rollback.assert_called_once()
+    assert response_holder["Status"] == "FAILED"
+    assert "template schema template does not exist" in response_holder["Reason"]
+
+
+def test_delete_cascade_in_batches(mock_connection, default_props, response_holder):
+    default_props['CascadeBatchSize'] = "3"
+    csr = mock_connection.cursor.return_value
+    csr.fetchall.side_effect = [
+        [("table", "example.t1"), ("table", "example.t2"), ("view", "example.v1")],
+        [("function", "example.f(integer)"), ("type", "example.mood")],
+        [],
+        ]
+    assert schema_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, SCHEMA_NAME, default_props, {}, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list if c[0][0].startswith("drop")]
+    assert executed == [
+        "drop table if exists example.t1, example.t2 cascade",
+        "drop view if exists example.v1 cascade",
+        "drop function if exists example.f(integer) cascade",
+        "drop type if exists example.mood cascade",
+        "drop schema if exists example cascade",
+        ]
+    assert mock_connection.commit.call_count == 3
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": SCHEMA_NAME,
+                              }
+
+
+def test_delete_batch_size_ignored_without_cascade(mock_connection, default_props, response_holder):
+    default_props['Cascade'] = "false"
+    default_props['CascadeBatchSize'] = "3"
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, SCHEMA_NAME, default_props, {}, response_holder)
+    csr.execute.assert_called_once_with("drop schema if exists example")
+
+
+def test_update_transfers_ownership(mock_connection, default_props, response_holder):
+    default_props['TransferOwnership'] = "true"
+    old_props = copy.deepcopy(default_props)
+    old_props['Owner'] = "previous"
+    csr = mock_connection.cursor.return_value
+    csr.fetchall.return_value = [("table", "t1", "me")] * 150 + [("function", "f(integer)", "me"), ("view", "v1", "me")]
+    assert schema_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, SCHEMA_NAME, default_props, old_props, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    assert executed[0] == "alter schema example owner to  me"
+    batches = [sql for sql in executed if sql.startswith("alter table t1")]
+    assert [sql.count(";") for sql in batches] == [99, 51]
+    assert batches[1].endswith("alter table t1 owner to me;\nalter function f(integer) owner to me;\nalter view v1 owner to me")
+    csr.fetchall.assert_called_once()
+    mock_connection.commit.assert_called_once()
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_transfers_ownership_in_batches(mock_connection, default_props, response_holder):
+    default_props['TransferOwnership'] = "true"
+    default_props['TransferOwnershipBatchSize'] = "2"
+    csr = mock_connection.cursor.return_value
+    csr.fetchall.side_effect = [
+        [("sequence", "s1", "me"), ("table", "t1", "me")],
+        [("type", "mood", "me")],
+        [],
+        ]
+    assert schema_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, SCHEMA_NAME, default_props, default_props, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list if "owner to" in c[0][0]]
+    assert executed == [
+        "alter sequence s1 owner to me;\nalter table t1 owner to me",
+        "alter type mood owner to me",
+        ]
+    assert [c[0][1][1] for c in csr.execute.call_args_list if len(c[0]) > 1 and "objects.owner <> n.nspowner" in c[0][0]] == [2, 2, 2]
+    # one commit before transferring, one per batch, and one at the end
+    assert mock_connection.commit.call_count == 4
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_no_transfer_ownership_by_default(mock_connection, default_props, response_holder):
+    old_props = copy.deepcopy(default_props)
+    old_props['Owner'] = "previous"
+    csr = mock_connection.cursor.return_value
+    assert schema_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, SCHEMA_NAME, default_props, old_props, response_holder)
+    executed = [c[0][0] for c in csr.execute.call_args_list]
+    assert [sql for sql in executed if "objects.owner <> n.nspowner" in sql] == []
@@ -0,0 +1,204 @@
+""" Unit tests for the HTTP service. These run the server on an ephemeral port, and
+    mock the database connection and response.
+    """
+
+import json
+import pytest
+import threading
+import time
+import urllib.request
+
+from unittest.mock import Mock
+
+from cf_postgres import lambda_handler, server
+
+
+SECRET_1    = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-admin-5z4FyE"
+
+
+################################################################################
+## fixtures and helpers
+################################################################################
+
+def make_event(request_id, request_type="Create", resource_type="Testing", secret_arn=SECRET_1, **props):
+    return {
+        "RequestType":          request_type,
+        "ResponseURL":          f"https://example.com/{request_id}",
+        "StackId":              "arn:aws:cloudformation:us-east-1:123456789012:stack/Example/388d1040",
+        "RequestId":            request_id,
+        "LogicalResourceId":    f"Resource{request_id}",
+        "PhysicalResourceId":   f"physical-{request_id}" if request_type != "Create" else None,
+        "ResourceProperties":   dict(props, Resource=resource_type, AdminSecretArn=secret_arn),
+        }
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+    def open_connection(secret_arn):
+        conn = Mock()
+        conn.secret_arn = secret_arn
+        opened.append(conn)
+        return conn
+    monkeypatch.setattr(lambda_handler.util, 'open_connection', Mock(side_effect=open_connection))
+    return opened
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    # maps response URL to response
+    sent = {}
+    def send_response(response_url, response):
+        sent[response_url] = response
+    monkeypatch.setattr(lambda_handler, 'send_response', send_response)
+    return sent
+
+
+@pytest.fixture
+def running_server():
+    srv = server.create_server("127.0.0.1", 0, server.Service(workers=2, pool_size=1))
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def request(srv, method, path="/", body=None):
+    (host, port) = srv.server_address
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(f"http://{host}:{port}{path}", data=data, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=10) as rsp:
+            return (rsp.status, json.loads(rsp.read()))
+    except urllib.error.HTTPError as ex:
+        return (ex.code, json.loads(ex.read()))
+
+
+def _wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out waiting for condition")
+        time.sleep(0.01)
+
+
+################################################################################
+## test cases
+################################################################################
+
+def test_event_processed_and_response_sent(running_server, connections, responses):
+    (status, body) = request(running_server, "POST", body=make_event("1"))
+    assert status == 202
+    assert body == { "RequestId": "1" }
+    _wait_until(lambda: "https://example.com/1" in responses)
+    assert responses["https://example.com/1"]["Status"] == "SUCCESS"
+    assert responses["https://example.com/1"]["RequestId"] == "1"
+    assert len(connections) == 1
+
+
+def test_connections_reused_between_events(running_server, connections, responses):
+    for request_id in ("1", "2", "3"):
+        request(running_server, "POST", body=make_event(request_id))
+        _wait_until(lambda: f"https://example.com/{request_id}" in responses)
+    assert len(connections) == 1
+    assert all(r["Status"] == "SUCCESS" for r in responses.values())
+    connections[0].rollback.assert_called()
+
+
+def test_handler_failure_reported(running_server, connections, responses):
+    request(running_server, "POST", body=make_event("1", resource_type="Bogus"))
+    _wait_until(lambda: "https://example.com/1" in responses)
+    assert responses["https://example.com/1"]["Status"] == "FAILED"
+    assert "Unknown resource" in responses["https://example.com/1"]["Reason"]
+
+
+def test_connection_failure_reported(running_server, monkeypatch, responses):
+    monkeypatch.setattr(lambda_handler.util, 'open_connection', Mock(side_effect=Exception("no route to host")))
+    request(running_server, "POST", body=make_event("1"))
+    _wait_until(lambda: "https://example.com/1" in responses)
+    assert responses["https://example.com/1"]["Status"] == "FAILED"
+    assert "no route to host" in responses["https://example.com/1"]["Reason"]
+
+
+def test_plan_returned_synchronously(running_server, connections, responses):
+    event = dict(make_event("1"), Plan="true")
+    (status, body) = request(running_server, "POST", body=event)
+    assert status == 200
+    assert body["Status"] == "SUCCESS"
+    assert "Statements" in body
+    assert connections == []
+    assert responses == {}
+
+
+def test_invalid_requests(running_server, connections, responses):
+    (status, _) = request(running_server, "POST", body=["not", "an", "event"])
+    assert status == 400
+    event = make_event("1")
+    del event["ResponseURL"]
+    (status, body) = request(running_server, "POST", body=event)
+    assert status == 400
+    assert body["Reason"] == "missing ResponseURL"
+    (status, _) = request(running_server, "GET", "/bogus")
+    assert status == 404
+
+
+def test_health_and_drain(running_server, connections, responses):
+    (status, body) = request(running_server, "GET", "/health")
+    assert status == 200
+    assert body["Status"] == "OK"
+    request(running_server, "POST", body=make_event("1"))
+    running_server.service.drain()
+    assert "https://example.com/1" in responses
+    connections[0].close.assert_called_once()
+    (status, body) = request(running_server, "GET", "/health")
+    assert status == 503
+    assert body["Status"] == "DRAINING"
+    assert body["Processed"] == 1
+    (status, body) = request(running_server, "POST", body=make_event("2"))
+    assert status == 503
+    assert "https://example.com/2" not in responses
+
+
+def test_submit_queues_while_holding_lock():
+    # otherwise drain() could shut down the executor between the check and the submit
+    service = server.Service(workers=1)
+    locked = []
+    service._executor = Mock()
+    service._executor.submit.side_effect = lambda fn, event: locked.append(service._lock.locked())
+    assert service.submit(make_event("1"))
+    assert locked == [True]
+    assert service.health()["Pending"] == 1
+    service.draining = True
+    assert not service.submit(make_event("2"))
+    assert service._executor.submit.call_count == 1
+    assert service.health()["Pending"] == 1
+
+
+def test_pool_limits_connections_per_secret(connections):
+    pool = server.ConnectionPool(max_size=1)
+    acquired = []
+    with pool.connection(SECRET_1) as conn_1:
+        thread = threading.Thread(target=lambda: acquired.append(pool._acquire(SECRET_1)), daemon=True)
+        thread.start()
+        thread.join(0.1)
+        assert acquired == []
+        assert pool.stats() == { "InUse": 1, "Idle": 0 }
+    thread.join(5)
+    assert acquired == [conn_1]
+    assert len(connections) == 1
+
+
+def test_pool_discards_broken_and_stale_connections(connections):
+    pool = server.ConnectionPool(max_size=2, max_idle_seconds=60)
+    with pool.connection(SECRET_1) as conn_1:
+        conn_1.rollback.side_effect = Exception("connection reset")
+    conn_1.close.assert_called_once()
+    assert pool.stats() == { "InUse": 0, "Idle": 0 }
+    with pool.connection(SECRET_1) as conn_2:
+        pass
+    pool._idle[SECRET_1] = [(conn_2, time.time() - 120)]
+    with pool.connection(SECRET_1) as conn_3:
+        assert conn_3 is not conn_2
+    conn_2.close.assert_called_once()
+    assert len(connections) == 3
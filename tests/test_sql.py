@@ -0,0 +1,81 @@
+""" Unit tests for the SQL statement builder.
+    """
+
+import pytest
+
+from cf_postgres import sql
+
+
+################################################################################
+## testcases
+################################################################################
+
+@pytest.mark.parametrize("identifier, expected_name, expected_ident", [
+    ("example",         "example",          "example"),
+    ("Example",         "example",          "example"),
+    ("_example_2$",     "_example_2$",      "_example_2$"),
+    ("app-data",        "app-data",         '"app-data"'),
+    ("my schema",       "my schema",        '"my schema"'),
+    ('"Example"',       "Example",          '"Example"'),
+    ('"example"',       "example",          "example"),
+    ('"say ""hi"""',    'say "hi"',         '"say ""hi"""'),
+    ("user",            "user",             '"user"'),
+    ("USER",            "user",             '"user"'),
+    ("2fast",           "2fast",            '"2fast"'),
+    ("ünïcode",         "ünïcode",          '"ünïcode"'),
+    ])
+def test_name_and_ident(identifier, expected_name, expected_ident):
+    assert sql.name(identifier) == expected_name
+    assert sql.ident(identifier) == expected_ident
+
+
+def test_quote_does_not_fold():
+    assert sql.quote("example") == "example"
+    assert sql.quote("Example") == '"Example"'
+    assert sql.quote("select") == '"select"'
+    assert sql.quote_all(["argle", "Bargle"]) == 'argle, "Bargle"'
+
+
+def test_unreserved_keywords_not_quoted():
+    assert sql.ident("name") == "name"
+    assert sql.ident("data") == "data"
+
+
+def test_qualified():
+    assert sql.qualified("search_path") == "search_path"
+    assert sql.qualified("pg_stat_statements.track") == "pg_stat_statements.track"
+    assert sql.qualified('App."My Table"') == 'app."My Table"'
+    assert sql.qualified('"a.b".c') == '"a.b".c'
+
+
+def test_role():
+    assert sql.role("public") == "PUBLIC"
+    assert sql.role("PUBLIC") == "PUBLIC"
+    assert sql.role("current_user") == "CURRENT_USER"
+    assert sql.role('"current_user"') == '"current_user"'
+    assert sql.role("app-user") == '"app-user"'
+    assert sql.roles(["PUBLIC", "argle", "Bargle"]) == "PUBLIC, argle, bargle"
+
+
+def test_literal():
+    assert sql.literal("example") == "'example'"
+    assert sql.literal("it's") == "'it''s'"
+    assert sql.literal(None) == "NULL"
+    assert sql.literal(123) == "'123'"
+
+
+def test_template():
+    t = sql.template("grant {privs} on schema {schema:ident} to {grantees:roles}")
+    assert t(privs="usage", schema="App-Data", grantees=["public", "argle"]) == 'grant usage on schema "App-Data" to PUBLIC, argle'
+    assert sql.template("grant {privs} on schema {schema:ident} to {grantees:roles}") is t
+
+
+def test_template_rejects_unknown_format():
+    with pytest.raises(KeyError):
+        sql.Template("drop table {name:bogus}")
+
+
+def test_batch():
+    statements = [f"select {n}" for n in range(5)]
+    assert sql.batch(statements, 2) == ["select 0;\nselect 1", "select 2;\nselect 3", "select 4"]
+    assert sql.batch([], 2) == []
@@ -0,0 +1,159 @@
+""" Unit tests for tracing. Tests that examine spans require the OpenTelemetry SDK,
+    and are skipped if it isn't installed.
+    """
+
+import json
+import pytest
+
+from types import SimpleNamespace
+from unittest.mock import Mock, MagicMock
+
+from cf_postgres import lambda_handler, tracing, util
+
+
+STACK_ID    = "arn:aws:cloudformation:us-east-1:123456789012:stack/Example/388d1040"
+SECRET_ARN  = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-admin-5z4FyE"
+
+
+################################################################################
+## fixtures and helpers
+################################################################################
+
+def make_event(resource_type="Counting"):
+    return {
+        "RequestType":          "Create",
+        "ResponseURL":          "https://example.com/response",
+        "StackId":              STACK_ID,
+        "RequestId":            "602e48af",
+        "LogicalResourceId":    "Example",
+        "ResourceProperties":   { "Resource": resource_type, "AdminSecretArn": SECRET_ARN },
+        }
+
+
+def counting_handler(statement_count):
+    # a handler that executes the specified number of statements
+    def try_handle(conn, request_type, resource_type, physical_id, props, old_props, response):
+        if resource_type != "Counting":
+            return False
+        csr = conn.cursor()
+        for n in range(statement_count):
+            csr.execute("select %s", (n,))
+        conn.commit()
+        util.report_success(response, "counted")
+        return True
+    return SimpleNamespace(try_handle=try_handle)
+
+
+@pytest.fixture
+def exporter():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    exporter = InMemorySpanExporter()
+    tracing.configure(exporter)
+    yield exporter
+    tracing.configure(None)
+
+
+@pytest.fixture
+def patched_aws(monkeypatch):
+    # secrets come from a mock client; connections and responses are mocked
+    util.reset_caches()
+    secret = { "username": "admin", "password": "secret", "host": "db.example.com", "port": "5432", "dbname": "postgres" }
+    sm_client = Mock()
+    sm_client.get_secret_value.return_value = { "SecretString": json.dumps(secret) }
+    monkeypatch.setattr(util, "aws_client", lambda service_name: sm_client)
+    monkeypatch.setattr(lambda_handler.util.pg8000.dbapi, "connect", Mock(return_value=MagicMock()))
+    monkeypatch.setattr(lambda_handler.requests, "put", Mock(return_value=Mock(status_code=200)))
+    monkeypatch.setattr(lambda_handler, "HANDLERS", [counting_handler(3)])
+    yield
+    util.reset_caches()
+
+
+def spans_by_name(exporter):
+    return { span.name: span for span in exporter.get_finished_spans() }
+
+
+################################################################################
+## test cases
+################################################################################
+
+def test_span_is_no_op_without_opentelemetry(monkeypatch):
+    monkeypatch.setattr(tracing, "otel_trace", None)
+    with tracing.span("example", foo="bar") as span:
+        span.set_attribute("baz", 123)
+        assert not span.is_recording()
+    tracing.flush()
+
+
+def test_handle_without_opentelemetry(monkeypatch, patched_aws):
+    monkeypatch.setattr(tracing, "otel_trace", None)
+    lambda_handler.handle(make_event(), None)
+    assert json.loads(lambda_handler.requests.put.call_args.kwargs["data"])["Status"] == "SUCCESS"
+
+
+def test_counting_connection():
+    conn = MagicMock()
+    counted = tracing.CountingConnection(conn)
+    csr = counted.cursor()
+    csr.execute("select 1")
+    csr.execute("select %s", (2,))
+    csr.fetchall()
+    counted.autocommit = True
+    counted.commit()
+    assert counted.statement_count == 2
+    assert conn.autocommit == True
+    conn.cursor.return_value.execute.assert_called_with("select %s", (2,))
+    conn.cursor.return_value.fetchall.assert_called_once()
+    conn.commit.assert_called_once()
+
+
+def test_spans_for_invocation(exporter, patched_aws):
+    lambda_handler.handle(make_event(), None)
+    spans = spans_by_name(exporter)
+    assert set(spans.keys()) == {
+        "cf_postgres.handle", "cf_postgres.retrieve_secret", "cf_postgres.connect",
+        "cf_postgres.handler", "cf_postgres.send_response" }
+    root = spans["cf_postgres.handle"]
+    assert root.parent is None
+    assert root.attributes[tracing.ATTR_STACK_ID] == STACK_ID
+    assert root.attributes[tracing.ATTR_LOGICAL_ID] == "Example"
+    assert root.attributes[tracing.ATTR_RESOURCE_TYPE] == "Counting"
+    assert root.attributes[tracing.ATTR_STATUS] == "SUCCESS"
+    for name, span in spans.items():
+        if span is not root:
+            assert span.parent.span_id == root.context.span_id, name
+            assert span.context.trace_id == root.context.trace_id, name
+    assert spans["cf_postgres.retrieve_secret"].attributes["aws.secretsmanager.secret_arn"] == SECRET_ARN
+    assert spans["cf_postgres.connect"].attributes["server.address"] == "db.example.com"
+    assert spans["cf_postgres.handler"].attributes[tracing.ATTR_STATEMENTS] == 3
+    assert spans["cf_postgres.handler"].attributes[tracing.ATTR_STATUS] == "SUCCESS"
+    assert spans["cf_postgres.send_response"].attributes["http.response.status_code"] == 200
+
+
+def test_failure_recorded_on_spans(exporter, patched_aws):
+    lambda_handler.handle(make_event(resource_type="Bogus"), None)
+    spans = spans_by_name(exporter)
+    assert spans["cf_postgres.handler"].attributes[tracing.ATTR_STATUS] == "FAILED"
+    assert spans["cf_postgres.handler"].attributes[tracing.ATTR_STATEMENTS] == 0
+    assert spans["cf_postgres.handle"].attributes[tracing.ATTR_STATUS] == "FAILED"
+
+
+def test_exception_recorded_on_span(exporter):
+    from opentelemetry.trace import StatusCode
+    with pytest.raises(ValueError):
+        with tracing.span("example"):
+            raise ValueError("oops")
+    (span,) = exporter.get_finished_spans()
+    assert span.status.status_code == StatusCode.ERROR
+    assert span.events[0].name == "exception"
+
+
+def test_concurrent_work_attributed_to_caller(exporter):
+    def work(n):
+        with tracing.span(f"work-{n}"):
+            return n
+    with tracing.span("parent") as parent:
+        assert util.run_concurrently(work, [1, 2, 3], 3) == [1, 2, 3]
+    spans = spans_by_name(exporter)
+    for n in (1, 2, 3):
+        assert spans[f"work-{n}"].parent.span_id == spans["parent"].context.span_id
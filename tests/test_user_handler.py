@@ -8,7 +8,7 @@
 import copy
 import json
 import pytest
-from unittest.mock import Mock, patch, ANY
+from unittest.mock import Mock, MagicMock, patch, ANY
 
 from cf_postgres import util
 from cf_postgres.handlers import user_handler
@@ -25,6 +25,9 @@ PASSWORD            = "tester-123"
 ADMIN_SECRET_ARN    = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-admin-5z4FyE"
 SECRET_ARN          = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-user-9qqMq4"
 
+NO_SETTINGS         = user_handler.RoleSettings(None, None, {}, {})
+NO_DELETE_OPTIONS   = user_handler.DeleteOptions(None, None, None)
+
 
 ################################################################################
 ## fixtures
@@ -32,7 +35,9 @@ SECRET_ARN          = "arn:aws:secretsmanager:us-east-1:123456789012:secret:data
 
 @pytest.fixture
 def mock_connection():
-    return Mock()
+    conn = Mock()
+    conn.cursor.return_value.fetchone.return_value = None
+    return conn
 
 
 @pytest.fixture
@@ -113,7 +118,7 @@ def test_create_from_props(no_secret, mock_connection, response_holder, mock_cre
                 "CreateRole":     "TRUE",
             }
     assert user_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
-    mock_create.assert_called_once_with(mock_connection, USERNAME, PASSWORD, True, True, response_holder)
+    mock_create.assert_called_once_with(mock_connection, USERNAME, PASSWORD, True, True, NO_SETTINGS, response_holder)
 
 
 def test_create_from_secret(mock_secret, mock_connection, response_holder, mock_create):
@@ -122,7 +127,7 @@ def test_create_from_secret(mock_secret, mock_connection, response_holder, mock_
             }
     assert user_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
     mock_secret.assert_called_once_with(SECRET_ARN)
-    mock_create.assert_called_once_with(mock_connection, USERNAME, PASSWORD, False, False, response_holder)
+    mock_create.assert_called_once_with(mock_connection, USERNAME, PASSWORD, False, False, NO_SETTINGS, response_holder)
 
 
 def test_update_flow(no_secret, mock_connection, response_holder):
@@ -164,7 +169,7 @@ def test_update_from_props(mock_secret, mock_connection, response_holder, mock_u
                 "CreateRole":     "TRUE",
             }
     assert user_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
-    mock_update.assert_called_once_with(mock_connection, USERNAME, None, True, True, response_holder)
+    mock_update.assert_called_once_with(mock_connection, USERNAME, None, True, True, {"createdb", "createrole"}, NO_SETTINGS, response_holder)
 
 
 def test_update_from_secret(mock_secret, mock_connection, response_holder, mock_update):
@@ -172,9 +177,73 @@ def test_update_from_secret(mock_secret, mock_connection, response_holder, mock_
                 "UserSecretArn":    SECRET_ARN,
             }
     assert user_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
-    mock_update.assert_called_once_with(mock_connection, USERNAME, PASSWORD, False, False, response_holder)
+    mock_update.assert_called_once_with(mock_connection, USERNAME, PASSWORD, False, False, {"password"}, NO_SETTINGS, response_holder)
     
 
+def test_changed_attributes():
+    old_props = {
+                "Username":       USERNAME,
+                "Password":       PASSWORD,
+                "CreateDatabase": "false",
+            }
+    assert user_handler.changed_attributes(dict(old_props), old_props) == set()
+    assert user_handler.changed_attributes(dict(old_props, Password="changed"), old_props) == {"password"}
+    assert user_handler.changed_attributes(dict(old_props, CreateDatabase="TRUE"), old_props) == {"createdb"}
+    assert user_handler.changed_attributes(dict(old_props, CreateRole="true"), old_props) == {"createrole"}
+    assert user_handler.changed_attributes({"UserSecretArn": SECRET_ARN}, old_props) == {"password"}
+
+
+def test_update_no_changes(no_secret, mock_connection, response_holder):
+    props = {
+                "Username":       USERNAME,
+                "Password":       PASSWORD,
+                "CreateDatabase": "true",
+            }
+    assert user_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, USERNAME, props, dict(props), response_holder)
+    # the only query retrieves attributes
+    mock_connection.cursor.return_value.execute.assert_called_once()
+    assert "from    pg_roles r" in mock_connection.cursor.return_value.execute.call_args[0][0]
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": USERNAME,
+                              }
+
+
+def test_update_only_changed_attributes(no_secret, mock_connection, response_holder):
+    old_props = {
+                "Username":       USERNAME,
+                "Password":       PASSWORD,
+                "CreateDatabase": "true",
+            }
+    props = dict(old_props, CreateDatabase="false")
+    assert user_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, USERNAME, props, old_props, response_holder)
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][0] == f"alter user {USERNAME} NOCREATEDB"
+    assert mock_connection.cursor.return_value.execute.call_count == 2
+    mock_connection.commit.assert_called_once()
+
+
+def test_create_returns_attributes(no_secret, mock_connection, response_holder):
+    mock_connection.cursor.return_value.description = [("Oid",), ("CanLogin",), ("CreateDatabase",), ("ConnectionLimit",), ("MemberOf",)]
+    mock_connection.cursor.return_value.fetchone.return_value = ("16384", True, False, -1, ["readers", "writers"])
+    props = {
+                "Username":     USERNAME,
+                "Password":     PASSWORD,
+            }
+    assert user_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    assert mock_connection.cursor.return_value.execute.call_args[0][1] == (USERNAME,)
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": USERNAME,
+                              "Data": {
+                                  "Oid":             "16384",
+                                  "CanLogin":        "true",
+                                  "CreateDatabase":  "false",
+                                  "ConnectionLimit": "-1",
+                                  "MemberOf":        "readers,writers",
+                                  },
+                              }
+
+
 def test_delete_flow(no_secret, mock_connection, response_holder):
     props = {
                 "Username":     USERNAME,
@@ -201,7 +270,7 @@ def test_delete(no_secret, mock_connection, response_holder, mock_delete):
                 "Username":     USERNAME,
             }
     assert user_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
-    mock_delete.assert_called_once_with(mock_connection, USERNAME, response_holder)
+    mock_delete.assert_called_once_with(mock_connection, USERNAME, NO_DELETE_OPTIONS, response_holder)
     
     
 def test_delete_ignores_username_property(no_secret, mock_connection, response_holder, mock_delete):
@@ -209,4 +278,177 @@ def test_delete_ignores_username_property(no_secret, mock_connection, response_h
                 "Username":       "anything",
             }
     assert user_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
-    mock_delete.assert_called_once_with(mock_connection, USERNAME, response_holder)
+    mock_delete.assert_called_once_with(mock_connection, USERNAME, NO_DELETE_OPTIONS, response_holder)
+
+
+# the following tests verify connection limits and configuration parameters
+
+def set_current_settings(conn, connection_limit, *settings):
+    rows = [(connection_limit, database, config) for (database, config) in settings] or [(connection_limit, None, None)]
+    conn.cursor.return_value.fetchall.return_value = rows
+
+
+def executed_sql(conn):
+    return [c[0][0] for c in conn.cursor.return_value.execute.call_args_list if not c[0][0].strip().startswith("select")]
+
+
+def test_create_with_settings(no_secret, mock_connection, response_holder):
+    set_current_settings(mock_connection, -1)
+    props = {
+                "Username":         USERNAME,
+                "Password":         PASSWORD,
+                "ConnectionLimit":  "20",
+                "Settings":         { "work_mem": "64MB", "Statement_Timeout": "30s" },
+                "DatabaseSettings": { "reporting": { "statement_timeout": "5min" } },
+            }
+    assert user_handler.try_handle(mock_connection, "Create", RESOURCE_TYPE, None, props, {}, response_holder)
+    assert executed_sql(mock_connection) == [
+        f"create user {USERNAME} password '{PASSWORD}' NOCREATEDB NOCREATEROLE",
+        f"alter role {USERNAME} connection limit 20",
+        f"alter role {USERNAME} set statement_timeout = '30s'",
+        f"alter role {USERNAME} set work_mem = '64MB'",
+        f"alter role {USERNAME} in database reporting set statement_timeout = '5min'",
+        ]
+    mock_connection.commit.assert_called_once()
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_update_settings_diffs_against_catalog(no_secret, mock_connection, response_holder):
+    old_props = {
+                "Username":         USERNAME,
+                "ConnectionLimit":  "20",
+                "Settings":         { "work_mem": "64MB", "statement_timeout": "30s", "search_path": "app,public" },
+                "DatabaseSettings": { "reporting": { "statement_timeout": "5min" } },
+            }
+    props = {
+                "Username":         USERNAME,
+                "ConnectionLimit":  "20",
+                "Settings":         { "work_mem": "128MB", "search_path": "app, public" },
+            }
+    set_current_settings(mock_connection, 20,
+                         (None, ["work_mem=64MB", "statement_timeout=30s", "search_path=app, public", "lock_timeout=1s"]),
+                         ("reporting", ["statement_timeout=5min"]))
+    assert user_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, USERNAME, props, old_props, response_holder)
+    # lock_timeout wasn't set by the resource, so isn't reset
+    assert executed_sql(mock_connection) == [
+        f"alter role {USERNAME} reset statement_timeout",
+        f"alter role {USERNAME} set work_mem = '128MB'",
+        f"alter role {USERNAME} in database reporting reset statement_timeout",
+        ]
+    mock_connection.commit.assert_called_once()
+
+
+def test_update_removes_connection_limit(no_secret, mock_connection, response_holder):
+    old_props = {
+                "Username":         USERNAME,
+                "ConnectionLimit":  "20",
+            }
+    props = {
+                "Username":         USERNAME,
+                "Settings":         { "search_path": "app, public" },
+            }
+    set_current_settings(mock_connection, 20)
+    assert user_handler.try_handle(mock_connection, "Update", RESOURCE_TYPE, USERNAME, props, old_props, response_holder)
+    assert executed_sql(mock_connection) == [
+        f"alter role {USERNAME} connection limit -1",
+        f"alter role {USERNAME} set search_path = 'app', 'public'",
+        ]
+
+
+# the following tests verify handling of owned objects on delete
+
+@pytest.fixture
+def other_connections(monkeypatch):
+    # connections to databases other than the current one, by database name
+    opened = {}
+    def connect(connection_info):
+        conn = MagicMock()
+        conn.__enter__.return_value = conn
+        opened[connection_info["database"]] = conn
+        return conn
+    monkeypatch.setattr(util, 'retrieve_pg8000_secret', Mock(return_value={ "host": "localhost", "database": "postgres" }))
+    monkeypatch.setattr(util, 'connect', connect)
+    return opened
+
+
+def executed_on(conn):
+    return [c[0][0] for c in conn.cursor.return_value.execute.call_args_list]
+
+
+def test_delete_reassign_owned(no_secret, mock_connection, response_holder, other_connections):
+    props = {
+                "Username":         USERNAME,
+                "AdminSecretArn":   ADMIN_SECRET_ARN,
+                "OnDelete":         "Reassign",
+                "ReassignOwnedTo":  "app_owner",
+            }
+    mock_connection.cursor.return_value.fetchone.return_value = ("postgres", ["app", "postgres", "reporting"])
+    assert user_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
+    assert set(other_connections.keys()) == { "app", "reporting" }
+    util.retrieve_pg8000_secret.assert_called_with(ADMIN_SECRET_ARN)
+    for conn in other_connections.values():
+        assert executed_on(conn) == [f"reassign owned by {USERNAME} to app_owner", f"drop owned by {USERNAME}"]
+        conn.commit.assert_called_once()
+    assert executed_on(mock_connection)[1:] == [
+        f"reassign owned by {USERNAME} to app_owner",
+        f"drop owned by {USERNAME}",
+        f"drop user {USERNAME}",
+        ]
+    assert mock_connection.commit.call_count == 2
+    assert response_holder == {
+                              "Status": "SUCCESS",
+                              "PhysicalResourceId": USERNAME,
+                              }
+
+
+def test_delete_reassign_owned_defaults_to_admin(no_secret, mock_connection, response_holder, other_connections):
+    props = {
+                "Username":         USERNAME,
+                "OnDelete":         "reassign",
+            }
+    mock_connection.cursor.return_value.fetchone.return_value = ("postgres", ["postgres"])
+    assert user_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
+    assert other_connections == {}
+    assert executed_on(mock_connection)[1:] == [
+        f"reassign owned by {USERNAME} to CURRENT_USER",
+        f"drop owned by {USERNAME}",
+        f"drop user {USERNAME}",
+        ]
+
+
+def test_delete_drop_owned_without_dependencies(no_secret, mock_connection, response_holder, other_connections):
+    props = {
+                "Username":         USERNAME,
+                "OnDelete":         "DropOwned",
+            }
+    mock_connection.cursor.return_value.fetchone.return_value = ("postgres", [])
+    assert user_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
+    assert executed_on(mock_connection)[1:] == [f"drop user {USERNAME}"]
+    assert mock_connection.cursor.return_value.execute.call_args_list[0][0][1] == (USERNAME,)
+    assert response_holder["Status"] == "SUCCESS"
+
+
+def test_delete_drop_owned_failure(monkeypatch, no_secret, mock_connection, response_holder, other_connections):
+    props = {
+                "Username":         USERNAME,
+                "AdminSecretArn":   ADMIN_SECRET_ARN,
+                "OnDelete":         "DropOwned",
+            }
+    mock_connection.cursor.return_value.fetchone.return_value = ("postgres", ["app", "postgres"])
+    monkeypatch.setattr(util, 'connect', Mock(side_effect=Exception("database is not accepting connections")))
+    assert user_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
+    assert f"drop user {USERNAME}" not in executed_on(mock_connection)
+    mock_connection.rollback.assert_called_once()
+    assert response_holder["Status"] == "FAILED"
+    assert "failed for 1 of 2 databases: app: database is not accepting connections" in response_holder["Reason"]
+
+
+def test_delete_invalid_on_delete(no_secret, mock_connection, response_holder):
+    props = {
+                "Username":         USERNAME,
+                "OnDelete":         "Cascade",
+            }
+    assert user_handler.try_handle(mock_connection, "Delete", RESOURCE_TYPE, USERNAME, props, {}, response_holder)
+    mock_connection.cursor.return_value.execute.assert_not_called()
+    assert response_holder["Status"] == "FAILED"
+    assert "OnDelete must be either Reassign or DropOwned" in response_holder["Reason"]
@@ -0,0 +1,116 @@
+""" Unit tests for utility functions that have non-trivial behavior.
+    """
+
+import json
+import pg8000.dbapi
+import pytest
+from unittest.mock import Mock
+
+from cf_postgres import util
+
+
+SECRET_ARN  = "arn:aws:secretsmanager:us-east-1:123456789012:secret:database-1-admin-5z4FyE"
+SECRET      = {
+              "username":   "postgres",
+              "password":   "argle",
+              "host":       "db.example.com",
+              "port":       5432,
+              "dbname":     "postgres",
+              }
+
+
+################################################################################
+## fixtures
+################################################################################
+
+@pytest.fixture
+def mock_boto3(monkeypatch):
+    util.reset_caches()
+    client = Mock()
+    client.get_secret_value.return_value = { "SecretString": json.dumps(SECRET) }
+    mock = Mock(return_value=client)
+    monkeypatch.setattr(util.boto3, 'client', mock)
+    yield mock
+    util.reset_caches()
+
+
+################################################################################
+## testcases
+################################################################################
+
+def test_aws_client_is_cached(mock_boto3):
+    assert util.aws_client('secretsmanager') is util.aws_client('secretsmanager')
+    mock_boto3.assert_called_once_with('secretsmanager')
+
+
+def test_pg8000_secret_is_cached(mock_boto3):
+    first = util.retrieve_pg8000_secret(SECRET_ARN)
+    first['database'] = "modified by caller"
+    second = util.retrieve_pg8000_secret(SECRET_ARN)
+    assert second['database'] == "postgres"
+    assert second['password'] == "argle"
+    mock_boto3.return_value.get_secret_value.assert_called_once_with(SecretId=SECRET_ARN)
+
+
+def test_pg8000_secret_cache_invalidated(mock_boto3):
+    util.retrieve_pg8000_secret(SECRET_ARN)
+    util.invalidate_cached_secret(SECRET_ARN)
+    util.retrieve_pg8000_secret(SECRET_ARN)
+    assert mock_boto3.return_value.get_secret_value.call_count == 2
+
+
+def test_pg8000_secret_cache_disabled(monkeypatch, mock_boto3):
+    monkeypatch.setenv("CF_POSTGRES_SECRET_CACHE_TTL", "0")
+    util.retrieve_pg8000_secret(SECRET_ARN)
+    util.retrieve_pg8000_secret(SECRET_ARN)
+    assert mock_boto3.return_value.get_secret_value.call_count == 2
+
+
+def test_pg8000_secret_cache_expires(monkeypatch, mock_boto3):
+    clock = Mock(return_value=1000.0)
+    monkeypatch.setattr(util.time, 'time', clock)
+    util.retrieve_pg8000_secret(SECRET_ARN)
+    clock.return_value = 1299.0
+    util.retrieve_pg8000_secret(SECRET_ARN)
+    assert mock_boto3.return_value.get_secret_value.call_count == 1
+    clock.return_value = 1301.0
+    util.retrieve_pg8000_secret(SECRET_ARN)
+    assert mock_boto3.return_value.get_secret_value.call_count == 2
+
+
+def test_json_secret_is_not_cached(mock_boto3):
+    # user secrets may change between requests, so are always retrieved
+    util.retrieve_json_secret(SECRET_ARN)
+    util.retrieve_json_secret(SECRET_ARN)
+    assert mock_boto3.return_value.get_secret_value.call_count == 2
+
+
+def test_open_connection_retries_after_authentication_failure(monkeypatch):
+    conn = Mock()
+    connect_mock = Mock(side_effect=[pg8000.dbapi.DatabaseError({'C': '28P01', 'M': 'password authentication failed'}), conn])
+    retrieve_mock = Mock(side_effect=[{ "password": "old" }, { "password": "new" }])
+    invalidate_mock = Mock()
+    monkeypatch.setattr(util, 'connect', connect_mock)
+    monkeypatch.setattr(util, 'retrieve_pg8000_secret', retrieve_mock)
+    monkeypatch.setattr(util, 'invalidate_cached_secret', invalidate_mock)
+    assert util.open_connection(SECRET_ARN) == conn
+    invalidate_mock.assert_called_once_with(SECRET_ARN)
+    assert connect_mock.call_args_list[1][0][0] == { "password": "new" }
+
+
+def test_open_connection_does_not_retry_other_failures(monkeypatch):
+    connect_mock = Mock(side_effect=pg8000.dbapi.DatabaseError({'C': '3D000', 'M': 'database does not exist'}))
+    monkeypatch.setattr(util, 'connect', connect_mock)
+    monkeypatch.setattr(util, 'retrieve_pg8000_secret', Mock(return_value={}))
+    with pytest.raises(pg8000.dbapi.DatabaseError):
+        util.open_connection(SECRET_ARN)
+    connect_mock.assert_called_once()
+
+
+def test_open_connection_to_other_database(monkeypatch):
+    connect_mock = Mock(side_effect=[pg8000.dbapi.DatabaseError({'C': '28000', 'M': 'no pg_hba.conf entry'}), Mock()])
+    monkeypatch.setattr(util, 'connect', connect_mock)
+    monkeypatch.setattr(util, 'retrieve_pg8000_secret', Mock(side_effect=lambda arn: { "database": "postgres" }))
+    monkeypatch.setattr(util, 'invalidate_cached_secret', Mock())
+    util.open_connection(SECRET_ARN, "reporting")
+    assert [c[0][0] for c in connect_mock.call_args_list] == [{ "database": "reporting" }, { "database": "reporting" }]